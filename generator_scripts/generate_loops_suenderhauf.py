@@ -3,9 +3,11 @@
 import argparse
 import sys
 import traceback
-from subprocess import check_call
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "scripts"))
+from scheduler import Scheduler, Job
+
 # as in Niko Suenderhauf's thesis, generate a number of outlier loops, to up 1000.
 # #outlier schedule (as per section 6.5 of his thesis) is: 50, 100, 200, 300, 400, 500, 750, 10000
 # for each of the four policies ( {nongrouped, grouped}x{random, local})
@@ -42,6 +44,7 @@ if __name__ == "__main__":
 	parser.add_argument("--outlier-format", default='%(policy_index)02d_%(n_outliers)05d_%(trial)02d.outliers', help="Format of outlier files, keys to be used: policy_index, n_outliers, trial. Default: '%%(policy_index)02d_%%(n_outliers)05d_%%(trial)02d.outliers'")
 	parser.add_argument("--seed-format", default='%(policy_index)02d%(n_outliers)05d%(trial)02d', help="Like --outlier-format, but used to generate a seed number. Same keys as above. Default: '%%(policy_index)02d%%(n_outliers)05d%%(trial)02d'")
 	parser.add_argument("--loop-information", type=float, nargs=2, default=[42,42], help="Information values for generated outlier loops. Default: [42,42]")
+	parser.add_argument("--jobs", type=int, default=1, help="Number of outlier_generator calls at the same time. A call only waits for the one whose outliers it extends (--previous-outliers), so different policies and trials are generated concurrently. Output files are the same as with a single job. Default: 1")
 
 
 	args = parser.parse_args()
@@ -58,6 +61,9 @@ if __name__ == "__main__":
 	
 	
 
+	scheduler = Scheduler(jobs=args.jobs, stop_on_failure=True)
+	chains = dict() # last job of every (policy, trial)
+
 	try:
 
 		for no in range(0,len(n_outliers)):
@@ -68,16 +74,22 @@ if __name__ == "__main__":
 					commandline +=  policies[np]
 					commandline += ['--false-loops', str(n_outliers[no]), '--seed', args.seed_format % cur ]
 					commandline += ['--loop-variance-translation', str(1.0/(args.loop_information[0])), '--loop-variance-rotation', str(1.0/(args.loop_information[1])) ]
+					after = []
 					if no > 0:
 						prev = cur
 						prev['n_outliers'] = n_outliers[no-1]
 						commandline += ['--previous-outliers', os.path.normpath(args.output_directory + "/" + args.outlier_format % prev )]
+						after = [chains[(np, nt)]]
+
+					chains[(np, nt)] = scheduler.add( Job(commandline[2], commandline, after=after, usage_log=commandline[2] + ".usage.jsonl") )
 
-					print "*************************"
-					print " ".join(commandline)
-					check_call(commandline, stdout=sys.stdout, stderr=sys.stderr)
-		
+		scheduler.run()
 
 	except:
 		traceback.print_exc(file=sys.stderr)
 		exit(100)
+
+	scheduler.summary()
+
+	if scheduler.failed():
+		exit(100)
@@ -3,8 +3,10 @@
 import argparse
 import sys
 import traceback
-from subprocess import check_call
 import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "scripts"))
+from scheduler import Scheduler, Job
 from math import floor
 
 # as in Olson and Agarwal's IJRR paper, generate a number of outlier loops, to up 4000.
@@ -43,6 +45,7 @@ if __name__ == "__main__":
 	parser.add_argument("--outlier-format", default='%(n_outliers)02d_%(n_hypercomp)02d_%(trial)03d.outliers', help="Format of outlier files, keys to be used: n_outliers, n_hypercomp, trial. Default: '%%(n_outliers)02d_%%(n_hypercomp)02d_%%(trial)03d.outliers'")
 	parser.add_argument("--seed-format", default='1%(n_outliers)02d%(n_hypercomp)02d%(trial)03d', help="Like --outlier-format, but used to generate a seed number. Same keys as above. Default: '1%%(n_outliers)02d%%(n_hypercomp)02d%%(trial)03d'")
 	parser.add_argument("--loop-information", type=float, nargs=2, default=[42,42], help="Information values for generated outlier loops. Default: [42,42]")
+	parser.add_argument("--jobs", type=int, default=1, help="Number of outlier_generator calls at the same time. A call only waits for the one whose outliers it extends (--previous-outliers), so different numbers of components and trials are generated concurrently. Output files are the same as with a single job. Default: 1")
 
 
 	args = parser.parse_args()
@@ -59,6 +62,9 @@ if __name__ == "__main__":
 	
 	loops = count_loop_edges(args.original)
 
+	scheduler = Scheduler(jobs=args.jobs, stop_on_failure=True)
+	chains = dict() # last job of every (number of components, trial)
+
 	try:
 
 		for no in range(0,len(n_outliers_ratio)):
@@ -70,16 +76,22 @@ if __name__ == "__main__":
 					commandline += ["0" for i in range(0,n_hypercomp[nm]-2)] + [str(int(floor(n_outliers_ratio[no]*loops)))]
 					commandline += ['--seed', args.seed_format % cur ]
 					commandline += ['--loop-variance-translation', str(1.0/(args.loop_information[0])), '--loop-variance-rotation', str(1.0/(args.loop_information[1])) ]
+					after = []
 					if no > 0:
 						prev = cur
 						prev['n_outliers'] = no-1
 						commandline += ['--previous-outliers', os.path.normpath(args.output_directory + "/" + args.outlier_format % prev )]
+						after = [chains[(nm, nt)]]
+
+					chains[(nm, nt)] = scheduler.add( Job(commandline[2], commandline, after=after, usage_log=commandline[2] + ".usage.jsonl") )
 
-					print "*************************"
-					print " ".join(commandline)
-					check_call(commandline, stdout=sys.stdout, stderr=sys.stderr)
-		
+		scheduler.run()
 
 	except:
 		traceback.print_exc(file=sys.stderr)
 		exit(100)
+
+	scheduler.summary()
+
+	if scheduler.failed():
+		exit(100)
@@ -3,9 +3,11 @@
 import argparse
 import sys
 import traceback
-from subprocess import check_call
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "scripts"))
+from scheduler import Scheduler, Job
+
 
 n_mogcomps = [
 	[1],
@@ -32,6 +34,7 @@ if __name__ == "__main__":
     parser.add_argument("--outlier-format", default='%(n_mogcomp)01d_%(trial)02d.outliers', help="Format of outlier files, keys to be used: n_mogcomp, trial. Default: '%%(n_mogcomp)01d_%%(trial)02d.outliers'")
     parser.add_argument("--seed-format", default='1%(n_mogcomp)02d%(trial)03d', help="Like --outlier-format, but used to generate a seed number. Same keys as above. Default: '1%%(n_mogcomp)02d%%(trial)03d'")
     parser.add_argument("--motion-information", type=float, nargs=2, default=[10,200], help="Information values for generated outlier loops. Default: [10,200]")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of outlier_generator calls at the same time. A call only waits for the one whose outliers it extends (--previous-outliers), so different trials are generated concurrently. Output files are the same as with a single job. Default: 1")
 
 
     args = parser.parse_args()
@@ -46,6 +49,9 @@ if __name__ == "__main__":
     elif not os.path.exists(args.output_directory):
         os.makedirs(args.output_directory)
 
+    scheduler = Scheduler(jobs=args.jobs, stop_on_failure=True)
+    chains = dict() # last job of every trial
+
     try:
 
         for nm in range(0,len(n_mogcomps)):
@@ -58,16 +64,22 @@ if __name__ == "__main__":
                 commandline += ['--motion-variance-translation', str(1.0/(args.motion_information[0])), '--motion-variance-rotation', str(1.0/(args.motion_information[1])) ]
                 commandline += ['--first-motion-wins']
                 commandline += ['--inflation-factor', '1.5']
+                after = []
                 if nm > 0:
                     prev = cur
                     prev['n_mogcomp'] = nm-1
                     commandline += ['--previous-outliers', os.path.normpath(args.output_directory + "/" + args.outlier_format % prev )]
+                    after = [chains[nt]]
+
+                chains[nt] = scheduler.add( Job(commandline[2], commandline, after=after, usage_log=commandline[2] + ".usage.jsonl") )
 
-                print "*************************"
-                print " ".join(commandline)
-                check_call(commandline, stdout=sys.stdout, stderr=sys.stderr)
-		
+        scheduler.run()
 
     except:
         traceback.print_exc(file=sys.stderr)
         exit(100)
+
+    scheduler.summary()
+
+    if scheduler.failed():
+        exit(100)
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import argparse
+import sys
+import os
+import numpy as np
+from multiprocessing import cpu_count
+from utils import DefaultHelpParser
+import g2o_timing as T
+
+def is_saved_table(path):
+	return os.path.isfile(path) and os.path.splitext(path)[1] in [".sqlite", ".db", ".npz"]
+
+def nanstat(f, values, *args):
+	values = values[~np.isnan(values)]
+	if len(values) == 0:
+		return float('nan')
+	return f(values, *args)
+
+if __name__ == "__main__":
+
+	parser = DefaultHelpParser(description='Read the timing files g2o writes with -saveTiming (run_g2o.py puts one next to every optimized graph) and print statistics per configuration: runs, iterations, time per iteration, total time and time to converge. The table of all iterations can be saved to SQLite or .npz and read again instead of the timing files.')
+
+	parser.add_argument("inputs", nargs="+", help="Directories to search for timing files, timing files, or tables saved with --save (.sqlite, .db, .npz).")
+	parser.add_argument("--pattern", default="*.time", help="File name pattern of timing files in directories. Default: *.time")
+	parser.add_argument("--config", help="Regular expression matched against the path of every timing file, the configuration of a run are the groups it matches (or the whole match). Runs that do not match are left out. Default: the directory of the file relative to the input directory.")
+	parser.add_argument("--jobs", type=int, default=cpu_count(), help="Number of processes reading timing files. Default: number of cpus (%d)" % cpu_count())
+	parser.add_argument("--tolerance", type=float, default=1e-3, help="A run converged when chi2 is within this relative tolerance of its final value. Default: 1e-3")
+	parser.add_argument("--percentiles", type=float, nargs="+", default=[50, 90], help="Percentiles of total time and time to converge per configuration. Default: 50 90")
+	parser.add_argument("--save", help="Save the table of all iterations (with per run statistics) to this file, SQLite unless it ends in .npz.")
+	parser.add_argument("-o", "--output", type=argparse.FileType('w'), default=sys.stdout, help="Output file for the statistics. Default: stdout")
+
+	args = parser.parse_args()
+
+	tables = []
+	configs = []
+
+	for path in args.inputs:
+		if not os.path.exists(path):
+			print("ERROR: '%s' does not exist!" % path, file=sys.stderr)
+			exit(1)
+
+		if is_saved_table(path):
+			if path.endswith(".npz"):
+				(table, c) = T.load_npz(path)
+			else:
+				(table, c) = T.load_sqlite(path)
+
+			if args.config:
+				c = [ T.configuration(f, None, args.config) for f in table.files ]
+
+			tables.append(table)
+			configs.extend(c)
+			continue
+
+		if os.path.isdir(path):
+			root = path
+			files = T.find_timing_files(path, args.pattern)
+		else:
+			root = os.path.dirname(path)
+			files = [path]
+
+		c = [ T.configuration(f, root, args.config) for f in files ]
+		files = [ f for f,cf in zip(files, c) if cf is not None ]
+		c = [ cf for cf in c if cf is not None ]
+
+		tables.append( T.read_timing_files(files, args.jobs) )
+		configs.extend(c)
+
+	table = T.concatenate_tables(tables)
+
+	print("read %d iterations of %d runs" % (len(table), len(table.files)), file=sys.stderr)
+
+	if args.save:
+		if args.save.endswith(".npz"):
+			T.save_npz(table, args.save, configs)
+		else:
+			T.save_sqlite(table, args.save, configs, args.tolerance)
+
+	stats = table.run_stats(args.tolerance)
+	(starts, ends) = table.bounds()
+
+	header = ["config", "runs", "iterations", "time/iteration"]
+	header += [ "total_time_mean" ] + [ "total_time_p%g" % p for p in args.percentiles ]
+	header += [ "converge_mean" ] + [ "converge_p%g" % p for p in args.percentiles ]
+	header += [ "final_chi2_median" ]
+	print("\t".join(header), file=args.output)
+
+	configs = np.array([ c or "" for c in configs ], dtype=object)
+	for config in sorted(set(configs)):
+		runs = np.nonzero(configs == config)[0]
+		rows = np.concatenate([ np.arange(starts[r], ends[r]) for r in runs ])
+
+		total = stats["total_time"][runs]
+		converge = stats["time_to_converge"][runs]
+
+		line = [ config, str(len(runs)), "%g" % np.mean(stats["iterations"][runs]), "%g" % (np.mean(table.time[rows]) if len(rows) else float('nan')) ]
+		line += [ "%g" % np.mean(total) ] + [ "%g" % p for p in np.percentile(total, args.percentiles) ]
+		line += [ "%g" % nanstat(np.mean, converge) ] + [ "%g" % nanstat(np.percentile, converge, p) for p in args.percentiles ]
+		line += [ "%g" % nanstat(np.median, stats["final_chi2"][runs]) ]
+		print("\t".join(line), file=args.output)
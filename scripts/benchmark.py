@@ -0,0 +1,425 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import glob
+import ctypes
+import ctypes.util
+import platform
+import resource
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+import numpy as np
+
+from utils import DefaultHelpParser
+import graph as G
+import converters
+import compute_error
+
+# Benchmarks of the pipeline stages on the bundled datasets.
+#
+# Every (dataset, stage, variant) runs in a forked child, which parses what the
+# stage needs, runs it repeat times and reports the times. Peak RSS is the
+# child's ru_maxrss from os.wait4 (it starts out with the memory of this
+# process, reported as base_rss_kb). Work that only prepares a repetition
+# (e.g. copying the parsed graph, so caches on the edges start out empty) is
+# not timed.
+#
+# Stages that read files run warm (files read once before) and cold (files
+# evicted from the page cache with posix_fadvise before every repetition). The
+# outliers are random, written by write_random_outliers with a fixed seed.
+
+datasets_dir = os.path.normpath( os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "datasets") )
+
+def count_lines(path):
+	with open(path, 'r') as f:
+		return sum([ 1 for l in f ])
+
+line_counts = dict()
+def count_lines_cached(path):
+	if not path in line_counts:
+		line_counts[path] = count_lines(path)
+	return line_counts[path]
+
+
+# random outliers for g in the outlier file format, n batches: a fraction of
+# them adds an outlier motion to an existing loop edge, the others are new
+# false loops with a null hypothesis and one to three targets
+def write_random_outliers(g, f, n, seed=0, inlier_fraction=0.3):
+	rng = np.random.RandomState(seed)
+
+	ids = np.array(sorted(g.V.keys()))
+	loops = sorted([ (e.reference, e.inlier_target) for e in g.E.values() if e.has_inlier and abs(e.reference - e.inlier_target) > 1 ])
+
+	if g.dim == 2:
+		inf = " ".join(["42", "0", "0", "42", "0", "42"])
+	else:
+		inf = " ".join([ "42" if i == j else "0" for i in range(6) for j in range(i, 6) ])
+
+	def motion(ref, target):
+		if g.dim == 2:
+			mean = np.concatenate([ rng.uniform(-10, 10, 2), rng.uniform(-np.pi, np.pi, 1) ])
+		else:
+			q = rng.normal(size=4)
+			mean = np.concatenate([ rng.uniform(-10, 10, 3), q / np.linalg.norm(q) ])
+		return "%s %d %d %s %s" % (g.edge_tag, ref, target, " ".join([ repr(float(x)) for x in mean ]), inf)
+
+	used = set()
+	for k in range(n):
+		if loops and rng.uniform() < inlier_fraction:
+			(ref, inlier) = loops[rng.randint(len(loops))]
+			if (ref, inlier) in used:
+				continue
+			used.add( (ref, inlier) )
+
+			target = int(ids[rng.randint(len(ids))])
+			print("LOOP_OUTLIER_BATCH %d 1 1 %d" % (ref, inlier), file=f)
+			print("MOTION_OUTLIER_BATCH %d 1.0" % target, file=f)
+			print("MOTION_WEIGHT 1.0", file=f)
+			print(motion(ref, target), file=f)
+			print("MOTION_OUTLIER_BATCH_END", file=f)
+			print("LOOP_OUTLIER_BATCH_END", file=f)
+			continue
+
+		ref = int(ids[rng.randint(len(ids))])
+		targets = sorted(set([ int(ids[rng.randint(len(ids))]) for i in range(rng.randint(1, 4)) ]) - set([ref]))
+		if not targets:
+			continue
+
+		print("LOOP_OUTLIER_BATCH %d 1 0 -1" % ref, file=f)
+		for t in targets:
+			print("MOTION_OUTLIER_BATCH %d %r" % (t, float(rng.uniform(0.5, 2.0))), file=f)
+			for m in range(rng.randint(1, 3)):
+				print("MOTION_WEIGHT %r" % float(rng.uniform(0.5, 2.0)), file=f)
+				print(motion(ref, t), file=f)
+			print("MOTION_OUTLIER_BATCH_END", file=f)
+		print("LOOP_OUTLIER_BATCH_END", file=f)
+
+
+libc = None
+
+# drops the pages of the files from the page cache, returns False if that is not possible
+def evict(paths):
+	global libc
+	if libc is None:
+		try:
+			libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+			libc.posix_fadvise
+		except (OSError, AttributeError):
+			libc = False
+	if not libc:
+		return False
+
+	ok = True
+	for path in paths:
+		fd = os.open(path, os.O_RDONLY)
+		try:
+			os.fsync(fd)
+			# POSIX_FADV_DONTNEED
+			ok = libc.posix_fadvise(fd, ctypes.c_longlong(0), ctypes.c_longlong(0), 4) == 0 and ok
+		finally:
+			os.close(fd)
+	return ok
+
+def warm(paths):
+	for path in paths:
+		with open(path, 'rb') as f:
+			while f.read(1 << 20):
+				pass
+
+
+class Dataset(object):
+	def __init__(self, name, graph, reference, outliers):
+		self.name = name
+		self.graph = graph
+		self.reference = reference
+		self.outliers = outliers
+
+		self.base = None
+
+	# parsed once per child, stages copy it
+	def parsed(self):
+		if self.base is None:
+			with open(self.graph, 'r') as f:
+				self.base = G.readg2o(f)
+		return self.base
+
+	def with_outliers(self):
+		g = G.Graph(self.parsed())
+		with open(self.outliers, 'r') as f:
+			g.readExtraOutliers(f)
+		return g
+
+# every dataset file: <name>/data.g2o as name, <name>/data_XX.g2o as name/data_XX.
+# groundtruth.g2o next to it is the reference for compute_error, the dataset itself otherwise.
+def find_datasets(directory):
+	found = []
+	for d in sorted(os.listdir(directory)):
+		files = sorted(glob.glob(os.path.join(directory, d, "data*.g2o")))
+		reference = os.path.join(directory, d, "groundtruth.g2o")
+		for path in files:
+			name = d if len(files) == 1 else d + "/" + os.path.splitext(os.path.basename(path))[0]
+			found.append( (name, path, reference if os.path.exists(reference) else path) )
+	return found
+
+
+# A stage is (files it reads, prepare, run): prepare(dataset) is called before
+# every repetition and not timed, run(dataset, state) is timed and returns the
+# number of lines and edges it processed (None if it does not process any).
+
+def run_read(ds, state):
+	with open(ds.graph, 'r') as f:
+		g = G.readg2o(f)
+	return (count_lines_cached(ds.graph), len(g.E))
+
+def run_read_outliers(ds, g):
+	with open(ds.outliers, 'r') as f:
+		g.readExtraOutliers(f)
+	return (count_lines_cached(ds.outliers), len(g.E))
+
+def run_write(ds, g):
+	with open(os.devnull, 'w') as f:
+		g.writeg2o(f)
+	return (len(g.V) + len(g.E) + len(g.fixed), len(g.E))
+
+def convert_stage(fmt):
+	def prepare(ds):
+		g = ds.with_outliers()
+		return (g, converters.make_output(g, fmt))
+
+	def run(ds, state):
+		(g, output) = state
+		with open(os.devnull, 'w') as f:
+			g.writeg2o(f, output)
+		return (None, len(g.E))
+
+	return (lambda ds: [], prepare, run)
+
+def run_init_seq(ds, g):
+	g.setNonfixedPosesToZero()
+	g.initializePosesSequential()
+	return (None, len(g.E))
+
+def run_init_bfs(ds, g):
+	g.setNonfixedPosesToZero()
+	g.intializePosesBFS(False)
+	return (None, len(g.E))
+
+def prepare_compute_error(ds):
+	if not "errs" in compute_error.worker:
+		with open(ds.reference, 'r') as f:
+			(ids, poses) = G.readg2oVertices(f)
+		compute_error.init_worker( dict(zip(ids.tolist(), poses)) )
+
+def run_compute_error(ds, state):
+	compute_error.evaluate_file(ds.graph)
+	return (count_lines_cached(ds.graph), None)
+
+stages = [
+	("read",          (lambda ds: [ds.graph],    lambda ds: None,                 run_read)),
+	("read_outliers", (lambda ds: [ds.outliers], lambda ds: G.Graph(ds.parsed()), run_read_outliers)),
+	("write",         (lambda ds: [],            lambda ds: G.Graph(ds.parsed()), run_write)),
+	("init_seq",      (lambda ds: [],            lambda ds: ds.with_outliers(),   run_init_seq)),
+	("init_bfs",      (lambda ds: [],            lambda ds: ds.with_outliers(),   run_init_bfs)),
+	("compute_error", (lambda ds: [ds.graph],    prepare_compute_error,           run_compute_error)),
+] + [ ("convert_" + fmt, convert_stage(fmt)) for fmt in sorted(converters.formats.keys()) ]
+
+
+# redirects stdout and stderr (also of child processes) to /dev/null, returns
+# the previous ones for restore_output
+def discard_output():
+	sys.stdout.flush()
+	sys.stderr.flush()
+	saved = (os.dup(1), os.dup(2))
+	devnull = os.open(os.devnull, os.O_WRONLY)
+	os.dup2(devnull, 1)
+	os.dup2(devnull, 2)
+	os.close(devnull)
+	return saved
+
+def restore_output(saved):
+	sys.stdout.flush()
+	sys.stderr.flush()
+	for (fd, s) in zip([1, 2], saved):
+		os.dup2(s, fd)
+		os.close(s)
+
+@contextmanager
+def quiet(enabled=True):
+	saved = discard_output() if enabled else None
+	try:
+		yield
+	finally:
+		if saved:
+			restore_output(saved)
+
+# runs a stage in this process, returns the result record
+def measure(ds, stage, variant, repeat):
+	(files, prepare, run) = dict(stages)[stage]
+	files = files(ds)
+
+	base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	times = []
+	counts = (None, None)
+	evicted = None
+	if variant == "warm":
+		warm(files)
+
+	for r in range(repeat):
+		state = prepare(ds)
+		if variant == "cold":
+			evicted = evict(files)
+
+		start = timer()
+		counts = run(ds, state)
+		times.append(timer() - start)
+
+		state = None
+
+	median = float(np.median(times))
+	result = dict(dataset=ds.name, stage=stage, variant=variant, repeat=repeat, times=times, min=min(times), median=median, mean=float(np.mean(times)), base_rss_kb=base_rss)
+	(result["lines"], result["edges"]) = counts
+	if counts[0] is not None:
+		result["lines_per_s"] = counts[0] / median if median > 0 else None
+	if counts[1] is not None:
+		result["edges_per_s"] = counts[1] / median if median > 0 else None
+	if evicted is not None:
+		result["evicted"] = evicted
+	return result
+
+# calls f(*args) in a forked child, returns (result, error, peak RSS of the
+# child in KB): the result has to be JSON serializable, error is None or what
+# went wrong. Unless verbose, what the child prints (e.g. warnings about the
+# dataset) is discarded.
+def call_forked(f, args, verbose=False):
+	(r, w) = os.pipe()
+	sys.stdout.flush()
+	pid = os.fork()
+
+	if pid == 0:
+		os.close(r)
+		if not verbose:
+			discard_output()
+		try:
+			message = dict(result=f(*args))
+		except Exception as e:
+			message = dict(error="%s: %s" % (type(e).__name__, e))
+		with os.fdopen(w, 'w') as out:
+			out.write(json.dumps(message))
+		os._exit(0)
+
+	os.close(w)
+	with os.fdopen(r, 'r') as inp:
+		data = inp.read()
+	(pid, status, usage) = os.wait4(pid, 0)
+
+	if not data:
+		return (None, "process died with status %d" % status, usage.ru_maxrss)
+
+	message = json.loads(data)
+	return (message.get("result"), message.get("error"), usage.ru_maxrss)
+
+# runs measure() in a forked child, adds its peak RSS
+def measure_forked(ds, stage, variant, repeat, verbose=False):
+	(result, error, peak_rss_kb) = call_forked(measure, (ds, stage, variant, repeat), verbose)
+	if error:
+		return dict(dataset=ds.name, stage=stage, variant=variant, error=error)
+
+	result["peak_rss_kb"] = peak_rss_kb
+	return result
+
+def metadata():
+	meta = dict(date=time.strftime("%Y-%m-%dT%H:%M:%S"), host=platform.node(), python=platform.python_version(), numpy=np.__version__, argv=sys.argv)
+	try:
+		with open(os.devnull, 'w') as devnull:
+			meta["commit"] = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.realpath(__file__)), stderr=devnull).strip()
+	except (OSError, subprocess.CalledProcessError):
+		pass
+	return meta
+
+def rate(x):
+	return "" if x is None else "%.0f" % x
+
+if __name__ == "__main__":
+
+	parser = DefaultHelpParser(description='Benchmark the pipeline stages (reading graphs and outliers, writing, every converter, both initializations, compute_error) on the bundled datasets. Every stage runs in a separate process, repeated, warm and with cold page cache for stages that read files. Results (times, lines/s, edges/s, peak RSS) are saved as JSON.')
+
+	parser.add_argument("-o", "--output", default="benchmark.json", help="Output JSON file. Default: benchmark.json")
+	parser.add_argument("--datasets", nargs="+", help="Names of the datasets to run (e.g. intel ring block-world/data_01), default: all in %s" % datasets_dir)
+	parser.add_argument("--datasets-dir", default=datasets_dir, help="Directory with the datasets, one subdirectory each with data*.g2o and optionally groundtruth.g2o.")
+	parser.add_argument("--stages", nargs="+", choices=[ s for s,d in stages ], help="Stages to run, default: all")
+	parser.add_argument("--variants", nargs="+", choices=["warm", "cold"], default=["warm", "cold"], help="Page cache variants of stages that read files. Default: warm cold")
+	parser.add_argument("--repeat", type=int, default=5, help="Repetitions of every stage. Default: 5")
+	parser.add_argument("--outlier-ratio", type=float, default=0.1, help="Number of random outlier batches as a fraction of the edges of a dataset. Default: 0.1")
+	parser.add_argument("--seed", type=int, default=0, help="Seed of the random outliers. Default: 0")
+	parser.add_argument("--verbose", default=False, action='store_true', help="Show what the stages print, e.g. warnings about the datasets.")
+	parser.add_argument("--compare", help="Previous benchmark JSON file, prints the ratio of median times (new / old).")
+
+	args = parser.parse_args()
+
+	found = find_datasets(args.datasets_dir)
+	if args.datasets:
+		unknown = set(args.datasets) - set([ n for n,p,r in found ])
+		if unknown:
+			print("ERROR: unknown datasets: %s, known are: %s" % (", ".join(sorted(unknown)), ", ".join([ n for n,p,r in found ])))
+			exit(1)
+		found = [ d for d in found if d[0] in args.datasets ]
+
+	selected = [ (s, d) for s,d in stages if not args.stages or s in args.stages ]
+
+	tmp = tempfile.mkdtemp(prefix="benchmark-")
+	results = []
+
+	print("\t".join(["dataset", "stage", "variant", "median s", "min s", "lines/s", "edges/s", "peak rss MB"]))
+	try:
+		for (name, path, reference) in found:
+			with open(path, 'r') as f, quiet(not args.verbose):
+				g = G.readg2o(f)
+			outliers = os.path.join(tmp, name.replace("/", "_") + ".outliers")
+			with open(outliers, 'w') as f:
+				write_random_outliers(g, f, max(1, int(args.outlier_ratio * len(g.E))), args.seed)
+			g = None
+
+			ds = Dataset(name, path, reference, outliers)
+
+			for (stage, (files, prepare, run)) in selected:
+				variants = args.variants if files(ds) else ["warm"]
+				for variant in variants:
+					result = measure_forked(ds, stage, variant, args.repeat, args.verbose)
+					results.append(result)
+
+					if "error" in result:
+						print("ERROR: %s %s %s: %s" % (name, stage, variant, result["error"]))
+						continue
+
+					print("\t".join([ name, stage, variant, "%.4f" % result["median"], "%.4f" % result["min"], rate(result.get("lines_per_s")), rate(result.get("edges_per_s")), "%.1f" % (result["peak_rss_kb"] / 1024.0) ]))
+					sys.stdout.flush()
+	finally:
+		for f in os.listdir(tmp):
+			os.remove(os.path.join(tmp, f))
+		os.rmdir(tmp)
+
+	with open(args.output, 'w') as f:
+		json.dump(dict(meta=metadata(), results=results), f, indent=1, sort_keys=True)
+
+	if args.compare:
+		with open(args.compare, 'r') as f:
+			old = dict([ ((r["dataset"], r["stage"], r["variant"]), r) for r in json.load(f)["results"] if "median" in r ])
+
+		print("*************************")
+		print("\t".join(["dataset", "stage", "variant", "old median s", "new median s", "new/old"]))
+		for r in results:
+			key = (r["dataset"], r["stage"], r["variant"])
+			if "median" in r and key in old:
+				print("\t".join([ r["dataset"], r["stage"], r["variant"], "%.4f" % old[key]["median"], "%.4f" % r["median"], "%.2f" % (r["median"] / old[key]["median"]) ]))
+
+	if any([ "error" in r for r in results ]):
+		exit(4)
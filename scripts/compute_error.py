@@ -11,77 +11,175 @@ import math
 import graph as G
 from utils import DefaultHelpParser
 import numpy as np
+import streaming_stats as ss
+from result_cache import ResultCache, file_hash
+import shared_graph
+from multiprocessing import Pool
+import itertools
 
+# bump whenever the way errors are computed changes, invalidates cached results
+METRIC_VERSION = 1
+
+# ref maps vertex ids to reference poses
 class error_calc:
 	def __init__(self,ref):
 		self.clear()
 		self.ref = ref
 
 	def clear(self):
-		self.errors_tr = []
-		self.errors_rot = []
+		self.n = 0
+		self.sum_tr = 0.0
+		self.sum_rot = 0.0
 
 	def calcRMSE(self):
-		return ( math.sqrt( sum(self.errors_tr)/float(len(self.errors_tr)-1) ), math.sqrt( sum(self.errors_rot)/float(len(self.errors_rot)-1) ) )
+		return ( math.sqrt( self.sum_tr/float(self.n-1) ), math.sqrt( self.sum_rot/float(self.n-1) ) )
 
 	def calcMSE(self):
-		return ( sum(self.errors_tr)/float(len(self.errors_tr)-1), sum(self.errors_rot)/float(len(self.errors_rot)-1) )
+		return ( self.sum_tr/float(self.n-1), self.sum_rot/float(self.n-1) )
 
 	def __call__(self,i,v):
-		if not i in self.ref.V:
+		if not i in self.ref:
 			print("ERROR: vertex",i,"not in reference file!", file=sys.stderr)
 			return
 
-		v_ref = self.ref.V[i]
+		v_ref = self.ref[i]
 		(err_tr, err_rot) = pu.errors( v_ref, v )
 
-		self.errors_tr.append(err_tr)
-		self.errors_rot.append(err_rot)
+		self.n += 1
+		self.sum_tr += err_tr
+		self.sum_rot += err_rot
+
+# per process state for evaluate_file()
+worker = dict()
+
+def init_worker(ref):
+	worker["errs"] = error_calc(ref)
+	worker["ref_ids"] = set(ref)
+
+# attaches to the reference poses shared by the parent process
+def init_shared_worker(handle):
+	worker["arrays"] = handle.attach()
+	init_worker( worker["arrays"].vertexPoses() )
+
+def evaluate_file(graphfile):
+	errs = worker["errs"]
+
+	with open(graphfile, 'r') as f:
+		(ids, poses) = G.readg2oVertices(f, worker["ref_ids"])
+
+	errs.clear()
+	for i,v in zip(ids.tolist(), poses):
+		errs(i,v)
+
+	return errs.calcMSE()
 
 if __name__ == "__main__":
 
 	parser = DefaultHelpParser(description='Compute RMSE errors for translation and rotation (based on angle only) for a set of g2o graph files, given a reference g2o graph file (e.g. ground truth).')
 
 	parser.add_argument("reference", type=argparse.FileType('r'), help = "Path to the reference (in g2o format).")
-	parser.add_argument("graphs", nargs="+", help = "Filenames or glob patterns matching g2o files to be processed.")
+	parser.add_argument("graphs", nargs="*", help = "Filenames or glob patterns matching g2o files to be processed.")
 	parser.add_argument("-o","--output", type=argparse.FileType('a+'), help="Output file to append the errors to. Default: stdout")
 	parser.add_argument("--5-summary", dest="summary", default=False, action='store_true', help="If given, calculate min,lower quartile,median,upper quartile,max instead of printing all error values.")
+	parser.add_argument("--quantiles", choices=sorted(ss.sketch_types.keys()), default="exact", help="How to compute the 5-summary: 'exact' keeps all per-file errors, 'tdigest' uses constant memory and is approximate. Default: exact")
+	parser.add_argument("--compression", type=float, default=100.0, help="Compression (accuracy vs. memory) of the tdigest quantile sketch. Default: 100")
+	parser.add_argument("--save-summary", type=argparse.FileType('w'), help="Save the partial summary to this file (JSON), to be merged later with --merge-summary.")
+	parser.add_argument("--cache", help="SQLite file to cache per-file results in. Files that did not change since they were last evaluated against the same reference are not read again.")
+	parser.add_argument("--jobs", type=int, default=1, help="Number of processes evaluating graph files concurrently, they share the reference poses in memory. Default: 1")
+	parser.add_argument("--merge-summary", nargs="+", default=[], type=argparse.FileType('r'), help="Merge these saved partial summaries into the result. Implies --5-summary.")
 	
 	args = parser.parse_args()
 
+	if args.merge_summary:
+		args.summary = True
+
+	if not args.graphs and not args.merge_summary:
+		parser.error("need graph files to process or summaries to merge")
+
 	if not args.output:
 		args.output = sys.stdout
 
-	G_ref = G.readg2o(args.reference)
+	(ref_ids, ref_poses) = G.readg2oVertices(args.reference)
+	ref = dict( zip(ref_ids.tolist(), ref_poses) )
 
-	errs = error_calc(G_ref)
+	cache = None
+	if args.cache:
+		cache = ResultCache(args.cache, file_hash(args.reference.name), METRIC_VERSION)
 
-	tr=[]
-	rot=[]
+	tr = ss.make_sketch(args.quantiles, args.compression)
+	rot = ss.make_sketch(args.quantiles, args.compression)
 
+	files = []
 	for pattern in args.graphs:
 		for graphfile in glob.glob(pattern):
 			if not os.path.exists(graphfile):
 				print("ERROR: graph file '",graphfile,"does not exist!", file=sys.stderr)
 				continue
+			files.append(graphfile)
+
+	cached = dict()
+	if cache:
+		for graphfile in files:
+			c = cache.lookup(graphfile)
+			if c:
+				# same types as calcMSE gives (they print differently)
+				cached[graphfile] = (np.float64(c[0]), float(c[1]))
+
+	todo = [f for f in files if not f in cached]
+
+	# the shared arrays are in /dev/shm, they are removed however this ends
+	# (a failed worker or cache store, Ctrl-C)
+	handle = None
+	pool = None
+	try:
+		if args.jobs > 1 and len(todo) > 1:
+			handle = shared_graph.export_vertices(ref_ids, ref_poses, 2 if ref_poses.shape[1] == 3 else 3)
+			pool = Pool(args.jobs, initializer=init_shared_worker, initargs=(handle,))
+			results = pool.imap(evaluate_file, todo)
+		else:
+			init_worker(ref)
+			results = itertools.imap(evaluate_file, todo)
+
+		for graphfile in files:
+			if graphfile in cached:
+				(RMSE_tr, RMSE_rot) = cached[graphfile]
+			else:
+				(RMSE_tr, RMSE_rot) = next(results)
 
-			G_cand =  G.readg2o( open(graphfile, 'r') )
-			
-			errs.clear()
-			G_cand.mapVertices(errs)
-
-			(RMSE_tr, RMSE_rot) = errs.calcMSE()
+				if cache:
+					cache.store(graphfile, (RMSE_tr, RMSE_rot))
 			
-			if not args.summary:
+			if not args.summary and not args.save_summary:
 				print( str(RMSE_tr) + " " + str(RMSE_rot), file=args.output )
 			else:
-				tr.append(RMSE_tr)
-				rot.append(RMSE_rot)
-
+				tr.add(RMSE_tr)
+				rot.add(RMSE_rot)
+	finally:
+		if pool:
+			pool.terminate() # all results are in, or they are not needed any more
+			pool.join()
+		if handle:
+			handle.unlink()
+
+	if cache:
+		cache.close()
+		print("cache: %d hits, %d misses" % (cache.hits, cache.misses), file=sys.stderr)
+
+	if args.save_summary:
+		ss.save_summary(args.save_summary, {"tr": tr, "rot": rot})
+
+	for f in args.merge_summary:
+		partial = ss.load_summary(f)
+		try:
+			tr.merge(partial["tr"])
+			rot.merge(partial["rot"])
+		except ValueError as e:
+			print("ERROR: can't merge summary '%s': %s" % (f.name, e), file=sys.stderr)
+			exit(1)
 
 	if args.summary:
-		p_tr= np.percentile(tr, [0,25,50,75,100])
-		p_rot= np.percentile(rot, [0,25,50,75,100])
+		p_tr= tr.percentile([0,25,50,75,100])
+		p_rot= rot.percentile([0,25,50,75,100])
 
 		for pt,pr in zip(p_tr, p_rot):
 			print( str(pt)+ " "+str(pr), file=args.output)
@@ -1,13 +1,51 @@
 #!/usr/bin/python
 
+from __future__ import print_function
+
 import argparse
 import sys
 import os
 import glob
 import traceback
-from subprocess import check_call
+from subprocess import check_call, Popen, PIPE
+from multiprocessing import Pool
+from StringIO import StringIO
 from utils import DefaultHelpParser
 
+# state of the conversion, set up before forking the worker pool, so workers
+# get the already parsed base graph copy-on-write
+job = dict()
+
+# converts one outlier file, returns (ok, stdout, stderr) with the output captured
+def convert_one(task):
+	(outlierfile, output_name) = task
+
+	if not job["in_process"]:
+		command = [job["worker"], job["input"], outlierfile, output_name] + job["extra_args"]
+		try:
+			p = Popen(command, stdout=PIPE, stderr=PIPE)
+			(out, err) = p.communicate()
+		except OSError as e: # e.g. worker not executable, fails like a nonzero exit
+			return (False, " ".join(command) + "\n", "ERROR: %s\n" % e)
+		return (p.returncode == 0, " ".join(command) + "\n" + out, err)
+
+	import converters
+
+	out = StringIO()
+	err = StringIO()
+	(sys.stdout, sys.stderr) = (out, err)
+	ok = True
+	try:
+		print("%s: %s -> %s" % (job["format"], outlierfile, output_name))
+		converters.convert(job["base"], outlierfile, output_name, job["format"], job["options"], **job["prepare_options"])
+	except Exception:
+		traceback.print_exc(file=err)
+		ok = False
+	finally:
+		(sys.stdout, sys.stderr) = (sys.__stdout__, sys.__stderr__)
+
+	return (ok, out.getvalue(), err.getvalue())
+
 if __name__ == "__main__":
 
 	parser = DefaultHelpParser(description='Convert many outlier files with a single original dataset with any of the one-shot converters. Additional arguments are passed on to worker conversion script.')
@@ -18,34 +56,88 @@ if __name__ == "__main__":
 	parser.add_argument("--output-dir", help="Optional output directory other than the directory containing outliers")
 	parser.add_argument("--output-prefix", help="Optional prefix that is prepended to the output file name")
 	parser.add_argument("--output-suffix", help="Optional suffix that is prepended to the output file name")
-	
+	parser.add_argument("--jobs", type=int, default=1, help="Number of outlier files to convert concurrently. Output of every conversion is collected and printed in order, a failed conversion does not stop the others. Default: 1")
+	parser.add_argument("--in-process", default=False, action='store_true', help="If given, do not start the worker script for every outlier file, but convert in this process with the converter of the worker script (one of the convert_to_*.py scripts). The original dataset is read only once.")
+	parser.add_argument("--incremental", default=False, action='store_true', help="Like --in-process, but outlier files that extend a previously converted one (as written by the generator scripts with --previous-outliers) are converted by adding only their new and changed outliers to the previous conversion. Outlier files are converted smallest first. Output is the same as without this option, byte for byte the one of the worker script, also with --bfs-init or --seq-init.")
+	parser.add_argument("--skip-up-to-date", default=False, action='store_true', help="Write a manifest next to every output (output file name + .manifest) with hashes of the original dataset, the outlier file, the worker script and its modules, and the command line. Skip outlier files whose output is up to date according to its manifest, convert only missing or outdated ones.")
+
 
 	(args, extra_args) = parser.parse_known_args()
 
-	print "Extra args to be passed on are: ", extra_args
+	print("Extra args to be passed on are: ", extra_args)
 
 	if not os.path.exists(args.worker) or not os.path.exists(args.input):
-		print "ERROR: worker script or input file does not exist!"
+		print("ERROR: worker script or input file does not exist!")
 		exit(1)
 
 	args.worker = os.path.realpath(args.worker)
 
+	tracker = None
+	if args.skip_up_to_date:
+		import manifest
+		# in process, the conversion is done by this script and the modules
+		# of the converters, not only by the worker script
+		extra_tools = []
+		if args.in_process or args.incremental:
+			here = os.path.dirname(os.path.realpath(__file__))
+			extra_tools = [ os.path.realpath(__file__), os.path.join(here, "converters.py") ]
+			if args.incremental:
+				extra_tools.append(os.path.join(here, "incremental.py"))
+		tracker = manifest.Tracker(args.worker, extra_tools)
+
+	# what an output depends on besides the worker script, for the manifest
+	def dependencies(outlierfile, output_name):
+		return ([output_name], [args.input, outlierfile], [args.worker, args.input, outlierfile, output_name] + extra_args)
+
+	def converted(outlierfile, output_name):
+		if tracker:
+			tracker.done(*dependencies(outlierfile, output_name))
+
+	if args.incremental:
+		if args.jobs > 1:
+			print("ERROR: --incremental converts outlier files one after another, it can't be used with --jobs")
+			exit(6)
+		args.in_process = True
+
 	if args.output_dir and os.path.exists(args.output_dir) and not os.path.isdir(args.output_dir):
-		print "ERROR: output dir is not a dir"
+		print("ERROR: output dir is not a dir")
 		exit(3)
 
 	if args.output_dir and not os.path.exists(args.output_dir):
 		os.makedirs(args.output_dir)
 
+	if args.in_process:
+		import graph as G
+		import converters
+
+		fmt = converters.format_of_script(args.worker)
+		if not fmt:
+			print("ERROR: --in-process needs one of the convert_to_*.py scripts as worker, known formats are: %s" % ", ".join(sorted(converters.formats.keys())))
+			exit(4)
+
+		worker_parser = DefaultHelpParser(prog=os.path.basename(args.worker), description="Options of the converter, passed on as extra args.")
+		converters.add_arguments(worker_parser, [fmt])
+		worker_args = worker_parser.parse_args(extra_args)
+
+		converters.check_args(worker_args)
+
+		options = converters.options_from_args(fmt, worker_args)
+		prepare_options = converters.prepare_args(worker_args)
+
+		with open(args.input, 'r') as f:
+			base = G.readg2o(f)
+
+	tasks = []
+
 	for pattern in args.outliers:
 		for outlierfile in glob.glob(pattern):
 			if not os.path.exists(outlierfile):
-				print "ERROR: outlier file '",outlierfile,"does not exist!"
+				print("ERROR: outlier file '",outlierfile,"does not exist!")
 				continue
 
-			command = [args.worker, args.input, outlierfile]
-
-			
+			output_dir = os.path.dirname(outlierfile)
+			if args.output_dir:
+				output_dir = args.output_dir
 
 			(output_name, outlier_ext) = os.path.splitext( os.path.basename(outlierfile) )
 
@@ -56,12 +148,94 @@ if __name__ == "__main__":
 				output_name += args.output_suffix
 
 
-			output_name = os.path.normpath(args.output_dir + "/" + output_name + ".g2o")
+			output_name = os.path.normpath( os.path.join(output_dir, output_name + ".g2o") )
+
+			if tracker:
+				if tracker.check(*dependencies(outlierfile, output_name)) is None:
+					print("up to date: %s" % output_name)
+					continue
+				tracker.begin([output_name])
+
+			if args.jobs > 1 or args.incremental:
+				tasks.append( (outlierfile, output_name) )
+				continue
+
+			if args.in_process:
+				print("*************************")
+				print("%s: %s -> %s" % (fmt, outlierfile, output_name))
+				converters.convert(base, outlierfile, output_name, fmt, options, **prepare_options)
+				converted(outlierfile, output_name)
+				continue
 
-			command += [output_name]
+			command = [args.worker, args.input, outlierfile, output_name]
 
 			command += extra_args
 
-			print "*************************"
-			print " ".join(command)
-			check_call(command, stdout=sys.stdout, stderr=sys.stderr)
\ No newline at end of file
+			print("*************************")
+			print(" ".join(command))
+			check_call(command, stdout=sys.stdout, stderr=sys.stderr)
+			converted(outlierfile, output_name)
+
+	if tasks and args.incremental:
+		import incremental
+
+		converter = incremental.IncrementalConverter(base, [(fmt, options)], **prepare_options)
+
+		failed = []
+		for (outlierfile, output_name) in sorted(tasks, key=lambda t: os.path.getsize(t[0])):
+			print("*************************")
+			print("%s: %s -> %s" % (fmt, outlierfile, output_name))
+			try:
+				if converter.convert(outlierfile, [output_name]):
+					print("extended a previous conversion")
+				converted(outlierfile, output_name)
+			except Exception:
+				traceback.print_exc(file=sys.stderr)
+				print("ERROR: conversion of '%s' failed" % outlierfile)
+				failed.append(outlierfile)
+
+		print("*************************")
+		print("converted %d of %d outlier files, %d by extending a previous conversion" % (len(tasks)-len(failed), len(tasks), converter.extended))
+		if failed:
+			print("failed: %s" % " ".join(failed))
+			exit(5)
+
+	elif tasks:
+		job["in_process"] = args.in_process
+		job["worker"] = args.worker
+		job["input"] = args.input
+		job["extra_args"] = extra_args
+		if args.in_process:
+			job["base"] = base
+			job["format"] = fmt
+			job["options"] = options
+			job["prepare_options"] = prepare_options
+
+		sys.stdout.flush()
+
+		pool = Pool(args.jobs)
+
+		failed = []
+		for (task, (ok, out, err)) in zip(tasks, pool.imap(convert_one, tasks)):
+			print("*************************")
+			sys.stdout.write(out)
+			sys.stdout.flush()
+			sys.stderr.write(err)
+			sys.stderr.flush()
+			if not ok:
+				print("ERROR: conversion of '%s' failed" % task[0])
+				failed.append(task[0])
+			else:
+				converted(*task)
+
+		pool.close()
+		pool.join()
+
+		print("*************************")
+		print("converted %d of %d outlier files" % (len(tasks)-len(failed), len(tasks)))
+		if failed:
+			print("failed: %s" % " ".join(failed))
+			exit(5)
+
+	if tracker:
+		print("%d outputs were up to date, %d were outdated or missing" % (tracker.up_to_date, tracker.outdated))
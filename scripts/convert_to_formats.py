@@ -0,0 +1,54 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import argparse
+import sys
+import graph as G
+import converters
+from utils import DefaultHelpParser
+
+if __name__ == "__main__":
+
+	parser = DefaultHelpParser(description='Convert a pair of original g2o file with corresponding outliers to several output formats at once. The graph and outliers are read and initialized only once, all outputs are written in a single pass.')
+
+	parser.add_argument("input", type=argparse.FileType('r'), help = "Path to the original dataset file (in g2o format).")
+	parser.add_argument("outliers", type=argparse.FileType('r'), help = "Outliers will be read from this file.")
+	parser.add_argument("--output", required=True, action='append', nargs='+', metavar="ARG", dest="outputs", help="FORMAT FILE [OPTION=VALUE ...], can be given multiple times. FORMAT is one of: %s. OPTIONs override the defaults given below for this output only, e.g. null_weight=0.01." % ", ".join(sorted(converters.formats.keys())))
+	converters.add_arguments(parser)
+
+	args = parser.parse_args()
+
+	converters.check_args(args)
+
+	outputs = []
+	for o in args.outputs:
+		if len(o) < 2:
+			parser.error("--output needs at least FORMAT and FILE")
+
+		fmt = o[0]
+		if not fmt in converters.formats:
+			parser.error("unknown format '%s'" % fmt)
+
+		(cls, defaults) = converters.formats[fmt]
+		defaults = dict(defaults)
+
+		options = converters.options_from_args(fmt, args)
+		for kv in o[2:]:
+			if not "=" in kv:
+				parser.error("output option '%s' is not of the form OPTION=VALUE" % kv)
+			(name, value) = kv.split("=", 1)
+			if not name in defaults:
+				parser.error("format '%s' has no option '%s', it has: %s" % (fmt, name, ", ".join(sorted(defaults.keys()))))
+			options[name] = converters.parse_option_value(defaults[name], value)
+
+		outputs.append( (open(o[1], 'w'), fmt, options) )
+
+	g = G.readg2o(args.input)
+
+	converters.prepare(g, args.outliers, **converters.prepare_args(args))
+
+	converters.write_formats(g, outputs)
+
+	for (f, fmt, options) in outputs:
+		f.close()
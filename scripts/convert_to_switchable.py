@@ -2,88 +2,83 @@
 
 from __future__ import print_function
 
-import argparse
 import sys
 import graph as G
-from utils import DefaultHelpParser
 
 class switchable_output(G.base_g2o_output):
-	def __init__(self,graph,switch_inf, switch_prior,weight_as_prior):
+	def __init__(self,graph,switch_inf, switch_prior,weight_as_prior,group_switch_vertices=False):
 		super(switchable_output, self).__init__(graph)
 
 		self.switch_inf=switch_inf
 		self.switch_prior=switch_prior
 		self.weight_as_prior=weight_as_prior
+		self.group_switch_vertices=group_switch_vertices
 
 		self.switchable_edge_tag = self.edge_tag+"_SWITCHABLE"
 
-		self.max_vertex_id=-1
+		self.switch_ids = dict() # edge key -> id of the first switch of the edge
 
-	def output_vertex(self,i,v):
-		super(switchable_output, self).output_vertex(i,v)
 
-		if i > self.max_vertex_id:
-			self.max_vertex_id=i
+	def weight_normalizations(self):
+		if self.weight_as_prior:
+			return ([0.0], [])
+		return ([], [])
 
+	# switch ids depend on all edges written before
+	def context_free(self,e):
+		return e.isSimple()
 
-	def output_edge(self,i,e):
-		if e.isSimple():
-			super(switchable_output, self).output_edge(i,e)
-			return
-
-		e.normalize()
+	# (target, motion, prior) of every switch of edge e
+	def switches(self,e):
+		if not self.weight_as_prior:
+			return [ (b.target, m, self.switch_prior) for b in e.motion_batches for m in b.motions ]
 
+		return [ (b.target, m, w*bw) for b,bw in zip(e.motion_batches, e.normalizedBatchWeights()) for m,w in zip(b.motions, b.normalizedWeights()) ]
 
-		for b in e.motion_batches:
-			
-			for m in b.motions:
-				w = m.weight
-				prior=self.switch_prior
-				if self.weight_as_prior:
-					prior = w*b.batch_weight
-
-				self.max_vertex_id+=1
-
-				print("VERTEX_SWITCH %d %s" %(self.max_vertex_id,str(prior)), file=self.out )
-				print("EDGE_SWITCH_PRIOR %d %s %s" %(self.max_vertex_id,str(prior),str(self.switch_inf)), file=self.out )
-				print("%s %d %d %d %s" %( self.switchable_edge_tag,e.reference, b.target, self.max_vertex_id, " ".join([str(x) for x in m])), file=self.out )
-				
-
-if __name__ == "__main__":
+	# switch ids follow the largest vertex id, one per motion of all complex edges in output order
+	def begin_edges(self,edges):
+		next_id = max(self.graph.V.keys())+1 if self.graph.V else 0
 
-	parser = DefaultHelpParser(description='Convert a pair of original g2o file with corresponding outliers to a switchable constraints graph.')
+		self.switch_ids = dict()
+		for i,e in edges:
+			if e.isSimple():
+				continue
+			self.switch_ids[i] = next_id
+			next_id += sum([len(b.motions) for b in e.motion_batches])
 
-	parser.add_argument("input", type=argparse.FileType('r'), help = "Path to the original dataset file (in g2o format).")
-	parser.add_argument("outliers", type=argparse.FileType('r'), help = "Outliers will be read from this file.")
-	parser.add_argument("output", type=argparse.FileType('w'), help = "Plain graph will be written into this file.")
-	parser.add_argument("--make-all-loops-hyperedges", default=False, dest="all_hyper", action='store_true', help="If given, make all non-sequential edges hyperedges, even though they do not have an assigned outlier.")
-	parser.add_argument("--seq-init", default=False, dest="do_seq", action='store_true', help="If given, do a sequential initialization (aka odometry init in g2o) including outliers.")
-	parser.add_argument("--bfs-init", default=False, dest="do_bfs", action='store_true', help="If given, do a breadth first initialization (aka spanning tree init in g2o) based on complete graph including outliers.")
-	parser.add_argument("--bfs-with-null", default=False, dest="do_bfs_with_null", action='store_true', help="If given, also use edges with null hypothesis for bfs initialization.")
-	parser.add_argument("--switch-inf", type=float, default=1.0, dest="switch_inf", help="Switch value information, default: 1.0")
-	parser.add_argument("--switch-prior", type=float, default=1.0, dest="switch_prior", help="Prior value for switch, default: 1.0")
-	parser.add_argument("--use-weight-as-prior", default=False, dest="weight_as_prior", action='store_true', help="If given, use outlier weight as switching prior.")
-
-	args = parser.parse_args()
-
-	if args.do_bfs and args.do_seq:
-		print("ERROR: specify either --seq-init or --bfs-init, not both")
-		exit(1)
+		if not self.group_switch_vertices:
+			return
 
-	g = G.readg2o(args.input)
+		vertices = []
+		priors = []
+		for i,e in edges:
+			if not i in self.switch_ids:
+				continue
+			for k,(target, m, prior) in enumerate(self.switches(e)):
+				s = self.switch_ids[i]+k
+				vertices.append("VERTEX_SWITCH %d %s\n" % (s, str(prior)))
+				priors.append("EDGE_SWITCH_PRIOR %d %s %s\n" % (s, str(prior), str(self.switch_inf)))
 
-	g.readExtraOutliers(args.outliers)
+		self.out.write("".join(vertices))
+		self.out.write("".join(priors))
 
-	if args.all_hyper:
-		g.makeAllLoopsHaveNullHypothesis()
+	def output_edge(self,i,e):
+		if e.isSimple():
+			super(switchable_output, self).output_edge(i,e)
+			return
 
-	if args.do_bfs:
-		g.setNonfixedPosesToZero()
-		g.intializePosesBFS(args.do_bfs_with_null)
+		lines = []
+		for k,(target, m, prior) in enumerate(self.switches(e)):
+			s = self.switch_ids[i]+k
 
-	if args.do_seq:
-		g.setNonfixedPosesToZero()
-		g.initializePosesSequential()
+			if not self.group_switch_vertices:
+				lines.append("VERTEX_SWITCH %d %s\n" % (s, str(prior)))
+				lines.append("EDGE_SWITCH_PRIOR %d %s %s\n" % (s, str(prior), str(self.switch_inf)))
+			lines.append("%s %d %d %d %s\n" % (self.switchable_edge_tag, e.reference, target, s, m.text()))
 
-	g.writeg2o(args.output,switchable_output(g, args.switch_inf, args.switch_prior, args.weight_as_prior))
+		self.out.write("".join(lines))
+				
 
+if __name__ == "__main__":
+	import converters # imports this script as a module, so only here
+	converters.main("switchable", 'Convert a pair of original g2o file with corresponding outliers to a switchable constraints graph.')
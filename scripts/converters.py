@@ -0,0 +1,196 @@
+from __future__ import print_function
+
+import os
+import argparse
+
+import graph as G
+from utils import DefaultHelpParser
+
+from convert_to_switchable import switchable_output
+from convert_to_hypermog import hypermog_output
+from convert_to_old_hypermog import old_hypermog_output
+from convert_to_hyper_maxmixture import hyper_maxmix_output
+from convert_to_separate_maxmixture import separate_maxmix_output
+from convert_to_all_plain_edges import plain_output
+
+# All output formats of the convert_to_*.py scripts, by the name of their
+# script (convert_to_<name>.py), with the output class and its options and
+# defaults (same as the command line defaults of the scripts).
+formats = {
+	"switchable":          (switchable_output,      [("switch_inf", 1.0), ("switch_prior", 1.0), ("weight_as_prior", False), ("group_switch_vertices", False)]),
+	"hypermog":            (hypermog_output,        [("null_weight", 1e-3)]),
+	"old_hypermog":        (old_hypermog_output,    [("null_weight", 1e-3)]),
+	"hyper_maxmixture":    (hyper_maxmix_output,    [("null_weight", 1e-3), ("null_inf_factor", 1e-12)]),
+	"separate_maxmixture": (separate_maxmix_output, [("null_weight", 1e-3), ("null_inf_factor", 1e-12)]),
+	"all_plain_edges":     (plain_output,           []),
+}
+
+# command line flags and help of the format options, as in the convert_to_*.py scripts
+option_flags = {
+	"switch_inf":      ("--switch-inf", "Switch value information, default: 1.0"),
+	"switch_prior":    ("--switch-prior", "Prior value for switch, default: 1.0"),
+	"weight_as_prior": ("--use-weight-as-prior", "If given, use outlier weight as switching prior."),
+	"group_switch_vertices": ("--group-switch-vertices", "If given, write all switch vertices and their priors in one block before the edges instead of next to their switchable edge."),
+	"null_weight":     ("--null-weight", "Weight of null hypothesis, used during hypercomponent weight normalization. Default: 1e-3"),
+	"null_inf_factor": ("--null-information-scale", "Factor for generating the null hypothesis information matrix, default: 1e-12"),
+}
+
+# command line flags of the prepare() options, as in the convert_to_*.py scripts
+prepare_flags = {
+	"all_hyper":        "--make-all-loops-hyperedges",
+	"do_seq":           "--seq-init",
+	"do_bfs":           "--bfs-init",
+	"do_bfs_with_null": "--bfs-with-null",
+}
+
+# name of the format a convert_to_*.py script writes, or None
+def format_of_script(path):
+	name = os.path.splitext(os.path.basename(path))[0]
+	if name.startswith("convert_to_") and name[len("convert_to_"):] in formats:
+		return name[len("convert_to_"):]
+	return None
+
+# adds the initialization flags shared by all converters and the option flags
+# of the given formats (default: all formats) to an argparse parser
+def add_arguments(parser, fmts=None):
+	parser.add_argument(prepare_flags["all_hyper"], default=False, dest="all_hyper", action='store_true', help="If given, make all non-sequential edges hyperedges, even though they do not have an assigned outlier.")
+	parser.add_argument(prepare_flags["do_seq"], default=False, dest="do_seq", action='store_true', help="If given, do a sequential initialization (aka odometry init in g2o) including outliers.")
+	parser.add_argument(prepare_flags["do_bfs"], default=False, dest="do_bfs", action='store_true', help="If given, do a breadth first initialization (aka spanning tree init in g2o) based on complete graph including outliers.")
+	parser.add_argument(prepare_flags["do_bfs_with_null"], default=False, dest="do_bfs_with_null", action='store_true', help="If given, also use edges with null hypothesis for bfs initialization.")
+
+	if fmts is None:
+		fmts = sorted(formats.keys())
+
+	added = set()
+	for fmt in fmts:
+		for name,default in formats[fmt][1]:
+			if name in added:
+				continue
+			added.add(name)
+
+			(flag, help) = option_flags[name]
+			if type(default) is bool:
+				parser.add_argument(flag, default=default, dest=name, action='store_true', help=help)
+			else:
+				parser.add_argument(flag, type=type(default), default=default, dest=name, help=help)
+
+# exits with an error if the parsed initialization flags contradict each other
+def check_args(args):
+	if args.do_bfs and args.do_seq:
+		print("ERROR: specify either --seq-init or --bfs-init, not both")
+		exit(1)
+
+# the options of format fmt from parsed command line arguments
+def options_from_args(fmt, args):
+	return dict([ (name, getattr(args, name)) for name,default in formats[fmt][1] ])
+
+# the initialization keyword arguments for prepare() from parsed command line arguments
+def prepare_args(args):
+	return dict(all_hyper=args.all_hyper, do_seq=args.do_seq, do_bfs=args.do_bfs, do_bfs_with_null=args.do_bfs_with_null)
+
+# the command line arguments of a convert_to_*.py script for format options and
+# prepare options, the reverse of options_from_args and prepare_args
+def script_arguments(options=dict(), prepare_options=dict()):
+	args = []
+	for name in sorted(prepare_options.keys()):
+		if prepare_options[name]:
+			args.append(prepare_flags[name])
+	for name in sorted(options.keys()):
+		value = options[name]
+		if type(value) is bool:
+			if value:
+				args.append(option_flags[name][0])
+		else:
+			args += [option_flags[name][0], repr(value)]
+	return args
+
+def parse_option_value(default, value):
+	if type(default) is bool:
+		if value.lower() in ["1", "true", "yes", "on"]:
+			return True
+		if value.lower() in ["0", "false", "no", "off"]:
+			return False
+		raise ValueError("Not a boolean value: '%s'" % value)
+	return type(default)(value)
+
+# options is a dict of option name to value, missing options get their default
+def make_output(graph, fmt, options=dict()):
+	if not fmt in formats:
+		raise ValueError("Unknown output format '%s', known formats: %s" % (fmt, ", ".join(sorted(formats.keys()))))
+
+	(cls, defaults) = formats[fmt]
+
+	unknown = set(options.keys()) - set([name for name,default in defaults])
+	if unknown:
+		raise ValueError("Unknown options for format '%s': %s" % (fmt, ", ".join(sorted(unknown))))
+
+	args = [ options.get(name, default) for name,default in defaults ]
+	return cls(graph, *args)
+
+# adds outliers and initializes poses, like all convert_to_*.py scripts do before writing.
+# outliers may be None if they were already added to g.
+def prepare(g, outliers, all_hyper=False, do_seq=False, do_bfs=False, do_bfs_with_null=False):
+	if do_bfs and do_seq:
+		raise ValueError("specify either sequential or bfs initialization, not both")
+
+	if outliers is not None:
+		g.readExtraOutliers(outliers)
+
+	if all_hyper:
+		g.makeAllLoopsHaveNullHypothesis()
+
+	if do_bfs:
+		g.setNonfixedPosesToZero()
+		g.intializePosesBFS(do_bfs_with_null)
+
+	if do_seq:
+		g.setNonfixedPosesToZero()
+		g.initializePosesSequential()
+
+	return g
+
+# writes the prepared graph g in several formats in a single pass over its edges.
+# outputs is a list of (file, format name, options dict)
+def write_formats(g, outputs):
+	g.writeg2oMany([ (f, make_output(g, fmt, options)) for (f, fmt, options) in outputs ])
+
+# converts the outliers in the file at outliers_path on top of an already
+# parsed base graph, which stays unchanged, and writes one or more formats.
+# outputs is a list of (output path, format name, options dict), prepare_options
+# are passed on to prepare().
+def convert_formats(base, outliers_path, outputs, **prepare_options):
+	g = G.Graph(base)
+
+	with open(outliers_path, 'r') as f:
+		prepare(g, f, **prepare_options)
+
+	files = []
+	try:
+		for (path, fmt, options) in outputs:
+			files.append( (open(path, 'w'), fmt, options) )
+
+		write_formats(g, files)
+	finally:
+		for (f, fmt, options) in files:
+			f.close()
+
+def convert(base, outliers_path, output_path, fmt, options=dict(), **prepare_options):
+	convert_formats(base, outliers_path, [(output_path, fmt, options)], **prepare_options)
+
+# command line of the convert_to_*.py scripts: converts one outlier file to format fmt
+def main(fmt, description):
+	parser = DefaultHelpParser(description=description)
+
+	parser.add_argument("input", type=argparse.FileType('r'), help = "Path to the original dataset file (in g2o format).")
+	parser.add_argument("outliers", type=argparse.FileType('r'), help = "Outliers will be read from this file.")
+	parser.add_argument("output", type=argparse.FileType('w'), help = "Plain graph will be written into this file.")
+	add_arguments(parser, [fmt])
+
+	args = parser.parse_args()
+	check_args(args)
+
+	g = G.readg2o(args.input)
+
+	prepare(g, args.outliers, **prepare_args(args))
+
+	g.writeg2o(args.output, make_output(g, fmt, options_from_args(fmt, args)))
@@ -0,0 +1,203 @@
+from __future__ import print_function
+
+import os
+import re
+import fnmatch
+import sqlite3
+from multiprocessing import Pool
+
+import numpy as np
+
+# Timing files of g2o (-saveTiming, as written by run_g2o.py next to every
+# optimized graph), read into one columnar table for many runs.
+#
+# A timing file has a line per iteration of "key= value" pairs separated by
+# tabs. The time of an iteration is timeIteration (g2o's batch statistics) or
+# time (its verbose output), chi2 is optional (NaN where missing).
+#
+# The table has a row per iteration: run (index into files), iteration, time,
+# chi2. It can be saved to SQLite (tables runs and iterations, for queries across
+# many runs) or to a numpy .npz file, and loaded from both.
+
+TIME_KEYS = ["timeIteration", "time"]
+
+def parse_line(l):
+	tokens = l.split()
+	return dict([ (k[:-1], v) for k,v in zip(tokens[0::2], tokens[1::2]) if k.endswith("=") ])
+
+# (iterations, times, chi2s) of one timing file as arrays
+def read_timing(f):
+	iterations = []
+	times = []
+	chi2s = []
+
+	for l in f:
+		values = parse_line(l)
+		if not values:
+			continue
+
+		t = [ values[k] for k in TIME_KEYS if k in values ]
+		if not t:
+			continue
+
+		iterations.append( int(values.get("iteration", len(iterations))) )
+		times.append( float(t[0]) )
+		chi2s.append( float(values.get("chi2", "nan")) )
+
+	return (np.array(iterations, dtype=np.int32), np.array(times), np.array(chi2s))
+
+def read_timing_file(path):
+	with open(path, 'r') as f:
+		return read_timing(f)
+
+# all files matching pattern under root, sorted
+def find_timing_files(root, pattern="*.time"):
+	found = []
+	for (dirpath, dirnames, filenames) in os.walk(root):
+		dirnames.sort()
+		for name in sorted(fnmatch.filter(filenames, pattern)):
+			found.append( os.path.join(dirpath, name) )
+	return found
+
+
+class TimingTable(object):
+	"""Iterations of many runs as columns, rows grouped by run in the order of files."""
+
+	def __init__(self, files, run, iteration, time, chi2):
+		self.files = list(files)
+		self.run = run
+		self.iteration = iteration
+		self.time = time
+		self.chi2 = chi2
+
+	def __len__(self):
+		return len(self.run)
+
+	# start and end row of every run
+	def bounds(self):
+		counts = np.bincount(self.run, minlength=len(self.files))
+		ends = np.cumsum(counts)
+		return (ends - counts, ends)
+
+	# per run: number of iterations, total time, final chi2 and time to converge,
+	# i.e. the time until chi2 first was within tolerance (relative) of its final
+	# value (NaN without chi2)
+	def run_stats(self, tolerance=1e-3):
+		(starts, ends) = self.bounds()
+		n = len(self.files)
+
+		stats = dict(iterations=ends - starts, total_time=np.zeros(n), final_chi2=np.full(n, np.nan), time_to_converge=np.full(n, np.nan))
+
+		for r in range(n):
+			(s, e) = (starts[r], ends[r])
+			if s == e:
+				continue
+
+			cum_time = np.cumsum(self.time[s:e])
+			stats["total_time"][r] = cum_time[-1]
+
+			chi2 = self.chi2[s:e]
+			final = chi2[-1]
+			if np.isnan(final):
+				continue
+
+			stats["final_chi2"][r] = final
+			converged = np.nonzero( np.abs(chi2 - final) <= tolerance * abs(final) )[0]
+			stats["time_to_converge"][r] = cum_time[converged[0]]
+
+		return stats
+
+
+def concatenate(files, parts):
+	lengths = [ len(p[0]) for p in parts ]
+	run = np.repeat(np.arange(len(files), dtype=np.int32), lengths)
+
+	if not parts:
+		return TimingTable(files, run, np.zeros(0, dtype=np.int32), np.zeros(0), np.zeros(0))
+
+	return TimingTable(files, run, *[ np.concatenate([ p[c] for p in parts ]) for c in range(3) ])
+
+# reads timing files with jobs processes into one TimingTable
+def read_timing_files(paths, jobs=1):
+	if jobs > 1 and len(paths) > 1:
+		pool = Pool(jobs)
+		parts = pool.map(read_timing_file, paths, chunksize=max(1, len(paths) // (4*jobs)))
+		pool.close()
+		pool.join()
+	else:
+		parts = [ read_timing_file(p) for p in paths ]
+
+	return concatenate(paths, parts)
+
+# the configuration of a run: the directory of its file relative to root, or
+# with a regular expression, the groups it matches in the path joined by '/'
+# (None if it does not match)
+def configuration(path, root, regex=None):
+	if regex is None:
+		return os.path.dirname( os.path.relpath(path, root) ) or "."
+
+	m = re.search(regex, path)
+	if m is None:
+		return None
+	if not m.groups():
+		return m.group(0)
+	return "/".join([ g for g in m.groups() if g is not None ])
+
+
+def save_sqlite(table, path, configs=None, tolerance=1e-3):
+	if os.path.exists(path):
+		os.remove(path)
+
+	stats = table.run_stats(tolerance)
+	if configs is None:
+		configs = [None] * len(table.files)
+
+	db = sqlite3.connect(path)
+	db.execute("CREATE TABLE runs (id INTEGER PRIMARY KEY, file TEXT, config TEXT, iterations INTEGER, total_time REAL, final_chi2 REAL, time_to_converge REAL)")
+	db.execute("CREATE TABLE iterations (run INTEGER, iteration INTEGER, time REAL, chi2 REAL)")
+
+	def real(x):
+		return None if np.isnan(x) else float(x)
+
+	db.executemany("INSERT INTO runs VALUES (?,?,?,?,?,?,?)", [ (r, table.files[r], configs[r], int(stats["iterations"][r]), float(stats["total_time"][r]), real(stats["final_chi2"][r]), real(stats["time_to_converge"][r])) for r in range(len(table.files)) ])
+	db.executemany("INSERT INTO iterations VALUES (?,?,?,?)", zip(table.run.tolist(), table.iteration.tolist(), table.time.tolist(), [ real(c) for c in table.chi2 ]))
+
+	db.execute("CREATE INDEX runs_by_config ON runs (config)")
+	db.execute("CREATE INDEX iterations_by_run ON iterations (run)")
+	db.commit()
+	db.close()
+
+def load_sqlite(path):
+	db = sqlite3.connect(path)
+	runs = db.execute("SELECT file, config FROM runs ORDER BY id").fetchall()
+	rows = db.execute("SELECT run, iteration, time, chi2 FROM iterations ORDER BY run, rowid").fetchall()
+	db.close()
+
+	table = TimingTable([ str(f) for f,c in runs ],
+		np.array([ r[0] for r in rows ], dtype=np.int32), np.array([ r[1] for r in rows ], dtype=np.int32),
+		np.array([ r[2] for r in rows ], dtype=np.float64), np.array([ np.nan if r[3] is None else r[3] for r in rows ], dtype=np.float64))
+	return (table, [ c if c is None else str(c) for f,c in runs ])
+
+def save_npz(table, path, configs=None):
+	if configs is None:
+		configs = [""] * len(table.files)
+	np.savez_compressed(path, files=np.array(table.files), configs=np.array([ c or "" for c in configs ]), run=table.run, iteration=table.iteration, time=table.time, chi2=table.chi2)
+
+def load_npz(path):
+	d = np.load(path)
+	table = TimingTable([ str(f) for f in d["files"] ], d["run"], d["iteration"], d["time"], d["chi2"])
+	return (table, [ str(c) or None for c in d["configs"] ])
+
+def concatenate_tables(tables):
+	files = []
+	offset = 0
+	runs = []
+	for t in tables:
+		files.extend(t.files)
+		runs.append(t.run + offset)
+		offset += len(t.files)
+
+	if not tables:
+		return concatenate([], [])
+
+	return TimingTable(files, np.concatenate(runs).astype(np.int32), *[ np.concatenate([ getattr(t, c) for t in tables ]) for c in ["iteration", "time", "chi2"] ])
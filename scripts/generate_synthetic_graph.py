@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import sys
+from multiprocessing import Pool
+import numpy as np
+from utils import DefaultHelpParser
+
+# Synthetic SE2 and SE3 pose graphs of any size, for scaling benchmarks.
+#
+# The ground truth trajectory moves one step forward per vertex and turns in
+# between: in a Manhattan world by +-90 degrees (and, in 3D, up or down one
+# level), on a random walk by a random angle (and, in 3D, pitching up and down
+# a little). Loop closures connect a vertex to the previous visit of the same
+# cell (of size --loop-radius) at least --min-loop-gap vertices earlier, a
+# random subset of them is kept. Measurements are the ground truth relative
+# poses with gaussian noise, the vertex estimates are the noisy odometry
+# composed from the first (fixed) vertex.
+#
+# Everything is computed with numpy on whole arrays; most of the time goes into
+# formatting the text, which is done in chunks (in --jobs processes).
+#
+# Poses are arrays with a row per pose, SE2 as x y theta, SE3 as x y z qx qy qz
+# qw (the order of g2o).
+
+CHUNK = 100000
+
+def wrap(a):
+	return np.arctan2(np.sin(a), np.cos(a))
+
+# quaternions (x, y, z, w) in rows
+def qmul(a, b):
+	(ax, ay, az, aw) = a.T
+	(bx, by, bz, bw) = b.T
+	return np.column_stack([ aw*bx + ax*bw + ay*bz - az*by,
+	                         aw*by - ax*bz + ay*bw + az*bx,
+	                         aw*bz + ax*by - ay*bx + az*bw,
+	                         aw*bw - ax*bx - ay*by - az*bz ])
+
+def qconj(q):
+	return np.column_stack([ -q[:,:3], q[:,3] ])
+
+def qrotate(q, v):
+	u = q[:,:3]
+	c = 2 * np.cross(u, v)
+	return v + q[:,3:4] * c + np.cross(u, c)
+
+def quat_from_rotvec(v):
+	angle = np.sqrt(np.sum(v**2, axis=1))
+	s = 0.5 * np.sinc(angle / (2 * np.pi))
+	return np.column_stack([ v * s[:,None], np.cos(angle / 2) ])
+
+def quat_from_yaw_pitch(yaw, pitch):
+	z = np.zeros(len(yaw))
+	qyaw = np.column_stack([ z, z, np.sin(yaw / 2), np.cos(yaw / 2) ])
+	qpitch = np.column_stack([ z, np.sin(pitch / 2), z, np.cos(pitch / 2) ])
+	return qmul(qyaw, qpitch)
+
+# pose of b relative to a
+def relative(a, b):
+	if a.shape[1] == 3:
+		(c, s) = (np.cos(a[:,2]), np.sin(a[:,2]))
+		(dx, dy) = (b[:,0] - a[:,0], b[:,1] - a[:,1])
+		return np.column_stack([ c*dx + s*dy, -s*dx + c*dy, wrap(b[:,2] - a[:,2]) ])
+
+	qa_inv = qconj(a[:,3:])
+	return np.column_stack([ qrotate(qa_inv, b[:,:3] - a[:,:3]), qmul(qa_inv, b[:,3:]) ])
+
+# SE3 poses a composed with b
+def compose(a, b):
+	q = qmul(a[:,3:], b[:,3:])
+	q /= np.sqrt(np.sum(q**2, axis=1))[:,None]
+	return np.column_stack([ a[:,:3] + qrotate(a[:,3:], b[:,:3]), q ])
+
+# relative poses with noise, rotation noise is applied as a random rotation
+def perturb(d, rng, sigma_t, sigma_r):
+	if d.shape[1] == 3:
+		noise = np.column_stack([ rng.normal(0, sigma_t, (len(d), 2)), rng.normal(0, sigma_r, len(d)) ])
+		out = d + noise
+		out[:,2] = wrap(out[:,2])
+		return out
+
+	q = qmul(d[:,3:], quat_from_rotvec(rng.normal(0, sigma_r, (len(d), 3))))
+	q *= np.sign(q[:,3:4]) + (q[:,3:4] == 0)
+	return np.column_stack([ d[:,:3] + rng.normal(0, sigma_t, (len(d), 3)), q ])
+
+# poses of the chain starting at first with the given relative poses between
+# consecutive vertices
+def compose_chain(first, odometry):
+	if len(first) == 3:
+		theta = first[2] + np.concatenate([ [0], np.cumsum(odometry[:,2]) ])
+		(c, s) = (np.cos(theta[:-1]), np.sin(theta[:-1]))
+		steps = np.column_stack([ c*odometry[:,0] - s*odometry[:,1], s*odometry[:,0] + c*odometry[:,1] ])
+		xy = first[:2] + np.concatenate([ np.zeros((1, 2)), np.cumsum(steps, axis=0) ])
+		return np.column_stack([ xy, wrap(theta) ])
+
+	# the chain is cut into about sqrt(n) blocks, composed step by step in all
+	# blocks at once, then every block is moved to the end of the one before
+	n = len(odometry)
+	size = int(np.ceil(np.sqrt(n)))
+	blocks = -(-n // size)
+
+	identity = np.tile([0, 0, 0, 0, 0, 0, 1.0], (blocks * size - n, 1))
+	steps = np.concatenate([ odometry, identity ]).reshape(blocks, size, 7)
+
+	local = np.empty_like(steps)
+	local[:,0] = steps[:,0]
+	for j in range(1, size):
+		local[:,j] = compose(local[:,j-1], steps[:,j])
+
+	starts = np.empty((blocks + 1, 7))
+	starts[0] = first
+	for i in range(blocks):
+		starts[i+1] = compose(starts[i:i+1], local[i,-1:])[0]
+
+	poses = compose(np.repeat(starts[:-1], size, axis=0), local.reshape(-1, 7))[:n]
+	return np.concatenate([ np.asarray(first)[None,:], poses ])
+
+# ground truth poses of n vertices
+def trajectory(n, dim, world, rng, step=1.0, turn_probability=0.3, turn_sigma=0.2, climb_probability=0.05):
+	# heading of vertex i is the sum of the turns before it, it moves along its heading to vertex i+1
+	if world == "manhattan":
+		quarters = rng.choice([-1, 0, 1], size=n-1, p=[turn_probability/2, 1-turn_probability, turn_probability/2])
+		yaw = np.concatenate([ [0], np.cumsum(quarters) ]) * (np.pi / 2)
+	else:
+		yaw = np.concatenate([ [0], np.cumsum(rng.normal(0, turn_sigma, n-1)) ])
+
+	if dim == 2:
+		xy = np.concatenate([ np.zeros((1, 2)), np.cumsum(step * np.column_stack([ np.cos(yaw[:-1]), np.sin(yaw[:-1]) ]), axis=0) ])
+		return np.column_stack([ xy, wrap(yaw) ])
+
+	if world == "manhattan":
+		pitch = np.zeros(n)
+		climb = step * rng.choice([-1, 0, 1], size=n-1, p=[climb_probability/2, 1-climb_probability, climb_probability/2])
+	else:
+		pitch = 0.2 * np.sin( np.concatenate([ [0], np.cumsum(rng.normal(0, turn_sigma, n-1)) ]) )
+		climb = -step * np.sin(pitch[:-1])
+
+	scale = step * np.cos(pitch[:-1])
+	moves = np.column_stack([ scale * np.cos(yaw[:-1]), scale * np.sin(yaw[:-1]), climb ])
+	xyz = np.concatenate([ np.zeros((1, 3)), np.cumsum(moves, axis=0) ])
+	return np.column_stack([ xyz, quat_from_yaw_pitch(yaw, pitch) ])
+
+# (a, b) of all vertices b whose previous visit of the same cell was vertex a,
+# at least min_gap vertices before
+def loop_candidates(positions, radius, min_gap):
+	cells = np.floor(positions / radius + 0.5).astype(np.int64)
+	cells -= cells.min(axis=0)
+	key = np.ravel_multi_index(cells.T, cells.max(axis=0) + 1)
+
+	order = np.argsort(key, kind='mergesort')
+	same = key[order[1:]] == key[order[:-1]]
+	(a, b) = (order[:-1][same], order[1:][same])
+
+	keep = b - a >= min_gap
+	return (a[keep], b[keep])
+
+def information_text(dim, sigma_t, sigma_r):
+	# the rotation error of EDGE_SE3:QUAT is the vector part of the quaternion, about half the angle
+	if dim == 2:
+		diag = [1 / sigma_t**2] * 2 + [1 / sigma_r**2]
+	else:
+		diag = [1 / sigma_t**2] * 3 + [4 / sigma_r**2] * 3
+	return " ".join([ "%g" % diag[i] if i == j else "0" for i in range(len(diag)) for j in range(i, len(diag)) ])
+
+# text of rows of columns with a line format for one row
+def format_rows(task):
+	(line, columns) = task
+	return "".join([ line % row for row in zip(*[ c.tolist() for c in columns ]) ])
+
+def write_rows(f, line, columns, pool):
+	tasks = [ (line, [ c[s:s+CHUNK] for c in columns ]) for s in range(0, len(columns[0]), CHUNK) ]
+	for text in (pool.imap(format_rows, tasks) if pool else map(format_rows, tasks)):
+		f.write(text)
+
+def write_graph(f, poses, refs, targets, measurements, information, header, pool):
+	dim = 2 if poses.shape[1] == 3 else 3
+	(vertex_tag, edge_tag) = ("VERTEX_SE2", "EDGE_SE2") if dim == 2 else ("VERTEX_SE3:QUAT", "EDGE_SE3:QUAT")
+
+	f.write("# %s\n" % header)
+	write_rows(f, vertex_tag + " %d" + " %.6f" * poses.shape[1] + "\n", [np.arange(len(poses))] + list(poses.T), pool)
+	f.write("FIX 0\n")
+	write_rows(f, edge_tag + " %d %d" + " %.6f" * poses.shape[1] + " " + information + "\n", [refs, targets] + list(measurements.T), pool)
+
+
+if __name__ == "__main__":
+
+	parser = DefaultHelpParser(description='Generate a synthetic SE2 or SE3 pose graph in g2o format (readable by graph.py and the outlier generator) with any number of vertices: a Manhattan world or random walk trajectory with odometry and loop closure edges with gaussian noise. Vertex estimates are the composed odometry, the first vertex is fixed.')
+
+	parser.add_argument("output", help="Output graph file (g2o format).")
+	parser.add_argument("--groundtruth", help="Also write the graph with ground truth vertex poses to this file, e.g. as reference for compute_error.py.")
+	parser.add_argument("--dim", type=int, choices=[2, 3], default=2, help="2 for SE2, 3 for SE3 (quaternion) poses. Default: 2")
+	parser.add_argument("--world", choices=["manhattan", "random"], default="manhattan", help="Manhattan world (moving on a grid) or random walk. Default: manhattan")
+	parser.add_argument("--vertices", type=int, default=10000, help="Number of vertices. Default: 10000")
+	parser.add_argument("--loops", type=float, default=0.1, help="Number of loop closures per vertex, if there are enough revisits. Default: 0.1")
+	parser.add_argument("--loop-radius", type=float, default=1.0, help="Size of the cells in which revisits are closed as loops. Default: 1.0")
+	parser.add_argument("--min-loop-gap", type=int, default=10, help="Minimum difference of vertex ids of a loop closure. Default: 10")
+	parser.add_argument("--step", type=float, default=1.0, help="Distance between consecutive vertices. Default: 1.0")
+	parser.add_argument("--turn-probability", type=float, default=0.3, help="Manhattan world: probability to turn by +-90 degrees at a vertex. Default: 0.3")
+	parser.add_argument("--turn-sigma", type=float, default=0.2, help="Random walk: standard deviation of the heading change between vertices (radians). Default: 0.2")
+	parser.add_argument("--climb-probability", type=float, default=0.05, help="Manhattan world in 3D: probability to move up or down one level between vertices. Default: 0.05")
+	parser.add_argument("--translation-noise", type=float, default=0.05, help="Standard deviation of the translation noise of measurements. Default: 0.05")
+	parser.add_argument("--rotation-noise", type=float, default=0.01, help="Standard deviation of the rotation noise of measurements (radians). Default: 0.01")
+	parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator. Default: 0")
+	parser.add_argument("--jobs", type=int, default=1, help="Number of processes formatting the output. Default: 1")
+
+	args = parser.parse_args()
+
+	if args.vertices < 2:
+		print("ERROR: need at least 2 vertices")
+		exit(1)
+	if args.min_loop_gap < 2:
+		print("ERROR: loop closures have to skip at least one vertex (--min-loop-gap 2)")
+		exit(1)
+
+	rng = np.random.RandomState(args.seed)
+	n = args.vertices
+
+	truth = trajectory(n, args.dim, args.world, rng, args.step, args.turn_probability, args.turn_sigma, args.climb_probability)
+
+	(loop_refs, loop_targets) = loop_candidates(truth[:,:args.dim], args.loop_radius, args.min_loop_gap)
+	wanted = int(round(args.loops * n))
+	if len(loop_refs) < wanted:
+		print("WARNING: only %d revisits for %d loop closures" % (len(loop_refs), wanted), file=sys.stderr)
+	else:
+		keep = np.sort(rng.permutation(len(loop_refs))[:wanted])
+		(loop_refs, loop_targets) = (loop_refs[keep], loop_targets[keep])
+
+	# odometry first, so it comes before the loop closures to the same vertex
+	refs = np.concatenate([ np.arange(n - 1), loop_refs ])
+	targets = np.concatenate([ np.arange(1, n), loop_targets ])
+	order = np.argsort(targets, kind='mergesort')
+	(refs, targets) = (refs[order], targets[order])
+
+	measurements = perturb(relative(truth[refs], truth[targets]), rng, args.translation_noise, args.rotation_noise)
+
+	# odometry edges are the ones between consecutive vertices, in order
+	odometry = measurements[targets - refs == 1]
+	estimates = compose_chain(truth[0], odometry)
+
+	information = information_text(args.dim, args.translation_noise, args.rotation_noise)
+	header = "generate_synthetic_graph.py " + " ".join(sys.argv[1:])
+
+	print("%d vertices, %d odometry edges, %d loop closures" % (n, n - 1, len(loop_refs)))
+
+	pool = Pool(args.jobs) if args.jobs > 1 else None
+
+	with open(args.output, 'w') as f:
+		write_graph(f, estimates, refs, targets, measurements, information, header, pool)
+
+	if args.groundtruth:
+		with open(args.groundtruth, 'w') as f:
+			write_graph(f, truth, refs, targets, measurements, information, header, pool)
+
+	if pool:
+		pool.close()
+		pool.join()
@@ -2,16 +2,29 @@ from __future__ import print_function
 
 import argparse
 import sys
-from collections import deque
-from copy import deepcopy
+from collections import deque, Counter
 import itertools
+import gc
+import random
+
+import numpy as np
 
 import pose_utils as pu
+import metrics
 from utils import DefaultHelpParser
 
-class Motion:
+# Motion, ConstraintMotions and ConstraintBatch have __slots__: there is one of
+# each per edge, and an instance __dict__ per object made reading large graphs
+# take about a third more memory.
+
+class Motion(object):
+	__slots__ = ("weight", "mean", "inf_up", "_text", "_mean_text")
+
 	def __init__(self, weight, elems):
 		self.weight = weight
+		# measurement text, formatted on first use, see text()
+		self._text = None
+		self._mean_text = None
 		if len(elems) > 13: # 3D
 			self.mean = [float(x) for x in elems[3:10]]
 			self.inf_up = [float(x) for x in elems[10:]]
@@ -26,23 +39,77 @@ class Motion:
 	def __iter__(self):
 		return itertools.chain(self.mean, self.inf_up)
 
-class ConstraintMotions:
+	# without parsing, e.g. for values that are already numbers
+	@classmethod
+	def fromValues(cls, weight, mean, inf_up):
+		m = cls.__new__(cls)
+		m.weight = weight
+		m.mean = mean
+		m.inf_up = inf_up
+		m._text = None
+		m._mean_text = None
+		return m
+
+	# mean and inf_up are never changed in place, so copies share them
+	def copy(self):
+		m = Motion.fromValues(self.weight, self.mean, self.inf_up)
+		m._text = self._text
+		m._mean_text = self._mean_text
+		return m
+
+	# mean and information as g2o text, formatted once and reused by every output
+	def text(self):
+		if self._text is None:
+			self._text = " ".join([str(x) for x in self])
+		return self._text
+
+	def meanText(self):
+		if self._mean_text is None:
+			self._mean_text = " ".join([str(x) for x in self.mean])
+		return self._mean_text
+
+	# has to be called after changing mean or inf_up, so the text is formatted again
+	def invalidate(self):
+		self._text = None
+		self._mean_text = None
+
+class ConstraintMotions(object):
+	__slots__ = ("batch_weight", "target", "motions", "normalized", "batch")
+
 	def __init__(self, batch_weight, target, init_str=None):
 		self.batch_weight = batch_weight
 		self.target = target
 
 		self.motions = [] # Motion instances
+		self.normalized = None # null hypothesis weight -> normalized motion weights, made on first use
+
+		self.batch = None # the ConstraintBatch this belongs to, set by ConstraintBatch.addMotions
 
 		if init_str:
 			self.addMotion(1.0, init_str)
 
 	def addMotion(self, weight, elems):
 		self.motions.append(Motion(weight, elems))
+		self.normalized = None
+
+		if self.batch:
+			self.batch.invalidate()
+
+	def copy(self):
+		c = ConstraintMotions(self.batch_weight, self.target)
+		c.motions = [m.copy() for m in self.motions]
+		return c
+
+	# motion weights divided by their sum plus the null hypothesis weight,
+	# cached per null hypothesis weight. The raw weights are not changed.
+	def normalizedWeights(self,null_hypothesis_weight=0.0):
+		if self.normalized is None:
+			self.normalized = dict()
+		if not null_hypothesis_weight in self.normalized:
+			norm = sum([x.weight for x in self.motions])+null_hypothesis_weight
+			self.normalized[null_hypothesis_weight] = [ m.weight / norm for m in self.motions ]
 
-	def normalize(self,null_hypothesis_weight=0.0):
-		norm = sum([x.weight for x in self.motions])+null_hypothesis_weight
-		for i in range(len(self.motions)):
-			self.motions[i].weight /= norm
+		return self.normalized[null_hypothesis_weight]
 
 	def getMaxMotion(self):
 		maxmotion=None
@@ -54,8 +121,15 @@ class ConstraintMotions:
 
 
 
-class ConstraintBatch:
+class ConstraintBatch(object):
+	__slots__ = ("_sort_key", "_ambiguity", "normalized", "rendered", "has_inlier", "_has_null_hypothesis", "reference", "inlier_target", "motion_batches")
+
 	def __init__(self, has_inlier, has_null_hypothesis, reference, inlier_target=None, inlier_str=None):
+		self._sort_key = None
+		self._ambiguity = None
+		self.normalized = None # null hypothesis weight -> normalized batch weights, made on first use
+		self.rendered = None # output signature -> text written for this edge, only made by incremental.py
+
 		self.has_inlier = has_inlier
 		self.has_null_hypothesis = has_null_hypothesis
 		self.reference = reference
@@ -64,7 +138,31 @@ class ConstraintBatch:
 		self.motion_batches = []
 
 		if inlier_str:
-			self.motion_batches.append( ConstraintMotions(1.0, inlier_target, inlier_str) )
+			self.addMotions( ConstraintMotions(1.0, inlier_target, inlier_str) )
+
+	def copy(self):
+		c = ConstraintBatch(self.has_inlier, self.has_null_hypothesis, self.reference, self.inlier_target)
+		for b in self.motion_batches:
+			c.addMotions(b.copy())
+		return c
+
+	# cached values derived from the structure of this edge have to be
+	# recomputed whenever motions are added or the null hypothesis changes
+	def invalidate(self):
+		self._sort_key = None
+		self._ambiguity = None
+		self.normalized = None
+		self.rendered = None
+
+	@property
+	def has_null_hypothesis(self):
+		return self._has_null_hypothesis
+
+	@has_null_hypothesis.setter
+	def has_null_hypothesis(self, value):
+		if value != getattr(self, "_has_null_hypothesis", None):
+			self._has_null_hypothesis = value
+			self.invalidate()
 
 	def getSimpleEdge(self):
 		if not self.isSimple():
@@ -78,10 +176,12 @@ class ConstraintBatch:
 		return self.isSimple() and self.reference+1 != self.motion_batches[0].target
 
 	def ambiguity(self):
-		s= sum([len(x.motions) for x in self.motion_batches])
-		if self.has_null_hypothesis:
-			s += 1
-		return s
+		if self._ambiguity is None:
+			s= sum([len(x.motions) for x in self.motion_batches])
+			if self.has_null_hypothesis:
+				s += 1
+			self._ambiguity = s
+		return self._ambiguity
 
 	def targets(self):
 		return [x.target for x in self.motion_batches]
@@ -105,51 +205,37 @@ class ConstraintBatch:
 
 	def addMotions(self,motion):
 		self.motion_batches.append(motion)
+		motion.batch = self
+		self.invalidate()
+
+	# batch weights divided by their sum plus the null hypothesis weight, cached
+	# per null hypothesis weight. The raw weights are not changed, the motion
+	# weights within each batch are normalized by ConstraintMotions.normalizedWeights()
+	def normalizedBatchWeights(self,null_hypothesis_weight=0.0):
+		if self.normalized is None:
+			self.normalized = dict()
+		if not null_hypothesis_weight in self.normalized:
+			norm = sum([x.batch_weight for x in self.motion_batches]) + null_hypothesis_weight
+			self.normalized[null_hypothesis_weight] = [ b.batch_weight / norm for b in self.motion_batches ]
+
+		return self.normalized[null_hypothesis_weight]
+
+	# ordering for output: simple edges first, sequential before loops, then
+	# by reference, number of hyper components and targets
+	def sortKey(self):
+		if self._sort_key is None:
+			simple = self.isSimple()
+			self._sort_key = (
+				0 if simple else 1,
+				1 if simple and self.isSimpleLoop() else 0,
+				self.reference,
+				len(self.motion_batches),
+				) + tuple(self.targets())
+
+		return self._sort_key
 
-	def normalize(self,null_hypothesis_weight=0.0):
-		norm = sum([x.batch_weight for x in self.motion_batches]) + null_hypothesis_weight
-
-		for i in range(0,len(self.motion_batches)):
-			self.motion_batches[i].batch_weight /= norm
-
-			self.motion_batches[i].normalize()
-
-	# ordering for output
 	def __lt__(self,other):
-		ms=self.isSimple()
-		os=other.isSimple()
-
-		if ms and not os:
-			return True
-		if os and not ms:
-			return False
-
-		if ms and os:
-			ml=self.isSimpleLoop()
-			ol=other.isSimpleLoop()
-
-			if ml and not ol:
-				return False
-			if ol and not ml:
-				return True
-
-		if self.reference < other.reference:
-			return True
-		elif self.reference > other.reference:
-			return False
-
-		if len(self.motion_batches) < len(other.motion_batches):
-			return True
-		elif len(self.motion_batches) > len(other.motion_batches):
-			return False
-
-		for i in range(0,len(self.motion_batches)):
-			if self.motion_batches[i].target < other.motion_batches[i].target:
-				return True
-			elif self.motion_batches[i].target > other.motion_batches[i].target:
-				return False
-
-		return False # same
+		return self.sortKey() < other.sortKey()
 
 
 
@@ -169,6 +255,12 @@ class base_g2o_output(object):
 	def setFile(self,out):
 		self.out = out
 
+	# null hypothesis weights output_edge normalizes with, as a pair of lists
+	# (for ConstraintBatch.normalizedBatchWeights, for ConstraintMotions.normalizedWeights),
+	# so the graph can normalize all edges at once before writing
+	def weight_normalizations(self):
+		return ([], [])
+
 	def output_vertex(self,i,v):
 		if not self.out:
 			raise ValueError("Don't have an output file!")
@@ -177,6 +269,25 @@ class base_g2o_output(object):
 		if i in self.graph.fixed:
 			print("FIX %d" % i, file=self.out)
 
+	# True if output_edge writes the same text for edge e no matter which other
+	# edges were written before, so the text can be reused while e is unchanged
+	def context_free(self,e):
+		return True
+
+	# all (id, pose) pairs, sorted by id
+	def output_vertices(self,vertices):
+		for i,v in vertices:
+			self.output_vertex(i,v)
+
+	# called once after all vertices and before output_edges, with all
+	# (key, edge) pairs in the order they will be written
+	def begin_edges(self,edges):
+		pass
+
+	def output_edges(self,edges):
+		for i,e in edges:
+			self.output_edge(i,e)
+
 	def output_edge(self,i,e):
 		if not self.out:
 			raise ValueError("Don't have an output file!")
@@ -185,17 +296,27 @@ class base_g2o_output(object):
 			print("ERROR: base_g2o_output can't process complex edges! id: %s" % i, file=sys.stderr)
 			return
 
-		print( "%s %d %d %s" %( self.edge_tag, e.reference, e.motion_batches[0].target, " ".join([str(x) for x in e.motion_batches[0].motions[0]]) ), file=self.out )
+		print( "%s %d %d %s" %( self.edge_tag, e.reference, e.motion_batches[0].target, e.motion_batches[0].motions[0].text() ), file=self.out )
 
 class Graph:
 	"""A class represeting a graph, maybe with outliers"""
 
 	def __init__(self, other=None):
 		if other:
-			self.V = deepcopy(other.V)
-			self.E = deepcopy(other.E)
-
-			self.fixed = deepcopy(other.fixed)
+			# bulk copy, without pausing the cyclic gc it would rescan the growing heap many times
+			gc_was_enabled = gc.isenabled()
+			gc.disable()
+			try:
+				self.copyVertices(other)
+				self.E = dict()
+				for k in other.edge_keys:
+					self.E[k] = other.E[k].copy()
+				self.edge_keys = list(other.edge_keys)
+			finally:
+				if gc_was_enabled:
+					gc.enable()
+
+			self.fixed = set(other.fixed)
 
 			self.vertex_tag = str(other.vertex_tag)
 			self.edge_tag = str(other.edge_tag)
@@ -212,6 +333,14 @@ class Graph:
 		self.V = dict()
 		self.E = dict()
 
+		# keys of V and E in the order they were added. Python 2 dicts iterate
+		# in hash table order, which depends on how the dict was built, so a
+		# copy may iterate differently. Copies replay this order (giving the
+		# same table), and what depends on the order (the adjacency for the bfs
+		# initialization, ties in the output order) follows it, not the dicts.
+		self.vertex_keys = []
+		self.edge_keys = []
+
 		self.fixed = set()
 
 		self.vertex_tag=None
@@ -221,6 +350,23 @@ class Graph:
 
 		self.adj = None
 
+	# replaces V by copies of the poses of other, added in the same order
+	def copyVertices(self, other):
+		self.V = dict()
+		for k in other.vertex_keys:
+			self.V[k] = list(other.V[k])
+		self.vertex_keys = list(other.vertex_keys)
+
+	# adds or replaces edge e
+	def setEdge(self, key, e):
+		if not key in self.E:
+			self.edge_keys.append(key)
+		self.E[key] = e
+
+	# (key, edge) pairs in the order the edges were added
+	def orderedEdges(self):
+		return [ (k, self.E[k]) for k in self.edge_keys ]
+
 	def make_edge_key(self,ref, targets):
 		key = str(ref)
 
@@ -233,18 +379,26 @@ class Graph:
 		return key
 
 
+	@metrics.timed("parse")
 	def readg2o(self,f):
 		self.V = dict()
 		self.E = dict()
+		self.vertex_keys = []
+		self.edge_keys = []
 		self.fixed = set()
 		self.adj = None
 		self.dim = None
 
+		tags = Counter() if metrics.current.enabled else None
+
 		for l in f:
 			elems = l.split()
 			if l[0] == '#' or len(elems) == 0:
 				continue
 
+			if tags is not None:
+				tags[elems[0]] += 1
+
 			if not self.dim and ( elems[0] == "VERTEX_SE2" or elems[0] == "EDGE_SE2" ):
 				self.dim = 2
 				self.edge_tag = "EDGE_SE2"
@@ -258,8 +412,10 @@ class Graph:
 			if elems[0] == self.vertex_tag:
 				if int(elems[1]) in self.V:
 					print("WARNING: already saw vertex %s, skipping this one" %(elems[1]), file=sys.stderr)
+					metrics.current.count("parse.duplicate_vertices")
 					continue
 				self.V[ int(elems[1]) ] = [float(x) for x in elems[2:]]
+				self.vertex_keys.append( int(elems[1]) )
 			elif elems[0] == "FIX":
 				self.fixed.add( int(elems[1]) )
 				#print("fixing %d" % int(elems[1]))
@@ -267,35 +423,163 @@ class Graph:
 				key = self.make_edge_key(elems[1], elems[2])
 				if key in self.E:
 					print("WARNING: already saw edge from %s to %s, skipping this one" %(elems[1],elems[2]), file=sys.stderr)
+					metrics.current.count("parse.duplicate_edges")
 					continue
 				self.E[key] = ConstraintBatch(True, False, int(elems[1]), int(elems[2]), elems)
+				self.edge_keys.append(key)
+
+		if tags is not None:
+			metrics.current.count_all("parse.lines.", tags)
 
 	def mapVertices(self,functor):
 		return map(lambda x: functor(*x), iter(sorted(self.V.items(), key=lambda x: x[0])) )
 
 	def mapEdges(self,functor):
-		return map(lambda x: functor(*x), iter(sorted(self.E.items(), key=lambda x: x[1])) )
-
+		return map(lambda x: functor(*x), iter(self.sortedEdges()) )
+
+	# output formats the measurement text of every motion only once, call this
+	# after changing motion values so it is formatted again (see Motion.text)
+	def invalidateMotionText(self):
+		for e in self.E.values():
+			for b in e.motion_batches:
+				for m in b.motions:
+					m.invalidate()
+			e.invalidate()
+
+	# (key, edge) pairs in output order, see ConstraintBatch.sortKey
+	@metrics.timed("sort")
+	def sortedEdges(self):
+		items = self.orderedEdges()
+		metrics.current.count("sort.edges", len(items))
+		if not items:
+			return items
+
+		keys = [e.sortKey() for k,e in items]
+
+		# targets differ in length, pad them. Only edges with the same number of
+		# targets are compared on them, so the padding value does not matter.
+		width = max([len(k) for k in keys])
+		padded = np.array([ k + (-1,)*(width-len(k)) for k in keys ], dtype=np.int64)
+
+		# lexsort is stable and sorts by the last key first
+		order = np.lexsort(padded.T[::-1])
+
+		return [ items[i] for i in order ]
+
+	@metrics.timed("write")
 	def writeg2o(self,f,g2o_output_functor=None):
 		if not g2o_output_functor:
 			g2o_output_functor = base_g2o_output(self)
 
 		g2o_output_functor.setFile(f)
 
-		self.mapVertices( lambda i,v: g2o_output_functor.output_vertex(i,v) )
-		self.mapEdges(    lambda i,e: g2o_output_functor.output_edge(i,e)   )
+		self.normalizeWeights(*g2o_output_functor.weight_normalizations())
+
+		g2o_output_functor.output_vertices( sorted(self.V.items(), key=lambda x: x[0]) )
+
+		edges = self.sortedEdges()
+		g2o_output_functor.begin_edges(edges)
+		g2o_output_functor.output_edges(edges)
+
+		metrics.current.count("write.vertices", len(self.V))
+		metrics.current.count("write.edges", len(edges))
+
+	# writes the graph to several outputs, vertices and edges are sorted only once.
+	# outputs is a list of (file, g2o_output_functor) pairs.
+	@metrics.timed("write")
+	def writeg2oMany(self,outputs):
+		functors = []
+		edge_null_weights = []
+		motion_null_weights = []
+		for f,functor in outputs:
+			functor.setFile(f)
+			functors.append(functor)
+
+			(e_nw, m_nw) = functor.weight_normalizations()
+			edge_null_weights += e_nw
+			motion_null_weights += m_nw
+
+		self.normalizeWeights(edge_null_weights, motion_null_weights)
+
+		vertices = sorted(self.V.items(), key=lambda x: x[0])
+		edges = self.sortedEdges()
+
+		for functor in functors:
+			functor.output_vertices(vertices)
+			functor.begin_edges(edges)
+			functor.output_edges(edges)
+
+		metrics.current.count("write.vertices", len(vertices) * len(functors))
+		metrics.current.count("write.edges", len(edges) * len(functors))
+
+	# fills the normalized weight caches of all edges with more than one
+	# hypothesis for the given null hypothesis weights, in one go on the packed
+	# weights of the graph instead of edge by edge. Normalizing an edge also
+	# normalizes the motions of its batches (with null hypothesis weight 0).
+	@metrics.timed("normalize")
+	def normalizeWeights(self, edge_null_weights=[], motion_null_weights=[]):
+		edge_null_weights = set(edge_null_weights)
+		motion_null_weights = set(motion_null_weights)
+		if edge_null_weights:
+			motion_null_weights.add(0.0)
+		if not motion_null_weights:
+			return
+
+		edges = [e for e in self.E.values() if not e.isSimple()]
+		if not edges:
+			return
+		batches = [b for e in edges for b in e.motion_batches]
+
+		batch_counts = [len(e.motion_batches) for e in edges]
+		motion_counts = [len(b.motions) for b in batches]
+		batch_edge = np.repeat(np.arange(len(edges)), np.array(batch_counts, dtype=np.int64))
+		motion_batch = np.repeat(np.arange(len(batches)), np.array(motion_counts, dtype=np.int64))
+
+		batch_weights = np.array([b.batch_weight for b in batches], dtype=np.float64)
+		motion_weights = np.array([m.weight for b in batches for m in b.motions], dtype=np.float64)
+
+		metrics.current.count("normalize.edges", len(edges) * len(edge_null_weights))
+		metrics.current.count("normalize.motions", len(motion_weights) * len(motion_null_weights))
+
+		# bincount adds up in order, so the sums are the same as with sum() per edge
+		edge_sums = np.bincount(batch_edge, weights=batch_weights, minlength=len(edges))
+		batch_sums = np.bincount(motion_batch, weights=motion_weights, minlength=len(batches))
+
+		for nw in edge_null_weights:
+			normalized = (batch_weights / (edge_sums + nw)[batch_edge]).tolist()
+			k = 0
+			for e,n in zip(edges, batch_counts):
+				if e.normalized is None:
+					e.normalized = dict()
+				e.normalized[nw] = normalized[k:k+n]
+				k += n
+
+		for nw in motion_null_weights:
+			normalized = (motion_weights / (batch_sums + nw)[motion_batch]).tolist()
+			k = 0
+			for b,n in zip(batches, motion_counts):
+				if b.normalized is None:
+					b.normalized = dict()
+				b.normalized[nw] = normalized[k:k+n]
+				k += n
 
 	# adds outliers to this graph, can be called multiple times to add outliers from many files
+	@metrics.timed("outliers")
 	def readExtraOutliers(self, f):
 		current_outlier_batch=None
 		current_motions=None
 		next_weight = 1.0
 
+		tags = Counter() if metrics.current.enabled else None
+
 		for l in f:
 			elems = l.split()
 			if l[0] == '#' or len(elems) == 0:
 				continue
 
+			if tags is not None:
+				tags[elems[0]] += 1
+
 			if (elems[0] == "EDGE_SE2" and self.dim != 2) or (elems[0] == "EDGE_SE3:QUAT" and self.dim != 3):
 				raise ValueError("You tried to load outliers with a different dimension than the original g2o graph!")
 
@@ -329,14 +613,17 @@ class Graph:
 				if not current_outlier_batch.has_inlier:
 					key=self.make_edge_key(current_outlier_batch.reference,current_outlier_batch.targets())
 					
-					self.E[key] = current_outlier_batch
+					self.setEdge(key, current_outlier_batch)
+
+		if tags is not None:
+			metrics.current.count_all("outliers.lines.", tags)
 
 
-	# needed for traversal
+	# needed for traversal, edges of a vertex in the order they were added
 	def buildAdjacency(self):
 		self.adj = dict()
 
-		for key,e in self.E.iteritems():
+		for key,e in self.orderedEdges():
 			for v in [e.reference] + e.targets():
 				if not v in self.adj:
 					self.adj[v]=[]
@@ -356,6 +643,7 @@ class Graph:
 			if self.E[k].isSimpleLoop():
 				self.E[k].has_null_hypothesis = True
 
+	@metrics.timed("init_seq")
 	def initializePosesSequential(self):
 		if len(self.fixed) != 1:
 			print("Don't know how to sequentially initialize with more than one fixed vertex, have %d" % len(self.fixed), file=sys.stderr)
@@ -372,6 +660,7 @@ class Graph:
 			c = m.getMaxMotion()
 
 			self.V[v_next] = pu.compound( self.V[v_cur], c.mean, False)
+			metrics.current.count("init.compound")
 			v_cur=v_next
 			v_next=v_cur+1
 			key = self.make_edge_key(v_cur, v_next)
@@ -386,12 +675,14 @@ class Graph:
 			c = ee.getMaxMotion()
 
 			self.V[v_next] = pu.compound( self.V[v_cur], c.mean, True)
+			metrics.current.count("init.compound")
 			v_cur=v_next
 			v_next=v_cur-1
 			key = self.make_edge_key(v_cur, v_next)
 
 
 
+	@metrics.timed("init_bfs")
 	def intializePosesBFS(self,with_null=True):
 		self.buildAdjacency()
 
@@ -443,6 +734,7 @@ class Graph:
 
 			#print("*** Assigned %d" % next_i)
 			assigned.add(next_i)
+			metrics.current.count("init.compound")
 
 			for a in self.adj[next_i]:
 				#print("%s is adj to %d" %(a, next_i))
@@ -452,8 +744,191 @@ class Graph:
 
 		#print("len(queue): %d, len(assigned): %d, len(self.V): %d" %(len(queue), len(assigned), len(self.V)))
 
+	# python heap memory of this graph by category (see MEMORY_CATEGORIES) as a
+	# dict: bytes and objects per category, counts of vertices, edges, motion
+	# batches and motions, and bytes per vertex, edge and motion. The tables of
+	# V, E and adj are measured directly, their contents on a random sample of
+	# up to sample vertices, edges and adjacency lists (all of them if sample
+	# is None), scaled up to the whole graph.
+	def memory_report(self, sample=10000, seed=0):
+		rng = random.Random(seed)
+		def pick(keys):
+			keys = list(keys)
+			if sample is None or len(keys) <= sample:
+				return (keys, 1.0)
+			return (rng.sample(keys, sample), len(keys) / float(sample))
+
+		sizes = dict([ (c, [0, 0]) for c in MEMORY_CATEGORIES ])
+		counts = dict(vertices=len(self.V), edges=len(self.E), motion_batches=0, motions=0)
+		seen = set()
+
+		def add(category, measured, scale=1.0):
+			sizes[category][0] += measured[0] * scale
+			sizes[category][1] += measured[1] * scale
+
+		add("tables", object_size(self.V, seen, follow=False))
+		add("tables", object_size(self.E, seen, follow=False))
+		add("tables", object_size(self.fixed, seen))
+		add("tables", object_size(self.vertex_keys, seen, follow=False))
+		add("tables", object_size(self.edge_keys, seen, follow=False))
+
+		(keys, scale) = pick(self.V)
+		for k in keys:
+			add("vertices", object_size(k, seen), scale)
+			add("vertices", object_size(self.V[k], seen), scale)
+
+		(keys, scale) = pick(self.E)
+		for k in keys:
+			e = self.E[k]
+			add("edge_keys", object_size(k, seen), scale)
+			add("edges", object_size(e, seen, skip=["normalized", "rendered"]), scale)
+			add("weight_caches", object_size(e.normalized, seen), scale)
+			add("text_caches", object_size(e.rendered, seen), scale)
+
+			for b in e.motion_batches:
+				counts["motion_batches"] += scale
+				add("motion_batches", object_size(b, seen, skip=["normalized"]), scale)
+				add("weight_caches", object_size(b.normalized, seen), scale)
+
+				for m in b.motions:
+					counts["motions"] += scale
+					add("motions", object_size(m, seen, skip=["_text", "_mean_text"]), scale)
+					add("text_caches", object_size(m._text, seen), scale)
+					add("text_caches", object_size(m._mean_text, seen), scale)
+
+		if self.adj:
+			add("adjacency", object_size(self.adj, seen, follow=False))
+			(keys, scale) = pick(self.adj)
+			for v in keys:
+				add("adjacency", object_size(v, seen), scale)
+				add("adjacency", object_size(self.adj[v], seen, follow=False), scale)
+
+		categories = dict([ (c, dict(bytes=int(round(b)), objects=int(round(n)))) for c,(b,n) in sizes.items() ])
+		counts = dict([ (c, int(round(n))) for c,n in counts.items() ])
+
+		def per(categories_of, n):
+			return sum([ sizes[c][0] for c in categories_of ]) / n if n else 0.0
+
+		return dict(categories=categories, counts=counts,
+			total_bytes=int(round(sum([ b for b,n in sizes.values() ]))),
+			per_vertex=per(["vertices"], counts["vertices"]),
+			per_edge=per(["edge_keys", "edges", "motion_batches", "motions", "weight_caches", "text_caches"], counts["edges"]),
+			per_motion=per(["motions"], counts["motions"]),
+			sampled=sample is not None and max(len(self.V), len(self.E)) > sample)
+
+
+# categories of Graph.memory_report: the dicts and set of the graph itself
+# (without contents), vertex ids and poses, edge keys, ConstraintBatch,
+# ConstraintMotions and Motion objects with their attributes, cached
+# normalized weights, cached text (Motion.text(), ConstraintBatch.rendered)
+# and the adjacency lists (without the edge keys, counted as edge_keys)
+MEMORY_CATEGORIES = ["tables", "vertices", "edge_keys", "edges", "motion_batches", "motions", "weight_caches", "text_caches", "adjacency"]
+
+GRAPH_CLASSES = (ConstraintBatch, ConstraintMotions, Motion)
+
+# (bytes, python objects) of obj and what it contains, except for objects in
+# seen (ids, updated), attributes of graph objects in skip and graph objects
+# other than obj itself (they are counted in their own category). Without
+# follow, only obj itself is counted.
+def object_size(obj, seen, skip=(), follow=True):
+	if obj is None:
+		return (0, 0)
+
+	size = 0
+	count = 0
+	stack = [obj]
+	while stack:
+		o = stack.pop()
+		if id(o) in seen:
+			continue
+		if o is not obj and isinstance(o, GRAPH_CLASSES):
+			continue
+		seen.add(id(o))
+		size += sys.getsizeof(o)
+		count += 1
+
+		if not follow:
+			break
+
+		if isinstance(o, GRAPH_CLASSES):
+			# attributes are slots, their references are part of getsizeof(o)
+			stack.extend([ getattr(o, k, None) for k in o.__slots__ if not k in skip ])
+		elif isinstance(o, dict):
+			stack.extend(o.keys())
+			stack.extend(o.values())
+		elif isinstance(o, (list, tuple, set, frozenset)):
+			stack.extend(o)
+
+	return (size, count)
+
+def format_memory_report(report):
+	total = float(report["total_bytes"]) or 1.0
+	lines = ["%-16s %12s %12s %7s" % ("category", "objects", "MB", "%")]
+	for c in MEMORY_CATEGORIES:
+		d = report["categories"][c]
+		lines.append("%-16s %12d %12.2f %6.1f%%" % (c, d["objects"], d["bytes"] / 1048576.0, 100 * d["bytes"] / total))
+	lines.append("%-16s %12d %12.2f" % ("total", sum([ d["objects"] for d in report["categories"].values() ]), report["total_bytes"] / 1048576.0))
+	lines.append("")
+	lines.append("%(vertices)d vertices, %(edges)d edges, %(motion_batches)d motion batches, %(motions)d motions" % report["counts"] + (" (estimated from a sample)" if report["sampled"] else ""))
+	lines.append("bytes per vertex %.0f, per edge %.0f, per motion %.0f" % (report["per_vertex"], report["per_edge"], report["per_motion"]))
+	return "\n".join(lines)
+
 
 def readg2o(f):
 	g=Graph()
 	g.readg2o(f)
-	return g
\ No newline at end of file
+	return g
+
+
+# vertex-only reader, e.g. for evaluating optimizer outputs. Everything but
+# VERTEX_SE2/VERTEX_SE3:QUAT lines is skipped by a cheap prefix check, so this
+# also works for files with edge types readg2o does not understand (switchable,
+# hypermog, ...). If stop_after (a collection of vertex ids) is given, reading
+# stops as soon as all of these have been seen.
+# returns (ids, poses) as numpy arrays, sorted by vertex id like mapVertices.
+@metrics.timed("parse_vertices")
+def readg2oVertices(f, stop_after=None):
+	ids = []
+	poses = []
+	seen = set()
+	vertex_tag = None
+
+	remaining = None
+	if stop_after is not None:
+		remaining = set(stop_after)
+
+	for l in f:
+		if not l.startswith("VERTEX_SE"):
+			continue
+
+		elems = l.split()
+
+		if not vertex_tag and ( elems[0] == "VERTEX_SE2" or elems[0] == "VERTEX_SE3:QUAT" ):
+			vertex_tag = elems[0]
+
+		if elems[0] != vertex_tag:
+			continue
+
+		i = int(elems[1])
+		if i in seen:
+			print("WARNING: already saw vertex %s, skipping this one" %(elems[1]), file=sys.stderr)
+			metrics.current.count("parse_vertices.duplicate_vertices")
+			continue
+		seen.add(i)
+
+		ids.append(i)
+		poses.append([float(x) for x in elems[2:]])
+
+		if remaining is not None:
+			remaining.discard(i)
+			if not remaining:
+				break
+
+	metrics.current.count("parse_vertices.vertices", len(ids))
+
+	ids = np.array(ids, dtype=np.int64)
+	poses = np.array(poses, dtype=np.float64)
+
+	order = np.argsort(ids, kind='mergesort')
+
+	return ids[order], poses[order]
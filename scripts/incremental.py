@@ -0,0 +1,286 @@
+from __future__ import print_function
+
+import gc
+from StringIO import StringIO
+
+import graph as G
+import converters
+
+# Incremental conversion of outlier files that extend each other, like the ones
+# the generator scripts create with --previous-outliers (10 outliers, then the
+# same 10 and 90 more, and so on).
+#
+# An outlier file is a list of LOOP_OUTLIER_BATCH blocks, one per edge. If all
+# edges of a previous conversion are still in the next file, the next graph is
+# the previous one plus the new blocks, and blocks that changed (e.g. an inlier
+# edge that got more outlier motions) replace their edge. Only those blocks are
+# parsed, and only their edges are formatted again: the text of all other edges
+# is kept on the edges (ConstraintBatch.rendered), vertices are formatted once
+# for all formats. Files that do not extend a
+# previous one are converted from scratch. Either way, the output is the same as
+# the one of the convert_to_*.py scripts.
+
+# the LOOP_OUTLIER_BATCH blocks of an outlier file as a list of (edge key, block
+# text, has inlier), or None if the blocks are not independent of each other
+# (e.g. an edge line that uses the MOTION_WEIGHT of the block before it)
+def split_blocks(g, text):
+	blocks = []
+	keys = set()
+
+	current = None
+	for l in text.splitlines(True):
+		elems = l.split()
+		if len(elems) == 0 or l[0] == '#':
+			if current is not None:
+				current.append(l)
+			continue
+
+		if elems[0] == 'LOOP_OUTLIER_BATCH':
+			if current is not None:
+				return None
+			current = [l]
+			header = elems
+			targets = []
+			has_weight = False
+			continue
+
+		if current is None:
+			return None
+		current.append(l)
+
+		if elems[0] == 'MOTION_OUTLIER_BATCH':
+			if not int(elems[1]) in targets:
+				targets.append(int(elems[1]))
+
+		elif elems[0] == 'MOTION_WEIGHT':
+			has_weight = True
+
+		elif elems[0] == g.edge_tag:
+			if not has_weight:
+				return None
+
+		elif elems[0] == 'LOOP_OUTLIER_BATCH_END':
+			has_inlier = header[3] == '1'
+			if has_inlier:
+				key = g.make_edge_key(header[1], header[4])
+			else:
+				key = g.make_edge_key(int(header[1]), targets)
+
+			# two blocks for one edge depend on their order
+			if key in keys:
+				return None
+			keys.add(key)
+
+			blocks.append( (key, "".join(current), has_inlier) )
+			current = None
+
+	if current is not None:
+		return None
+
+	return blocks
+
+
+# the vertices of g as written by base_g2o_output, the same in all formats
+def vertex_text(g):
+	out = StringIO()
+	output = G.base_g2o_output(g)
+	output.setFile(out)
+	output.output_vertices( sorted(g.V.items(), key=lambda x: x[0]) )
+	return out.getvalue()
+
+def writes_plain_vertices(output):
+	cls = type(output)
+	return cls.output_vertex.__func__ is G.base_g2o_output.output_vertex.__func__ and cls.output_vertices.__func__ is G.base_g2o_output.output_vertices.__func__
+
+
+class cached_output(object):
+	"""Passes everything on to an output, but writes already formatted vertices
+	(if not None) as one block. For context free edges, the text output_edge
+	writes is kept on the edge, to write it again as long as the edge does not
+	change."""
+
+	def __init__(self, output, signature, vertices=None):
+		self.output = output
+		self.signature = signature
+		self.vertices = vertices
+
+	def __getattr__(self, name):
+		return getattr(self.output, name)
+
+	def output_vertices(self,vertices):
+		if self.vertices is None:
+			self.output.output_vertices(vertices)
+		else:
+			self.output.out.write(self.vertices)
+
+	def output_edges(self,edges):
+		texts = []
+		for i,e in edges:
+			text = e.rendered.get(self.signature) if e.rendered else None
+
+			if text is None:
+				out = self.output.out
+				self.output.out = StringIO()
+				try:
+					self.output.output_edge(i,e)
+					text = self.output.out.getvalue()
+				finally:
+					self.output.out = out
+
+				if self.output.context_free(e):
+					if e.rendered is None:
+						e.rendered = dict()
+					e.rendered[self.signature] = text
+
+			texts.append(text)
+
+		self.output.out.write("".join(texts))
+
+
+class chain_state(object):
+	def __init__(self, graph, blocks):
+		self.graph = graph
+		self.blocks = dict([ (key, text) for (key, text, has_inlier) in blocks ])
+
+
+class IncrementalConverter(object):
+	"""Converts outlier files on top of one base graph into the same formats, reusing the previous conversion when a file extends it.
+
+	outputs is a list of (format name, options dict), prepare_options are passed on
+	to converters.prepare(). Up to max_chains previous conversions are kept, for
+	chains that are interleaved (e.g. several trials).
+	"""
+
+	def __init__(self, base, outputs, max_chains=4, **prepare_options):
+		self.base = base
+		self.outputs = outputs
+		self.max_chains = max_chains
+		self.prepare_options = prepare_options
+
+		self.chains = []
+		self.base_vertices = None # formatted vertices of base, if they are not initialized
+
+		self.extended = 0
+		self.from_scratch = 0
+
+	# the kept conversion the blocks extend with the most unchanged blocks, or None
+	def find_chain(self, blocks):
+		if blocks is None:
+			return None
+
+		current = dict([ (key, text) for (key, text, has_inlier) in blocks ])
+
+		best = None
+		best_unchanged = -1
+		for chain in self.chains:
+			if not all([ key in current for key in chain.blocks ]):
+				continue
+
+			unchanged = len([ key for key,text in chain.blocks.items() if current[key] == text ])
+			if unchanged > best_unchanged:
+				best = chain
+				best_unchanged = unchanged
+
+		return best
+
+	def extend(self, chain, blocks):
+		g = chain.graph
+
+		for (key, text, has_inlier) in blocks:
+			if chain.blocks.get(key) == text:
+				continue
+
+			# outliers of an inlier edge are added to it, so start again from the original edge
+			if has_inlier:
+				g.E[key] = self.base.E[key].copy()
+
+			g.readExtraOutliers(StringIO(text))
+
+		# edges in the order reading the whole file into a copy of the base graph
+		# adds them (see Graph.edge_keys), that order decides the bfs
+		# initialization and ties in the edge order
+		edge_keys = list(self.base.edge_keys)
+		edge_keys += [ key for (key, text, has_inlier) in blocks if not key in self.base.E ]
+
+		if len(edge_keys) != len(g.E):
+			raise ValueError("Edges of the previous conversion are missing from the extended one")
+
+		E = dict()
+		for key in edge_keys:
+			E[key] = g.E[key]
+		g.E = E
+		g.edge_keys = edge_keys
+
+		chain.blocks = dict([ (key, text) for (key, text, has_inlier) in blocks ])
+
+	# converts the outliers in the file at outliers_path and writes the outputs
+	# to output_paths (one per output). Returns True if a previous conversion
+	# was extended, False if the file was converted from scratch.
+	def convert(self, outliers_path, output_paths):
+		# the kept graphs are large and long lived, without pausing the cyclic gc
+		# it would rescan them many times while the new edges are created
+		gc_was_enabled = gc.isenabled()
+		gc.disable()
+		try:
+			return self._convert(outliers_path, output_paths)
+		finally:
+			if gc_was_enabled:
+				gc.enable()
+
+	def _convert(self, outliers_path, output_paths):
+		with open(outliers_path, 'r') as f:
+			text = f.read()
+
+		blocks = split_blocks(self.base, text)
+		chain = self.find_chain(blocks)
+		extended = chain is not None
+
+		if extended:
+			# taken out first, a half extended graph must not be used again if this fails
+			self.chains.remove(chain)
+			self.extend(chain, blocks)
+		else:
+			g = G.Graph(self.base)
+			g.readExtraOutliers(StringIO(text))
+			chain = chain_state(g, blocks if blocks is not None else [])
+
+		g = chain.graph
+
+		initialize = self.prepare_options.get("do_seq") or self.prepare_options.get("do_bfs")
+
+		# initialization starts from the original poses every time
+		if initialize:
+			g.copyVertices(self.base)
+
+		converters.prepare(g, None, **self.prepare_options)
+
+		if initialize:
+			vertices = vertex_text(g)
+		else:
+			if self.base_vertices is None:
+				self.base_vertices = vertex_text(self.base)
+			vertices = self.base_vertices
+
+		files = []
+		try:
+			for (path, (fmt, options)) in zip(output_paths, self.outputs):
+				output = converters.make_output(g, fmt, options)
+				output = cached_output(output, (fmt, tuple(sorted(options.items()))), vertices if writes_plain_vertices(output) else None)
+				files.append( (open(path, 'w'), output) )
+
+			g.writeg2oMany(files)
+		finally:
+			for (f, output) in files:
+				f.close()
+
+		if blocks is not None:
+			self.chains.append(chain)
+			if len(self.chains) > self.max_chains:
+				self.chains.pop(0)
+
+		if extended:
+			self.extended += 1
+		else:
+			self.from_scratch += 1
+
+		return extended
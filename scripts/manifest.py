@@ -0,0 +1,161 @@
+from __future__ import print_function
+
+import os
+import json
+from modulefinder import ModuleFinder
+
+from result_cache import file_hash
+
+# Make-style up-to-date checks for the driver scripts (run_g2o.py, convert_many.py).
+#
+# Next to the first output of a job, a manifest (<output>.manifest, JSON)
+# records the content hashes of the job's inputs, of the tool that made it (the
+# executable or script and its modules) and of the outputs, and the command
+# line. A job is up to date if its manifest exists and all of that is still the
+# same, otherwise it has to run again. Files whose size and mtime match the
+# manifest are not hashed again, so checking a large experiment is cheap.
+#
+# The manifest of a job is removed before it runs and written only after it
+# succeeded, so a failed or interrupted job is never up to date.
+
+MANIFEST_VERSION = 1
+
+def manifest_path(output):
+	return output + ".manifest"
+
+# hashes of files, by (path, size, mtime), so shared inputs (e.g. the original
+# dataset of many conversions) are read only once per run
+hashes = dict()
+
+def describe(path):
+	path = os.path.realpath(path)
+	st = os.stat(path)
+
+	key = (path, st.st_size, st.st_mtime)
+	if not key in hashes:
+		hashes[key] = file_hash(path)
+
+	return dict(size=st.st_size, mtime=st.st_mtime, sha1=hashes[key])
+
+def describe_all(paths):
+	return dict([ (os.path.realpath(p), describe(p)) for p in paths ])
+
+def hashes_of(described):
+	return dict([ (p, d["sha1"]) for p,d in described.items() ])
+
+# True if the file at path has the recorded content, hashed only if size or mtime changed
+def unchanged(path, recorded):
+	if not os.path.isfile(path):
+		return False
+
+	st = os.stat(path)
+	if st.st_size != recorded["size"]:
+		return False
+	if st.st_mtime == recorded["mtime"]:
+		return True
+
+	return describe(path)["sha1"] == recorded["sha1"]
+
+# the files a tool consists of: the tool itself and, for a python script, the
+# modules it imports from its own directory (e.g. graph.py for the converters)
+def tool_files(tool):
+	tool = os.path.realpath(tool)
+	if not tool.endswith(".py"):
+		return [tool]
+
+	directory = os.path.dirname(tool)
+
+	finder = ModuleFinder(path=[directory])
+	try:
+		finder.run_script(tool)
+	except (ImportError, SyntaxError):
+		pass
+
+	files = set([tool])
+	for m in finder.modules.values():
+		if m.__file__ and os.path.dirname(os.path.realpath(m.__file__)) == directory:
+			files.add(os.path.realpath(m.__file__))
+
+	return sorted(files)
+
+
+class Tracker(object):
+	"""Up-to-date checks and manifests for jobs of one tool.
+
+	extra_tools are further scripts or modules the outputs depend on (e.g.
+	when the tool runs in this process).
+
+	A job is given by its outputs (the manifest is written next to the first),
+	its input files and its command (any JSON serializable list, it should
+	include everything else the outputs depend on, like options).
+	"""
+
+	def __init__(self, tool, extra_tools=[]):
+		files = set(tool_files(tool))
+		for t in extra_tools:
+			files.update(tool_files(t))
+		self.tool = describe_all(sorted(files))
+
+		self.up_to_date = 0
+		self.outdated = 0
+
+	# returns None if the job is up to date, otherwise why it has to run
+	def check(self, outputs, inputs, command):
+		path = manifest_path(outputs[0])
+		if not os.path.exists(path):
+			self.outdated += 1
+			return "no manifest"
+
+		reason = self._compare(path, outputs, inputs, command)
+		if reason:
+			self.outdated += 1
+		else:
+			self.up_to_date += 1
+		return reason
+
+	def _compare(self, path, outputs, inputs, command):
+		try:
+			with open(path, 'r') as f:
+				m = json.load(f)
+		except ValueError:
+			return "unreadable manifest"
+
+		if m.get("version") != MANIFEST_VERSION:
+			return "manifest of another version"
+
+		if m["command"] != command:
+			return "command changed"
+
+		if hashes_of(m["tool"]) != hashes_of(self.tool):
+			return "tool changed"
+
+		recorded = m["inputs"]
+		if sorted(recorded.keys()) != sorted([ os.path.realpath(p) for p in inputs ]):
+			return "inputs changed"
+		for p in inputs:
+			if not unchanged(p, recorded[os.path.realpath(p)]):
+				return "input '%s' changed" % p
+
+		recorded = m["outputs"]
+		for p in outputs:
+			if not os.path.realpath(p) in recorded:
+				return "outputs changed"
+			if not unchanged(p, recorded[os.path.realpath(p)]):
+				return "output '%s' missing or changed" % p
+
+		return None
+
+	# call before running a job
+	def begin(self, outputs):
+		path = manifest_path(outputs[0])
+		if os.path.exists(path):
+			os.remove(path)
+
+	# call after a job succeeded
+	def done(self, outputs, inputs, command):
+		m = dict(version=MANIFEST_VERSION, command=command, tool=self.tool, inputs=describe_all(inputs), outputs=describe_all(outputs))
+
+		path = manifest_path(outputs[0])
+		with open(path + ".tmp", 'w') as f:
+			json.dump(m, f, indent=1, sort_keys=True)
+		os.rename(path + ".tmp", path)
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import sys
+import json
+import resource
+import graph as G
+from utils import DefaultHelpParser
+
+
+if __name__ == "__main__":
+
+	parser = DefaultHelpParser(description='Read a g2o graph (and outlier files) like the converters do and report the memory the graph takes: bytes and python objects per category (vertices, edges, motions, caches, ...) and bytes per vertex, edge and motion. Large graphs are measured on a sample of vertices and edges. The difference to the peak RSS printed last is interpreter and allocator overhead and memory freed while reading.')
+
+	parser.add_argument("input", help="Path to the original dataset file (in g2o format).")
+	parser.add_argument("outliers", nargs="*", help="Outlier files to add to the graph, like the converters do.")
+	parser.add_argument("--sample", type=int, default=10000, help="Number of vertices and edges measured, 0 for all of them. Default: 10000")
+	parser.add_argument("--seed", type=int, default=0, help="Seed for picking the sample. Default: 0")
+	parser.add_argument("--adjacency", default=False, action='store_true', help="Build the adjacency (as for the breadth first initialization) before measuring.")
+	parser.add_argument("--text", default=False, action='store_true', help="Format the text of all motions (as writing does) before measuring, so the text caches are included.")
+	parser.add_argument("--json", help="Also write the report as JSON to this file.")
+
+	args = parser.parse_args()
+
+	with open(args.input, 'r') as f:
+		g = G.readg2o(f)
+
+	for path in args.outliers:
+		with open(path, 'r') as f:
+			g.readExtraOutliers(f)
+
+	if args.adjacency:
+		g.buildAdjacency()
+
+	if args.text:
+		for e in g.E.values():
+			for b in e.motion_batches:
+				for m in b.motions:
+					m.text()
+
+	report = g.memory_report(args.sample or None, args.seed)
+
+	print(G.format_memory_report(report))
+	print("peak RSS of this process: %.2f MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(report, f, indent=1, sort_keys=True)
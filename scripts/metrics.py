@@ -0,0 +1,138 @@
+from __future__ import print_function
+
+import sys
+import json
+import atexit
+import functools
+from timeit import default_timer as timer
+
+# Opt-in counters and phase timers for the graph operations (graph.py).
+#
+# current is a NullMetrics that does nothing until enable() (or --metrics of
+# utils.DefaultHelpParser) replaces it with a Metrics, so instrumented code
+# always calls metrics.current, never keeps a reference to it. Code that counts
+# per line checks current.enabled once and counts locally, everything else calls
+# count() directly.
+#
+# Phases nest (e.g. sort inside write): seconds of a phase include its nested
+# phases, self_seconds do not, so the self_seconds of all phases add up to the
+# time spent in phases.
+
+class Metrics(object):
+	"""Counters (name -> number) and timed phases (name -> calls, seconds, self_seconds)."""
+
+	enabled = True
+
+	def __init__(self):
+		self.counters = dict()
+		self.phases = dict()
+		self.running = []
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	# counts every key of a dict (e.g. a Counter of tags) as prefix + key
+	def count_all(self, prefix, counts):
+		for k,n in counts.items():
+			self.count(prefix + k, n)
+
+	def phase(self, name):
+		return Phase(self, name)
+
+	def to_dict(self):
+		phases = dict([ (k, dict(calls=c, seconds=s, self_seconds=ss)) for k,(c,s,ss) in self.phases.items() ])
+		return dict(counters=dict(self.counters), phases=phases)
+
+	def dump(self, f):
+		json.dump(self.to_dict(), f, sort_keys=True)
+
+
+class Phase(object):
+	"""Context manager timing one call of a phase of m."""
+
+	def __init__(self, m, name):
+		self.m = m
+		self.name = name
+		self.nested = 0.0
+
+	def __enter__(self):
+		self.m.running.append(self)
+		self.start = timer()
+		return self
+
+	def __exit__(self, *exc):
+		seconds = timer() - self.start
+		self.m.running.pop()
+		if self.m.running:
+			self.m.running[-1].nested += seconds
+
+		(calls, total, own) = self.m.phases.get(self.name, (0, 0.0, 0.0))
+		self.m.phases[self.name] = (calls + 1, total + seconds, own + seconds - self.nested)
+		return False
+
+
+class NullPhase(object):
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+class NullMetrics(object):
+	"""Does nothing, stands in for Metrics while metrics are off."""
+
+	enabled = False
+
+	def count(self, name, n=1):
+		pass
+
+	def count_all(self, prefix, counts):
+		pass
+
+	def phase(self, name):
+		return NullPhase()
+
+	def to_dict(self):
+		return dict(counters=dict(), phases=dict())
+
+
+current = NullMetrics()
+
+def enable():
+	global current
+	if not current.enabled:
+		current = Metrics()
+	return current
+
+# decorator timing every call of a function as phase name while metrics are on
+def timed(name):
+	def decorate(f):
+		@functools.wraps(f)
+		def wrapper(*args, **kwargs):
+			if not current.enabled:
+				return f(*args, **kwargs)
+			with current.phase(name):
+				return f(*args, **kwargs)
+		return wrapper
+	return decorate
+
+dump_paths = []
+
+# enables metrics and writes them as JSON to path ("-" for one line on stderr)
+# when the process exits, with the command line
+def dump_at_exit(path):
+	enable()
+	if not path in dump_paths:
+		dump_paths.append(path)
+		atexit.register(dump, path)
+
+def dump(path):
+	d = current.to_dict()
+	d["command"] = sys.argv
+
+	if path == "-":
+		print(json.dumps(d, sort_keys=True), file=sys.stderr)
+		return
+
+	with open(path, 'w') as f:
+		json.dump(d, f, indent=1, sort_keys=True)
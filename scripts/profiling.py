@@ -0,0 +1,106 @@
+from __future__ import print_function
+
+import os
+import sys
+import time
+import atexit
+import resource
+
+# Profiling of a whole script run, switched on with --profile of
+# utils.DefaultHelpParser (or the environment variable PROFILE_ENV, which child
+# processes inherit) and written when the script exits.
+#
+# Modes: cpu (cProfile), memory (tracemalloc where the python has it, peak RSS
+# otherwise) or all. Writes <prefix>.prof (cProfile stats, for pstats or
+# snakeviz) and <prefix>.txt, a short report with times, peak memory and the
+# top functions and allocation sites.
+#
+# Processes forked by multiprocessing exit without atexit handlers, so only the
+# process that parsed the command line is reported. Scripts started as
+# separate processes (e.g. by convert_many.py or run_experiment.py) report
+# themselves if the environment variable is set.
+
+PROFILE_ENV = "OUTLIER_GENERATOR_PROFILE"
+PROFILE_DIR_ENV = "OUTLIER_GENERATOR_PROFILE_DIR"
+
+MODES = ["cpu", "memory", "all"]
+
+# state of the running profile, empty if there is none
+active = dict()
+
+def default_prefix():
+	script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+	return os.path.join(os.environ.get(PROFILE_DIR_ENV, "."), "%s.%d" % (script, os.getpid()))
+
+# starts profiling this process until it exits, does nothing if it already is
+def start(mode, prefix=None, top=20):
+	if active:
+		return
+	if not mode in MODES:
+		print("WARNING: unknown profile mode '%s' (known are %s), not profiling" % (mode, ", ".join(MODES)), file=sys.stderr)
+		return
+
+	active.update(mode=mode, prefix=prefix or default_prefix(), top=top, wall=time.time(), times=os.times(), cpu=None, tracemalloc=None)
+
+	if mode in ["memory", "all"]:
+		try:
+			import tracemalloc
+			tracemalloc.start(10)
+			active["tracemalloc"] = tracemalloc
+		except ImportError:
+			pass
+
+	if mode in ["cpu", "all"]:
+		import cProfile
+		active["cpu"] = cProfile.Profile()
+		active["cpu"].enable()
+
+	atexit.register(stop)
+
+def stop():
+	if not active:
+		return
+
+	prof = active["cpu"]
+	if prof:
+		prof.disable()
+
+	tm = active["tracemalloc"]
+	snapshot = None
+	if tm:
+		(current, peak) = tm.get_traced_memory()
+		snapshot = tm.take_snapshot()
+		tm.stop()
+
+	prefix = active["prefix"]
+	directory = os.path.dirname(prefix)
+	if directory and not os.path.isdir(directory):
+		os.makedirs(directory)
+
+	times = os.times()
+	(user, system) = (times[0] - active["times"][0], times[1] - active["times"][1])
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+
+	with open(prefix + ".txt", 'w') as f:
+		print("command: %s" % " ".join(sys.argv), file=f)
+		print("wall %.3f s, user %.3f s, sys %.3f s, peak RSS %.1f MB" % (time.time() - active["wall"], user, system, usage.ru_maxrss / 1024.0), file=f)
+
+		if active["mode"] in ["memory", "all"]:
+			print("", file=f)
+			if snapshot is None:
+				print("memory: no tracemalloc in python %s, only peak RSS above" % sys.version.split()[0], file=f)
+			else:
+				print("memory: traced peak %.1f MB, %.1f MB still allocated at exit, largest allocation sites:" % (peak / 1048576.0, current / 1048576.0), file=f)
+				for stat in snapshot.statistics("lineno")[:active["top"]]:
+					print("  %s" % stat, file=f)
+
+		if prof:
+			import pstats
+			prof.dump_stats(prefix + ".prof")
+			for (key, name) in [("cumulative", "cumulative time"), ("tottime", "own time")]:
+				print("", file=f)
+				print("cpu: top %d functions by %s" % (active["top"], name), file=f)
+				pstats.Stats(prof, stream=f).sort_stats(key).print_stats(active["top"])
+
+	print("profile written to %s.txt%s" % (prefix, " and %s.prof" % prefix if prof else ""), file=sys.stderr)
+	active.clear()
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import subprocess
+from itertools import izip_longest
+from timeit import default_timer as timer
+
+import graph as G
+import converters
+from benchmark import call_forked, write_random_outliers, find_datasets, datasets_dir, metadata
+from result_cache import file_hash
+from utils import DefaultHelpParser
+
+# Regression checks for speed work on graph.py, pose_utils.py and the
+# converters: a fixed matrix of conversions (datasets x outlier sets x
+# initializations x option variants x formats) runs against a stored baseline.
+# A case fails if its output differs from the baseline's (token by token,
+# numbers within a tolerance), or if it got slower or needs more memory than
+# allowed.
+#
+# The baseline output of every case is written by its convert_to_*.py script
+# (run as a separate process), not by the in-process conversion that is timed,
+# and --update fails if the two are not byte for byte the same. So the harness
+# also fails if the conversion in process stops doing what the scripts do.
+#
+# Everything lives in one directory:
+#   corpus/      outlier files, written once with fixed seeds (no outlier
+#                generator needed), reused by all later runs
+#   baseline/    output of the script of every case with --update
+#   baseline.json  times, peak RSS and output hashes of the baseline, and
+#                the hashes of the corpus it was made with
+#   current/     output of the last check (or update), for inspecting differences
+#   current.json   results of the last check
+#
+# Every case runs in a forked child that reads its dataset and converts repeat
+# times. The fastest conversion counts, and it is compared to the slowest one of
+# the baseline, so timer noise alone does not make a case fail. Peak RSS is the child's, which is
+# comparable between runs because this process never reads a graph itself.
+
+DATASETS = ["ring", "manhattan", "sphere2500"]
+
+# name, seed, number of outlier batches as a fraction of the edges
+OUTLIER_SETS = [ ("r10", 1, 0.1) ]
+
+INITS = [ ("none", dict()), ("seq", dict(do_seq=True)), ("bfs", dict(do_bfs=True)) ]
+
+# name, prepare options, format options (each format takes the ones it has)
+VARIANTS = [
+	("default", dict(), dict()),
+	("options", dict(all_hyper=True, do_bfs_with_null=True), dict(weight_as_prior=True, group_switch_vertices=True, null_weight=1e-2, null_inf_factor=1e-9)),
+]
+
+def corpus_name(dataset, outlier_set):
+	return "%s-%s.outliers" % (dataset.replace("/", "_"), outlier_set)
+
+def make_cases(datasets, formats):
+	cases = []
+	for dataset in datasets:
+		for (outlier_set, seed, ratio) in OUTLIER_SETS:
+			for (init, init_options) in INITS:
+				for (variant, prepare_options, format_options) in VARIANTS:
+					for fmt in formats:
+						known = [ name for name,default in converters.formats[fmt][1] ]
+						prepare = dict(prepare_options)
+						prepare.update(init_options)
+						cases.append(dict(
+							name="-".join([ dataset.replace("/", "_"), outlier_set, init, variant, fmt ]),
+							dataset=dataset, outliers=corpus_name(dataset, outlier_set), format=fmt,
+							options=dict([ (k,v) for k,v in format_options.items() if k in known ]),
+							prepare=prepare))
+	return cases
+
+def write_corpus_file(dataset_path, path, seed, ratio):
+	with open(dataset_path, 'r') as f:
+		g = G.readg2o(f)
+	with open(path + ".tmp", 'w') as f:
+		write_random_outliers(g, f, max(1, int(ratio * len(g.E))), seed)
+	os.rename(path + ".tmp", path)
+
+# writes the outlier files of datasets that are missing in the corpus,
+# returns the hashes of all corpus files of these datasets
+def make_corpus(directory, datasets, paths):
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+
+	hashes = dict()
+	for dataset in datasets:
+		for (outlier_set, seed, ratio) in OUTLIER_SETS:
+			path = os.path.join(directory, corpus_name(dataset, outlier_set))
+			if not os.path.exists(path):
+				(result, error, peak_rss_kb) = call_forked(write_corpus_file, (paths[dataset], path, seed, ratio))
+				if error:
+					print("ERROR: could not write '%s': %s" % (path, error))
+					exit(1)
+				print("wrote %s" % path)
+			hashes[corpus_name(dataset, outlier_set)] = file_hash(path)
+	return hashes
+
+# runs in the child: reads the dataset, converts repeat times, returns the times
+def run_case(dataset_path, case, corpus, output, repeat):
+	with open(dataset_path, 'r') as f:
+		base = G.readg2o(f)
+
+	times = []
+	for r in range(repeat):
+		start = timer()
+		converters.convert(base, os.path.join(corpus, case["outliers"]), output, case["format"], case["options"], **case["prepare"])
+		times.append(timer() - start)
+	return times
+
+# writes the output of case with its convert_to_*.py script, returns None or an error
+def run_script(dataset_path, case, corpus, output, verbose):
+	script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "convert_to_%s.py" % case["format"])
+	command = [sys.executable, script, dataset_path, os.path.join(corpus, case["outliers"]), output]
+	command += converters.script_arguments(case["options"], case["prepare"])
+	with open(os.devnull, 'w') as devnull:
+		returncode = subprocess.call(command, stdout=None if verbose else devnull, stderr=None if verbose else devnull)
+	if returncode != 0:
+		return "'%s' exited with %d" % (" ".join(command), returncode)
+	return None
+
+# None if the files have the same tokens (numbers within atol + rtol * |expected|),
+# otherwise where they differ first
+def compare_outputs(expected, actual, rtol, atol):
+	with open(expected, 'r') as fe, open(actual, 'r') as fa:
+		for (n, (le, la)) in enumerate(izip_longest(fe, fa), 1):
+			if le == la:
+				continue
+			if le is None:
+				return "line %d: extra line '%s'" % (n, la.strip())
+			if la is None:
+				return "line %d: missing line '%s'" % (n, le.strip())
+
+			(te, ta) = (le.split(), la.split())
+			if len(te) != len(ta):
+				return "line %d: %d tokens instead of %d" % (n, len(ta), len(te))
+
+			for (a, b) in zip(te, ta):
+				if a == b:
+					continue
+				try:
+					(x, y) = (float(a), float(b))
+				except ValueError:
+					return "line %d: '%s' instead of '%s'" % (n, b, a)
+				if not abs(x - y) <= atol + rtol * abs(x):
+					return "line %d: %s instead of %s" % (n, b, a)
+	return None
+
+
+if __name__ == "__main__":
+
+	parser = DefaultHelpParser(description='Check that conversions still give the same output and did not get slower or bigger: runs a fixed matrix of conversions (bundled datasets x outlier files made with fixed seeds x initializations x option variants x formats) and compares them to a stored baseline. Output is compared token by token, numbers within a tolerance. Runs offline, the outlier files are made once and kept in the directory.')
+
+	parser.add_argument("directory", help="Directory of the corpus, the baseline and the last results.")
+	parser.add_argument("--update", default=False, action='store_true', help="Make (or replace) the baseline of the selected cases instead of checking against it. The baseline outputs are written by the convert_to_*.py scripts, a case fails if its conversion in process writes anything else.")
+	parser.add_argument("--datasets", nargs="+", default=DATASETS, help="Datasets to run (names as in datasets/, e.g. block-world/data_01). Default: %s" % " ".join(DATASETS))
+	parser.add_argument("--formats", nargs="+", choices=sorted(converters.formats.keys()), default=sorted(converters.formats.keys()), help="Formats to run. Default: all")
+	parser.add_argument("--repeat", type=int, default=3, help="Number of times every conversion is timed, the fastest counts. Default: 3")
+	parser.add_argument("--rtol", type=float, default=1e-9, help="Relative tolerance of numbers in the output. Default: 1e-9")
+	parser.add_argument("--atol", type=float, default=1e-12, help="Absolute tolerance of numbers in the output. Default: 1e-12")
+	parser.add_argument("--time-tolerance", type=float, default=0.25, help="A case fails if its fastest conversion takes this fraction longer than the slowest one of the baseline. Default: 0.25")
+	parser.add_argument("--min-time", type=float, default=0.1, help="Cases faster than this (seconds) in the baseline are not checked for time, they are too noisy. Default: 0.1")
+	parser.add_argument("--memory-tolerance", type=float, default=0.1, help="A case fails if its peak RSS is this fraction higher than in the baseline. Default: 0.1")
+	parser.add_argument("--outputs-only", default=False, action='store_true', help="Only compare outputs, not time and memory (e.g. on a different machine than the baseline).")
+	parser.add_argument("--verbose", default=False, action='store_true', help="Show what the conversions print.")
+
+	args = parser.parse_args()
+
+	paths = dict([ (n, p) for (n, p, r) in find_datasets(datasets_dir) ])
+	unknown = set(args.datasets) - set(paths.keys())
+	if unknown:
+		print("ERROR: unknown datasets: %s, known are: %s" % (", ".join(sorted(unknown)), ", ".join(sorted(paths.keys()))))
+		exit(1)
+
+	baseline_file = os.path.join(args.directory, "baseline.json")
+	corpus = os.path.join(args.directory, "corpus")
+	outputs = os.path.join(args.directory, "current")
+	baseline_outputs = os.path.join(args.directory, "baseline")
+
+	baseline = dict(cases=dict(), corpus=dict())
+	if os.path.exists(baseline_file):
+		with open(baseline_file, 'r') as f:
+			baseline = json.load(f)
+	elif not args.update:
+		print("ERROR: no baseline in '%s', make one with --update first" % args.directory)
+		exit(1)
+
+	hashes = make_corpus(corpus, args.datasets, paths)
+	changed = [ n for n,h in hashes.items() if n in baseline["corpus"] and baseline["corpus"][n] != h ]
+	if changed and not args.update:
+		print("ERROR: the corpus differs from the one of the baseline: %s" % ", ".join(sorted(changed)))
+		exit(1)
+
+	for d in [outputs, baseline_outputs] if args.update else [outputs]:
+		if not os.path.isdir(d):
+			os.makedirs(d)
+
+	cases = make_cases(args.datasets, args.formats)
+	if not args.update:
+		missing = [ c["name"] for c in cases if not c["name"] in baseline["cases"] ]
+		if missing:
+			print("WARNING: %d cases are not in the baseline, skipping them (e.g. %s)" % (len(missing), missing[0]))
+		cases = [ c for c in cases if c["name"] in baseline["cases"] ]
+
+	results = dict()
+	failed = 0
+
+	print("\t".join(["case", "status", "time s", "baseline s", "peak rss MB", "baseline MB"]))
+	for case in cases:
+		output = os.path.join(outputs, case["name"] + ".g2o")
+		(times, error, peak_rss_kb) = call_forked(run_case, (paths[case["dataset"]], case, corpus, output, args.repeat), args.verbose)
+
+		result = dict(peak_rss_kb=peak_rss_kb)
+		problems = []
+		if error:
+			problems.append("ERROR " + error)
+		else:
+			result.update(time=min(times), times=times, sha1=file_hash(output))
+
+		if args.update and not error:
+			script_output = os.path.join(baseline_outputs, case["name"] + ".g2o")
+			script_error = run_script(paths[case["dataset"]], case, corpus, script_output, args.verbose)
+			if script_error:
+				problems.append("ERROR " + script_error)
+			elif file_hash(script_output) != result["sha1"]:
+				problems.append("SCRIPT DIFF " + (compare_outputs(script_output, output, 0.0, 0.0) or "same numbers, different text"))
+
+		old = baseline["cases"].get(case["name"])
+		if old and not args.update and not error:
+			if result["sha1"] != old["sha1"]:
+				difference = compare_outputs(os.path.join(baseline_outputs, case["name"] + ".g2o"), output, args.rtol, args.atol)
+				if difference:
+					problems.append("DIFF " + difference)
+			if not args.outputs_only:
+				slowest = max(old.get("times", [old["time"]]))
+				if old["time"] >= args.min_time and result["time"] > slowest * (1 + args.time_tolerance):
+					problems.append("SLOW %.2fx" % (result["time"] / slowest))
+				if peak_rss_kb > old["peak_rss_kb"] * (1 + args.memory_tolerance):
+					problems.append("MEMORY %.2fx" % (peak_rss_kb / float(old["peak_rss_kb"])))
+
+		if problems:
+			failed += 1
+			result["problems"] = problems
+		results[case["name"]] = result
+
+		columns = [ case["name"], "; ".join(problems) or "ok" ]
+		columns += [ "%.4f" % result["time"] if "time" in result else "", "%.4f" % old["time"] if old else "" ]
+		columns += [ "%.1f" % (peak_rss_kb / 1024.0), "%.1f" % (old["peak_rss_kb"] / 1024.0) if old else "" ]
+		print("\t".join(columns))
+		sys.stdout.flush()
+
+	if args.update:
+		if failed:
+			print("ERROR: %d cases failed, baseline not updated" % failed)
+			exit(4)
+		baseline["cases"].update(results)
+		baseline["corpus"].update(hashes)
+		baseline["meta"] = metadata()
+		with open(baseline_file + ".tmp", 'w') as f:
+			json.dump(baseline, f, indent=1, sort_keys=True)
+		os.rename(baseline_file + ".tmp", baseline_file)
+		print("baseline of %d cases written to %s" % (len(results), baseline_file))
+		exit(0)
+
+	with open(os.path.join(args.directory, "current.json"), 'w') as f:
+		json.dump(dict(meta=metadata(), cases=results), f, indent=1, sort_keys=True)
+
+	print("*************************")
+	print("%d of %d cases failed" % (failed, len(results)))
+	if failed:
+		exit(4)
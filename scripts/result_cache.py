@@ -0,0 +1,87 @@
+from __future__ import print_function
+
+import os
+import hashlib
+import sqlite3
+
+# Persistent cache of per-file evaluation results in a local SQLite file.
+#
+# Results are keyed by the hash of the reference file, the metric version and
+# the candidate file. A candidate whose path, size and mtime match a cached
+# entry is returned without reading it. Otherwise its content hash is looked up,
+# so renamed or touched but unchanged files still hit the cache.
+
+def file_hash(path, blocksize=1<<20):
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		while True:
+			block = f.read(blocksize)
+			if not block:
+				break
+			h.update(block)
+	return h.hexdigest()
+
+
+class ResultCache(object):
+	def __init__(self, db_path, ref_hash, metric_version, commit_every=100):
+		self.db = sqlite3.connect(db_path)
+		self.ref_hash = ref_hash
+		self.metric_version = metric_version
+		self.commit_every = commit_every
+
+		self.pending = dict() # path -> (size, mtime, hash) of misses from lookup()
+		self.uncommitted = 0
+
+		self.hits = 0
+		self.misses = 0
+
+		self.db.execute("CREATE TABLE IF NOT EXISTS results (ref_hash TEXT, metric_version INTEGER, path TEXT, size INTEGER, mtime REAL, cand_hash TEXT, err_tr REAL, err_rot REAL, PRIMARY KEY (ref_hash, metric_version, path))")
+		self.db.execute("CREATE INDEX IF NOT EXISTS results_by_hash ON results (ref_hash, metric_version, cand_hash)")
+
+	# returns the cached (err_tr, err_rot) for the file at path, or None
+	def lookup(self, path):
+		path = os.path.realpath(path)
+		st = os.stat(path)
+
+		row = self.db.execute("SELECT err_tr, err_rot FROM results WHERE ref_hash=? AND metric_version=? AND path=? AND size=? AND mtime=?",
+			(self.ref_hash, self.metric_version, path, st.st_size, st.st_mtime)).fetchone()
+		if row:
+			self.hits += 1
+			return row
+
+		h = file_hash(path)
+
+		row = self.db.execute("SELECT err_tr, err_rot FROM results WHERE ref_hash=? AND metric_version=? AND cand_hash=?",
+			(self.ref_hash, self.metric_version, h)).fetchone()
+		if row:
+			self.hits += 1
+			self._insert(path, st.st_size, st.st_mtime, h, row)
+			return row
+
+		self.misses += 1
+		self.pending[path] = (st.st_size, st.st_mtime, h)
+		return None
+
+	def store(self, path, values):
+		path = os.path.realpath(path)
+
+		if path in self.pending:
+			(size, mtime, h) = self.pending.pop(path)
+		else:
+			st = os.stat(path)
+			(size, mtime, h) = (st.st_size, st.st_mtime, file_hash(path))
+
+		self._insert(path, size, mtime, h, values)
+
+	def _insert(self, path, size, mtime, h, values):
+		self.db.execute("INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?,?,?)",
+			(self.ref_hash, self.metric_version, path, size, mtime, h, values[0], values[1]))
+
+		self.uncommitted += 1
+		if self.uncommitted >= self.commit_every:
+			self.db.commit()
+			self.uncommitted = 0
+
+	def close(self):
+		self.db.commit()
+		self.db.close()
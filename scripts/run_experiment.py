@@ -0,0 +1,343 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import glob
+import shutil
+import hashlib
+import tempfile
+from multiprocessing import cpu_count
+from utils import DefaultHelpParser
+from result_cache import file_hash
+from scheduler import Scheduler, Job
+import manifest
+
+# Runs a whole experiment from a spec: outlier generation -> conversion ->
+# optimization -> errors, for every combination of datasets, generators (and/or
+# given outlier files), formats and optimizers.
+#
+# Every task runs in its own work directory on links to its inputs, and the
+# files it writes are stored by the sha1 of their content. A task's key is the
+# hash of its stage, parameters, the content of its tools (scripts with the
+# modules they import, executables) and the content hashes of its inputs, and
+# the store remembers which outputs each key produced. Tasks whose key is known
+# are not run again. Since keys use the content of inputs, a task that is run
+# again but writes the same files does not invalidate the stages after it.
+# Tasks of later stages are started as soon as their inputs are there, all
+# tasks share one scheduler with --jobs workers.
+#
+# Spec (JSON, relative paths are relative to the spec file):
+# {
+#   "datasets": {
+#     "ring": {"graph": "../datasets/ring/data.g2o",
+#              "reference": "../datasets/ring/groundtruth.g2o",   # optional, errors are computed against it
+#              "outliers": ["outliers/ring_*.outliers"]}            # optional, existing outlier files
+#   },
+#   "generators": {                                                # optional, run on every dataset
+#     "suenderhauf": {"script": "../generator_scripts/generate_loops_suenderhauf.py",
+#                     "outlier_generator": "../bin/outlier_generator", "args": []}
+#   },
+#   "formats": {                                                   # converter is the X of convert_to_X.py, default: the name
+#     "switchable": {"args": ["--use-weight-as-prior"]},
+#     "mog": {"converter": "hypermog", "args": ["--null-weight", "1e-4"]}
+#   },
+#   "optimizers": {                                                # g2o may be a python script, e.g. stub_g2o.py
+#     "gn20": {"g2o": "/opt/g2o/bin/g2o", "solver": "gn_var_cholmod", "iterations": 20,
+#              "args": [], "env": {"LD_LIBRARY_PATH": "/opt/g2o/lib"}}
+#   },
+#   "metrics": {"script": "compute_error.py", "args": []}          # optional, these are the defaults
+# }
+
+STORE_VERSION = 1
+
+scripts_dir = os.path.dirname(os.path.realpath(__file__))
+
+def makedirs(path):
+	if not os.path.isdir(path):
+		os.makedirs(path)
+
+
+class Store(object):
+	"""Files by the sha1 of their content, and the outputs of tasks by their key."""
+
+	def __init__(self, root):
+		self.root = os.path.abspath(root)
+		for d in ["objects", "actions", "tmp"]:
+			makedirs(os.path.join(root, d))
+
+	def object_path(self, h):
+		return os.path.join(self.root, "objects", h[:2], h)
+
+	# adds the file at path, moves it into the store if move is set, returns its hash
+	def add(self, path, move=False):
+		h = file_hash(path)
+		dest = self.object_path(h)
+
+		if not os.path.exists(dest):
+			makedirs(os.path.dirname(dest))
+			if move:
+				os.rename(path, dest)
+			else:
+				shutil.copyfile(path, dest + ".tmp")
+				os.rename(dest + ".tmp", dest)
+
+		return h
+
+	def action_path(self, key):
+		return os.path.join(self.root, "actions", key[:2], key + ".json")
+
+	# the outputs (name -> hash) of the task with this key, or None
+	def lookup(self, key):
+		path = self.action_path(key)
+		if not os.path.exists(path):
+			return None
+
+		with open(path, 'r') as f:
+			action = json.load(f)
+
+		outputs = action["outputs"]
+		if not all([ os.path.exists(self.object_path(h)) for h in outputs.values() ]):
+			return None
+
+		return dict([ (str(name), str(h)) for name,h in outputs.items() ])
+
+	def record(self, key, outputs, info):
+		path = self.action_path(key)
+		makedirs(os.path.dirname(path))
+
+		action = dict(info)
+		action["outputs"] = outputs
+		with open(path + ".tmp", 'w') as f:
+			json.dump(action, f, indent=1, sort_keys=True)
+		os.rename(path + ".tmp", path)
+
+	def workdir(self, key):
+		return tempfile.mkdtemp(prefix=key[:12] + "-", dir=os.path.join(self.root, "tmp"))
+
+
+def task_key(stage, tool, inputs, params):
+	return hashlib.sha1( json.dumps([STORE_VERSION, stage, tool, inputs, params], sort_keys=True) ).hexdigest()
+
+# command prefix to run a tool, python scripts run with this interpreter
+def tool_command(path):
+	if path.endswith(".py"):
+		return [sys.executable, path]
+	return [path]
+
+
+class Experiment(object):
+	"""The tasks of a spec on a store and a scheduler."""
+
+	def __init__(self, spec, base_dir, store, scheduler):
+		self.spec = spec
+		self.base_dir = base_dir
+		self.store = store
+		self.scheduler = scheduler
+
+		self.tools = dict() # path -> content hashes of its files
+
+		self.rows = [] # one per optimized graph, or per chain that failed before
+		self.run_tasks = 0
+		self.cached_tasks = 0
+		self.failed_tasks = 0
+
+	def resolve(self, path):
+		return os.path.normpath( os.path.join(self.base_dir, os.path.expanduser(path)) )
+
+	def tool_hashes(self, path):
+		if not path in self.tools:
+			self.tools[path] = sorted( manifest.hashes_of( manifest.describe_all( manifest.tool_files(path) ) ).values() )
+		return self.tools[path]
+
+	# runs command(work directory) with links to the inputs (name -> hash) in
+	# the work directory, unless the outputs are known already. then is called
+	# with the outputs (name -> hash), all files the command wrote to out/.
+	def submit(self, stage, row, tools, inputs, params, command, then, env=None):
+		key = task_key(stage, [ self.tool_hashes(t) for t in tools ], inputs, params)
+
+		outputs = self.store.lookup(key)
+		if outputs is not None:
+			self.cached_tasks += 1
+			then(outputs)
+			return
+
+		work = self.store.workdir(key)
+		os.mkdir(os.path.join(work, "out"))
+		for name,h in inputs.items():
+			os.symlink(self.store.object_path(h), os.path.join(work, name))
+
+		def done(job):
+			if job.status != "ok":
+				self.failed_tasks += 1
+				self.finish(row, "%s %s" % (stage, job.status))
+				shutil.rmtree(work, ignore_errors=True)
+				return
+
+			self.run_tasks += 1
+
+			outputs = dict()
+			out = os.path.join(work, "out")
+			for (dirpath, dirnames, filenames) in os.walk(out):
+				for name in filenames:
+					path = os.path.join(dirpath, name)
+					outputs[os.path.relpath(path, out)] = self.store.add(path, move=True)
+
+			self.store.record(key, outputs, dict(stage=stage, params=params, inputs=inputs, command=job.command))
+			shutil.rmtree(work, ignore_errors=True)
+			then(outputs)
+
+		name = "%s %s" % (stage, " ".join([ row[c] for c in ["dataset", "source", "outliers", "format", "optimizer"] if c in row ]))
+		self.scheduler.add( Job(name, command(work), env=env, cwd=work, done=done) )
+
+	def finish(self, row, status, errors=("", "")):
+		row = dict(row)
+		row["status"] = status
+		(row["err_tr"], row["err_rot"]) = errors
+		self.rows.append(row)
+
+	def run(self):
+		for (dataset, d) in sorted(self.spec["datasets"].items()):
+			graph = self.store.add( self.resolve(d["graph"]) )
+			reference = None
+			if "reference" in d:
+				reference = self.store.add( self.resolve(d["reference"]) )
+
+			row = dict(dataset=dataset)
+
+			for pattern in d.get("outliers", []):
+				for path in sorted(glob.glob( self.resolve(pattern) )):
+					r = dict(row, source="given", outliers=os.path.basename(path))
+					self.convert(r, graph, reference, self.store.add(path))
+
+			for (name, gen) in sorted(self.spec.get("generators", {}).items()):
+				self.generate(dict(row, source=name), graph, reference, gen)
+
+		self.scheduler.run()
+
+	def generate(self, row, graph, reference, gen):
+		script = self.resolve(gen["script"])
+		outlier_generator = self.resolve(gen["outlier_generator"])
+		args = gen.get("args", [])
+
+		def command(work):
+			return tool_command(script) + ["graph.g2o", "out", "--outlier-generator", outlier_generator] + args
+
+		def then(outputs):
+			for (name, h) in sorted(outputs.items()):
+				# resource usage the generator scripts record next to every outlier file
+				if name.endswith(".usage.jsonl"):
+					continue
+				self.convert(dict(row, outliers=name), graph, reference, h)
+
+		self.submit("generate", row, [script, outlier_generator], {"graph.g2o": graph}, dict(args=args), command, then)
+
+	def convert(self, row, graph, reference, outliers):
+		for (name, fmt) in sorted(self.spec["formats"].items()):
+			script = os.path.join(scripts_dir, "convert_to_%s.py" % fmt.get("converter", name))
+			args = fmt.get("args", [])
+
+			def command(work, script=script, args=args):
+				return tool_command(script) + ["graph.g2o", "outliers", "out/converted.g2o"] + args
+
+			def then(outputs, row=dict(row, format=name)):
+				self.optimize(row, reference, outputs["converted.g2o"])
+
+			self.submit("convert", dict(row, format=name), [script], {"graph.g2o": graph, "outliers": outliers}, dict(args=args), command, then)
+
+	def optimize(self, row, reference, converted):
+		for (name, opt) in sorted(self.spec["optimizers"].items()):
+			g2o = self.resolve(opt["g2o"])
+			params = dict(solver=opt.get("solver", "gn_var_cholmod"), iterations=opt.get("iterations", 20), args=opt.get("args", []), env=opt.get("env", {}))
+
+			env = os.environ.copy()
+			env.update(params["env"])
+
+			def command(work, g2o=g2o, p=params):
+				return tool_command(g2o) + p["args"] + ["-solver", p["solver"], "-i", str(p["iterations"]), "-o", "out/optimized.g2o", "-saveTiming", "out/optimized.time", "input.g2o"]
+
+			def then(outputs, row=dict(row, optimizer=name)):
+				row = dict(row, optimized=self.store.object_path(outputs["optimized.g2o"]))
+				if "optimized.time" in outputs:
+					row["timing"] = self.store.object_path(outputs["optimized.time"])
+				if reference is None:
+					self.finish(row, "ok")
+				else:
+					self.evaluate(row, reference, outputs["optimized.g2o"])
+
+			self.submit("optimize", dict(row, optimizer=name), [g2o], {"input.g2o": converted}, params, command, then, env=env)
+
+	def evaluate(self, row, reference, optimized):
+		metrics = self.spec.get("metrics", {})
+		script = self.resolve(metrics["script"]) if "script" in metrics else os.path.join(scripts_dir, "compute_error.py")
+		args = metrics.get("args", [])
+
+		def command(work):
+			return tool_command(script) + ["reference.g2o", "optimized.g2o", "-o", "out/errors.txt"] + args
+
+		def then(outputs):
+			with open(self.store.object_path(outputs["errors.txt"]), 'r') as f:
+				errors = f.read().split()
+			self.finish(row, "ok", tuple(errors[:2]) if len(errors) >= 2 else ("", ""))
+
+		self.submit("evaluate", row, [script], {"reference.g2o": reference, "optimized.g2o": optimized}, dict(args=args), command, then)
+
+	columns = ["dataset", "source", "outliers", "format", "optimizer", "status", "err_tr", "err_rot", "optimized", "timing"]
+
+	def write_results(self, f):
+		print("\t".join(self.columns), file=f)
+		for row in sorted(self.rows, key=lambda r: [ r.get(c, "") for c in self.columns ]):
+			print("\t".join([ row.get(c, "") for c in self.columns ]), file=f)
+
+
+if __name__ == "__main__":
+
+	parser = DefaultHelpParser(description='Run an experiment described by a JSON spec: generate outliers, convert, optimize and compute errors, for all combinations of datasets, generators, formats and optimizers. Results of all tasks are kept in a store by the hash of what they depend on, only tasks whose inputs, tools or parameters changed are run again.')
+
+	parser.add_argument("spec", help="Path to the experiment spec (JSON), see the top of this script.")
+	parser.add_argument("output_directory", help="Output directory, gets results.tsv with one line per optimized graph (errors and the paths of the optimized graph and its timing file in the store).")
+	parser.add_argument("--store", help="Directory of the artifact store, can be shared between experiments. Default: store in the output directory")
+	parser.add_argument("--jobs", type=int, default=cpu_count(), help="Number of tasks at the same time. Default: number of cpus (%d)" % cpu_count())
+	parser.add_argument("--timeout", type=float, help="Wall time limit for a single task in seconds.")
+
+	args = parser.parse_args()
+
+	with open(args.spec, 'r') as f:
+		try:
+			spec = json.load(f)
+		except ValueError as e:
+			print("ERROR: can't read spec: %s" % e)
+			exit(1)
+
+	for section in ["datasets", "formats", "optimizers"]:
+		if not spec.get(section):
+			print("ERROR: spec has no %s" % section)
+			exit(1)
+
+	for (name, fmt) in spec["formats"].items():
+		if not os.path.exists( os.path.join(scripts_dir, "convert_to_%s.py" % fmt.get("converter", name)) ):
+			print("ERROR: format '%s' has no converter convert_to_%s.py" % (name, fmt.get("converter", name)))
+			exit(1)
+
+	if os.path.exists(args.output_directory) and not os.path.isdir(args.output_directory):
+		print("ERROR: output dir exists, but is not a directory!")
+		exit(2)
+	makedirs(args.output_directory)
+
+	store = Store(args.store or os.path.join(args.output_directory, "store"))
+	scheduler = Scheduler(jobs=args.jobs, timeout=args.timeout)
+
+	experiment = Experiment(spec, os.path.dirname(os.path.realpath(args.spec)), store, scheduler)
+	experiment.run()
+
+	scheduler.summary()
+
+	with open(os.path.join(args.output_directory, "results.tsv"), 'w') as f:
+		experiment.write_results(f)
+
+	print("%d tasks run, %d cached, %d failed" % (experiment.run_tasks, experiment.cached_tasks, experiment.failed_tasks))
+
+	if experiment.failed_tasks:
+		exit(4)
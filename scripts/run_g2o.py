@@ -1,17 +1,18 @@
 #!/usr/bin/python
 
+from __future__ import print_function
 
 import argparse
 import sys
 import os
 import glob
 import traceback
-from subprocess import check_call
 from utils import DefaultHelpParser
+from scheduler import Scheduler, Job
 
 if __name__ == "__main__":
 
-	parser = DefaultHelpParser(description='Run g2o command line executable with options for many g2o files. Additional command line options are passed on to g2o.')
+	parser = DefaultHelpParser(description='Run g2o command line executable with options for many g2o files. Additional command line options are passed on to g2o. Wall time, CPU time and peak memory of every g2o run are appended to a JSON lines file next to its output (output file name + .usage.jsonl).')
 
 	parser.add_argument("graphs", nargs="+", help = "Filenames or glob patterns matching g2o files to be optimized.")
 	parser.add_argument("--g2o", default="/opt/g2o/bin/g2o", help="Path to the g2o executable")
@@ -21,20 +22,26 @@ if __name__ == "__main__":
 	parser.add_argument("--output-dir", help="Optional output directory other than the directory containing g2o files")
 	parser.add_argument("--output-prefix", help="Optional prefix that is prepended to the output file name")
 	parser.add_argument("--output-suffix", help="Optional suffix that is prepended to the output file name")
+	parser.add_argument("--jobs", type=int, default=1, help="Number of g2o runs at the same time. With more than one, the output of each run is printed when it finished. Default: 1")
+	parser.add_argument("--timeout", type=float, help="Wall time limit for a single g2o run in seconds. A run over the limit is killed (with everything it started) and counts as failed.")
+	parser.add_argument("--retries", type=int, default=0, help="Run failed or timed out g2o runs again up to this many times. Default: 0")
+	parser.add_argument("--on-failure", choices=["continue", "stop"], default="continue", help="What to do when a run failed for good: continue with the others, or stop and skip all runs that did not start yet. Runs already started are finished. Default: continue")
+	parser.add_argument("--skip-up-to-date", default=False, action='store_true', help="Write a manifest next to every optimized graph (output file name + .manifest) with hashes of the input graph, the g2o executable and both outputs, and the command line. Skip graphs whose outputs are up to date according to their manifest, run g2o only for missing or outdated ones.")
+	parser.add_argument("--cpus", type=int, nargs="+", help="Pin each concurrently running g2o to one of these CPUs, the k-th run at a time to the k-th CPU.")
 
 	(args, extra_args) = parser.parse_known_args()
 
 
-	print "Going to pass these args on to g2o:", extra_args
+	print("Going to pass these args on to g2o:", extra_args)
 
 	if not os.path.exists(args.g2o):
-		print "ERROR: g2o executable not valid!"
+		print("ERROR: g2o executable not valid!")
 		exit(1)
 
 	args.g2o = os.path.realpath(args.g2o)
 
 	if args.output_dir and os.path.exists(args.output_dir) and not os.path.isdir(args.output_dir):
-		print "ERROR: output dir is not a dir"
+		print("ERROR: output dir is not a dir")
 		exit(3)
 
 	if args.output_dir and not os.path.exists(args.output_dir):
@@ -57,10 +64,24 @@ if __name__ == "__main__":
 			env[name] = val
 
 
+	tracker = None
+	if args.skip_up_to_date:
+		import manifest
+		tracker = manifest.Tracker(args.g2o)
+
+	# writes the manifest after a successful run
+	def optimized(dependencies):
+		def done(job):
+			if job.status == "ok":
+				tracker.done(*dependencies)
+		return done
+
+	scheduler = Scheduler(jobs=args.jobs, timeout=args.timeout, retries=args.retries, stop_on_failure=args.on_failure == "stop", cpus=args.cpus)
+
 	for pattern in args.graphs:
 		for graphfile in glob.glob(pattern):
 			if not os.path.exists(graphfile):
-				print "ERROR: outlier file '",graphfile,"does not exist!"
+				print("ERROR: outlier file '",graphfile,"does not exist!")
 				continue
 
 			output_dir = os.path.dirname(graphfile)
@@ -76,8 +97,8 @@ if __name__ == "__main__":
 				output_name += args.output_suffix
 
 
-			g2o_name = os.path.normpath(output_dir + "/" + output_name + ".g2o")
-			timing_name = os.path.normpath(output_dir + "/" + output_name + ".time")
+			g2o_name = os.path.normpath( os.path.join(output_dir, output_name + ".g2o") )
+			timing_name = os.path.normpath( os.path.join(output_dir, output_name + ".time") )
 
 			command = [args.g2o]
 			command += extra_args
@@ -87,6 +108,24 @@ if __name__ == "__main__":
 			command += ['-saveTiming', timing_name]
 			command += [graphfile]
 
-			print "*************************"
-			print " ".join(command)
-			check_call(command, env=env)
\ No newline at end of file
+			if not tracker:
+				scheduler.add( Job(graphfile, command, env=env, usage_log=g2o_name + ".usage.jsonl") )
+				continue
+
+			# the environment settings are part of the command, they may e.g. select other g2o libraries
+			dependencies = ([g2o_name, timing_name], [graphfile], command + args.env)
+			if tracker.check(*dependencies) is None:
+				print("up to date: %s" % g2o_name)
+				continue
+			tracker.begin([g2o_name, timing_name])
+
+			scheduler.add( Job(graphfile, command, env=env, done=optimized(dependencies), usage_log=g2o_name + ".usage.jsonl") )
+
+	scheduler.run()
+	scheduler.summary()
+
+	if tracker:
+		print("%d graphs were up to date, %d were outdated or missing" % (tracker.up_to_date, tracker.outdated))
+
+	if scheduler.failed():
+		exit(4)
@@ -0,0 +1,341 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import errno
+import signal
+import tempfile
+import subprocess
+from distutils.spawn import find_executable
+
+# Runs commands as subprocesses, at most a given number at a time.
+#
+# Every run gets its own process group, so a run that exceeds the timeout is
+# killed together with everything it started (SIGTERM, then SIGKILL after a
+# grace period). Failed or timed out runs can be retried, and the remaining runs
+# skipped after a failure. Runs may depend on others (e.g. outlier files that
+# extend the previous one), a run starts only after all runs it depends on
+# succeeded, and is skipped if one of them failed. Independent runs are started
+# in the order they were added. Workers can be pinned to CPUs: os.sched_setaffinity
+# where available (python 3), otherwise the command is started with taskset.
+#
+# Runs are reaped with os.wait4, which gives their CPU time and peak resident
+# memory (of the command and the children it waited for, not of children it
+# left running). Each attempt can be appended to a JSON lines file, e.g. next
+# to the output of the run.
+
+class Job(object):
+	"""A command to run, and what happened when it ran.
+
+	after is a list of jobs that have to succeed before this one starts, if one
+	of them does not, this job is skipped. done is an optional function that is
+	called with the job when it finished for good (after the last attempt, not
+	for skipped jobs). If usage_log is a path, a JSON line with the resources
+	used is appended to it after every attempt.
+	"""
+
+	def __init__(self, name, command, env=None, cwd=None, after=[], done=None, usage_log=None):
+		self.name = name
+		self.command = command
+		self.env = env
+		self.cwd = cwd
+		self.after = list(after)
+		self.done = done
+		self.usage_log = usage_log
+
+		self.status = "pending" # afterwards one of: ok, failed, timeout, skipped
+		self.returncode = None
+		self.attempts = 0
+		self.elapsed = 0.0 # wall time of the last attempt in seconds
+		self.output = None # stdout and stderr of the last attempt, if captured
+		self.usage = None # user and system CPU time (seconds) and peak RSS (kB) of the last attempt
+
+		# state while running
+		self.process = None
+		self.started = None
+		self.killed = None
+		self.slot = None
+		self.cpu = None
+		self.log = None
+
+
+class Scheduler(object):
+	"""Runs jobs, at most jobs at a time.
+
+	timeout is the wall time in seconds a single attempt may take (None: no
+	limit). Failed and timed out jobs are run again up to retries times. If
+	stop_on_failure is set, jobs that did not start yet are skipped after a job
+	failed for good. cpus is an optional list of CPU ids, worker k is pinned to
+	cpus[k]. With capture, the output of every job is collected and printed
+	when it finished instead of going straight to the terminal (default: only
+	when running more than one job at a time).
+	"""
+
+	def __init__(self, jobs=1, timeout=None, retries=0, stop_on_failure=False, cpus=None, capture=None, kill_grace=5.0, poll_interval=0.05, out=sys.stdout):
+		self.jobs = max(1, jobs)
+		self.timeout = timeout
+		self.retries = retries
+		self.stop_on_failure = stop_on_failure
+		self.cpus = cpus
+		self.capture = capture if capture is not None else self.jobs > 1
+		self.kill_grace = kill_grace
+		self.poll_interval = poll_interval
+		self.out = out
+
+		self.taskset = None
+		if cpus and not hasattr(os, "sched_setaffinity"):
+			self.taskset = find_executable("taskset")
+			if not self.taskset:
+				print("WARNING: can't pin workers to cpus, neither os.sched_setaffinity nor taskset are available", file=sys.stderr)
+
+		self.queue = []
+		self.running = []
+		self.finished = [] # in the order they finished
+		self.all = [] # in the order they were added
+
+	def add(self, job):
+		self.queue.append(job)
+		self.all.append(job)
+		return job
+
+	# runs all added jobs, returns them in the order they were added
+	def run(self):
+		free_slots = list(range(self.jobs))
+		stopping = False
+
+		try:
+			while self.queue or self.running:
+				while free_slots and not stopping:
+					job = self.next_job()
+					if job is None:
+						break
+					self.start(job, free_slots.pop(0))
+
+				if stopping:
+					for job in self.queue:
+						self.skip(job)
+					self.queue = []
+
+				if not self.running:
+					if self.queue:
+						raise ValueError("Jobs depend on jobs that were not added: %s" % ", ".join([ job.name for job in self.queue ]))
+					continue
+
+				time.sleep(self.poll_interval)
+
+				for job in list(self.running):
+					if not self.check(job):
+						continue
+
+					self.running.remove(job)
+					free_slots.append(job.slot)
+					free_slots.sort()
+
+					if job.status != "ok" and job.attempts <= self.retries:
+						print("retrying %s (%s, attempt %d of %d)" % (job.name, job.status, job.attempts, self.retries+1), file=self.out)
+						job.status = "pending"
+						self.queue.insert(0, job)
+						continue
+
+					self.finished.append(job)
+					if job.done:
+						job.done(job)
+
+					if job.status != "ok" and self.stop_on_failure:
+						stopping = True
+
+		except KeyboardInterrupt:
+			for job in self.running:
+				self.kill(job, signal.SIGKILL)
+			raise
+
+		return self.all
+
+	# takes the first queued job that can start now out of the queue, skips
+	# jobs that depend on a job that did not succeed
+	def next_job(self):
+		i = 0
+		while i < len(self.queue):
+			job = self.queue[i]
+			status = [ dep.status for dep in job.after ]
+
+			if any([ s in ["failed", "timeout", "skipped"] for s in status ]):
+				del self.queue[i]
+				self.skip(job)
+				# jobs depending on this one might be earlier in the queue
+				i = 0
+			elif all([ s == "ok" for s in status ]):
+				del self.queue[i]
+				return job
+			else:
+				i += 1
+
+		return None
+
+	def skip(self, job):
+		job.status = "skipped"
+		self.finished.append(job)
+
+	def start(self, job, slot):
+		job.attempts += 1
+		job.slot = slot
+		job.killed = None
+		job.returncode = None
+		job.output = None
+		job.usage = None
+
+		cpu = None
+		if self.cpus:
+			cpu = self.cpus[slot % len(self.cpus)]
+
+		command = list(job.command)
+		if cpu is not None and self.taskset:
+			command = [self.taskset, "-c", str(cpu)] + command
+
+		def setup():
+			# own process group, to kill everything the command started on timeout
+			os.setsid()
+			if cpu is not None and hasattr(os, "sched_setaffinity"):
+				os.sched_setaffinity(0, [cpu])
+
+		stdout = None
+		stderr = None
+		if self.capture:
+			job.log = tempfile.TemporaryFile()
+			stdout = job.log
+			stderr = subprocess.STDOUT
+		else:
+			print("*************************", file=self.out)
+			print(" ".join(job.command), file=self.out)
+			self.out.flush()
+
+		job.cpu = cpu
+		job.started = time.time()
+		try:
+			job.process = subprocess.Popen(command, env=job.env, cwd=job.cwd, stdout=stdout, stderr=stderr, preexec_fn=setup)
+		except OSError as e:
+			job.process = None
+			job.output = "ERROR: could not start %s: %s\n" % (command[0], e)
+
+		self.running.append(job)
+
+	# returns True if the job finished, kills it if it ran too long
+	def check(self, job):
+		now = time.time()
+
+		if job.process is None:
+			job.returncode = None
+		else:
+			try:
+				(pid, status, usage) = os.wait4(job.process.pid, os.WNOHANG)
+			except OSError as e:
+				if e.errno != errno.EINTR:
+					raise
+				pid = 0
+
+			if pid == 0:
+				if job.killed is None and self.timeout and now - job.started > self.timeout:
+					self.kill(job, signal.SIGTERM)
+					job.killed = now
+				elif job.killed is not None and now - job.killed > self.kill_grace:
+					self.kill(job, signal.SIGKILL)
+				return False
+
+			if os.WIFSIGNALED(status):
+				job.returncode = -os.WTERMSIG(status)
+			else:
+				job.returncode = os.WEXITSTATUS(status)
+			# reaped here, the Popen object must not wait for it
+			job.process.returncode = job.returncode
+
+			job.usage = dict(user=usage.ru_utime, sys=usage.ru_stime, maxrss_kb=usage.ru_maxrss)
+
+		job.elapsed = now - job.started
+
+		if job.killed is not None:
+			job.status = "timeout"
+		elif job.returncode == 0:
+			job.status = "ok"
+		else:
+			job.status = "failed"
+
+		if job.log:
+			job.log.seek(0)
+			job.output = (job.output or "") + job.log.read()
+			job.log.close()
+			job.log = None
+
+		if job.usage_log:
+			self.log_usage(job)
+
+		self.report(job)
+		return True
+
+	def log_usage(self, job):
+		record = dict(name=job.name, command=job.command, attempt=job.attempts, status=job.status, returncode=job.returncode, started=job.started, wall=job.elapsed, cpu=job.cpu)
+		if job.usage:
+			record.update(job.usage)
+
+		with open(job.usage_log, 'a') as f:
+			f.write(json.dumps(record, sort_keys=True) + "\n")
+
+	def kill(self, job, sig):
+		if job.process is None:
+			return
+		try:
+			os.killpg(job.process.pid, sig)
+		except OSError:
+			pass
+
+	def report(self, job):
+		if self.capture:
+			print("*************************", file=self.out)
+			print(" ".join(job.command), file=self.out)
+		if job.output:
+			self.out.write(job.output)
+
+		if job.status == "timeout":
+			print("ERROR: %s timed out after %.1fs" % (job.name, job.elapsed), file=self.out)
+		elif job.status == "failed":
+			print("ERROR: %s failed with exit code %s" % (job.name, job.returncode), file=self.out)
+		self.out.flush()
+
+	def failed(self):
+		return [job for job in self.all if job.status != "ok"]
+
+	# table of all jobs with status, attempts, wall time, resources and exit
+	# code of the last attempt, and the totals
+	def summary(self, out=None):
+		if out is None:
+			out = self.out
+
+		if not self.all:
+			return
+
+		def usage(job, key, fmt, scale=1.0):
+			if job.usage is None:
+				return ""
+			return fmt % (job.usage[key] * scale)
+
+		rows = [ (job.status, str(job.attempts), "%.2f" % job.elapsed, usage(job, "user", "%.2f"), usage(job, "sys", "%.2f"), usage(job, "maxrss_kb", "%.1f", 1.0/1024), "" if job.returncode is None else str(job.returncode), job.name) for job in self.all ]
+		header = ("status", "tries", "seconds", "user", "sys", "rss MB", "exit", "run")
+
+		widths = [ max([len(r[c]) for r in rows + [header]]) for c in range(len(header)-1) ]
+
+		print("*************************", file=out)
+		for r in [header] + rows:
+			print("  ".join([ r[c].ljust(widths[c]) for c in range(len(widths)) ] + [r[-1]]), file=out)
+
+		counts = dict()
+		for job in self.all:
+			counts[job.status] = counts.get(job.status, 0) + 1
+		print(", ".join([ "%s: %d" % (s, counts[s]) for s in ["ok", "failed", "timeout", "skipped"] if s in counts ]) + " of %d runs" % len(self.all), file=out)
+
+		measured = [ job for job in self.all if job.usage ]
+		if measured:
+			largest = max(measured, key=lambda job: job.usage["maxrss_kb"])
+			print("cpu time (last attempts): user %.2fs, sys %.2fs, peak rss %.1f MB (%s)" % (
+				sum([ job.usage["user"] for job in measured ]), sum([ job.usage["sys"] for job in measured ]), largest.usage["maxrss_kb"]/1024.0, largest.name), file=out)
+		out.flush()
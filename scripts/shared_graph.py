@@ -0,0 +1,181 @@
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+import graph as G
+
+# Graphs as packed numpy arrays in memory-mapped files, for sharing one graph
+# between many processes. export_graph() writes the arrays once, workers get a
+# small picklable SharedGraphHandle and attach() to it, which maps the files
+# read-only without copying. By default the files live in /dev/shm (i.e. RAM),
+# so all workers share the same physical pages.
+#
+# Layout (all arrays in CSR style, offsets index into the next level):
+#   vertex_ids [V], vertex_poses [V,3|7] (sorted by id), fixed [F]
+#   edge_reference [E], edge_has_inlier [E], edge_has_null [E], edge_inlier_target [E] (-1: none), edge_batch_offsets [E+1]
+#   batch_target [B], batch_weight [B], batch_motion_offsets [B+1]
+#   motion_weight [M], motion_values [M,9|28] (mean followed by upper triangular information)
+
+def default_directory():
+	if os.path.isdir("/dev/shm"):
+		return "/dev/shm"
+	return None
+
+
+class SharedGraphHandle(object):
+	def __init__(self, directory, meta):
+		self.directory = directory
+		self.meta = meta
+
+	def attach(self):
+		return SharedGraphArrays(self)
+
+	# for attaching to a graph exported by another program
+	@classmethod
+	def fromDirectory(cls, directory):
+		with open(os.path.join(directory, "meta.json"), 'r') as f:
+			return cls(directory, json.load(f))
+
+	# removes the files, already attached arrays stay valid until closed
+	def unlink(self):
+		shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class SharedGraphArrays(object):
+	"""The arrays of an exported graph, as read-only memory maps (attribute per array)."""
+
+	def __init__(self, handle):
+		self.dim = handle.meta["dim"]
+		self.vertex_tag = handle.meta["vertex_tag"]
+		self.edge_tag = handle.meta["edge_tag"]
+
+		for name, (dtype, shape) in handle.meta["arrays"].items():
+			if 0 in shape:
+				a = np.zeros(shape, dtype=dtype)
+			else:
+				a = np.memmap(os.path.join(handle.directory, name), dtype=dtype, mode='r', shape=tuple(shape))
+			setattr(self, name, a)
+
+	def vertexPoses(self):
+		return VertexPoseLookup(self.vertex_ids, self.vertex_poses)
+
+	# materializes a full Graph again (this copies, of course)
+	def toGraph(self):
+		g = G.Graph()
+		g.dim = self.dim
+		g.vertex_tag = self.vertex_tag
+		g.edge_tag = self.edge_tag
+
+		for i, v in zip(self.vertex_ids.tolist(), self.vertex_poses.tolist()):
+			g.V[i] = v
+			g.vertex_keys.append(i)
+		g.fixed = set(self.fixed.tolist())
+
+		n_mean = 3 if self.dim == 2 else 7
+
+		for e in range(len(self.edge_reference)):
+			inlier_target = int(self.edge_inlier_target[e])
+			batch = G.ConstraintBatch(bool(self.edge_has_inlier[e]), bool(self.edge_has_null[e]), int(self.edge_reference[e]), inlier_target if inlier_target >= 0 else None)
+
+			for b in range(self.edge_batch_offsets[e], self.edge_batch_offsets[e+1]):
+				motions = G.ConstraintMotions(float(self.batch_weight[b]), int(self.batch_target[b]))
+				for m in range(self.batch_motion_offsets[b], self.batch_motion_offsets[b+1]):
+					values = self.motion_values[m].tolist()
+					motions.motions.append(G.Motion.fromValues(float(self.motion_weight[m]), values[:n_mean], values[n_mean:]))
+				batch.addMotions(motions)
+
+			if batch.has_inlier:
+				key = g.make_edge_key(batch.reference, batch.inlier_target)
+			else:
+				key = g.make_edge_key(batch.reference, batch.targets())
+			g.setEdge(key, batch)
+
+		return g
+
+
+class VertexPoseLookup(object):
+	"""Read-only dict-like view of vertex id -> pose on sorted id and pose arrays."""
+
+	def __init__(self, ids, poses):
+		self.ids = ids
+		self.poses = poses
+
+	def index(self, i):
+		k = np.searchsorted(self.ids, i)
+		if k < len(self.ids) and self.ids[k] == i:
+			return k
+		return -1
+
+	def __contains__(self, i):
+		return self.index(i) >= 0
+
+	def __getitem__(self, i):
+		k = self.index(i)
+		if k < 0:
+			raise KeyError(i)
+		return self.poses[k]
+
+	def __iter__(self):
+		return iter(self.ids.tolist())
+
+	def __len__(self):
+		return len(self.ids)
+
+
+def export_graph(g, directory=None):
+	directory = tempfile.mkdtemp(prefix="graph_", dir=directory if directory else default_directory())
+
+	n_values = 9 if g.dim == 2 else 28
+
+	vertex_ids = sorted(g.V.keys())
+
+	edges = [e for key,e in g.orderedEdges()]
+	batches = [b for e in edges for b in e.motion_batches]
+	motions = [m for b in batches for m in b.motions]
+
+	arrays = dict(
+		vertex_ids = np.array(vertex_ids, dtype=np.int64),
+		vertex_poses = np.array([g.V[i] for i in vertex_ids], dtype=np.float64).reshape(len(vertex_ids), 3 if g.dim == 2 else 7),
+		fixed = np.array(sorted(g.fixed), dtype=np.int64),
+
+		edge_reference = np.array([e.reference for e in edges], dtype=np.int64),
+		edge_has_inlier = np.array([e.has_inlier for e in edges], dtype=np.uint8),
+		edge_has_null = np.array([e.has_null_hypothesis for e in edges], dtype=np.uint8),
+		edge_inlier_target = np.array([e.inlier_target if e.inlier_target is not None else -1 for e in edges], dtype=np.int64),
+		edge_batch_offsets = np.cumsum([0] + [len(e.motion_batches) for e in edges]).astype(np.int64),
+
+		batch_target = np.array([b.target for b in batches], dtype=np.int64),
+		batch_weight = np.array([b.batch_weight for b in batches], dtype=np.float64),
+		batch_motion_offsets = np.cumsum([0] + [len(b.motions) for b in batches]).astype(np.int64),
+
+		motion_weight = np.array([m.weight for m in motions], dtype=np.float64),
+		motion_values = np.array([list(m) for m in motions], dtype=np.float64).reshape(len(motions), n_values),
+	)
+
+	meta = {"dim": g.dim, "vertex_tag": g.vertex_tag, "edge_tag": g.edge_tag, "arrays": dict()}
+
+	for name, a in arrays.items():
+		if a.size:
+			mm = np.memmap(os.path.join(directory, name), dtype=a.dtype, mode='w+', shape=a.shape)
+			mm[...] = a
+			mm.flush()
+			del mm
+		meta["arrays"][name] = (a.dtype.str, list(a.shape))
+
+	with open(os.path.join(directory, "meta.json"), 'w') as f:
+		json.dump(meta, f)
+
+	return SharedGraphHandle(directory, meta)
+
+# vertex poses only, e.g. a reference for compute_error
+def export_vertices(ids, poses, dim, directory=None):
+	g = G.Graph()
+	g.dim = dim
+	g.vertex_keys = ids.tolist()
+	g.V = dict( zip(g.vertex_keys, poses.tolist()) )
+	return export_graph(g, directory)
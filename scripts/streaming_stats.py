@@ -0,0 +1,195 @@
+from __future__ import print_function
+
+import math
+import json
+
+import numpy as np
+
+# Quantile sketches for summarizing many values (e.g. one MSE per optimized
+# graph) without keeping them all around. All sketches support add(), merge()
+# and percentile() and can be saved to / loaded from plain dicts (JSON), so
+# partial summaries of separate runs can be combined later.
+
+class ExactQuantiles(object):
+	"""Keeps all values, percentiles are exactly what numpy.percentile gives."""
+
+	kind = "exact"
+
+	def __init__(self):
+		self.values = []
+
+	def __len__(self):
+		return len(self.values)
+
+	def add(self, x):
+		self.values.append(float(x))
+
+	def merge(self, other):
+		if isinstance(other, ExactQuantiles):
+			self.values.extend(other.values)
+		else:
+			raise ValueError("Can't merge a '%s' sketch into an exact one, only approximate sketches can absorb others." % other.kind)
+
+	def percentile(self, q):
+		if not self.values:
+			return np.array([float('nan')] * len(q))
+		return np.percentile(self.values, q)
+
+	def to_dict(self):
+		return {"kind": self.kind, "values": self.values}
+
+	@classmethod
+	def from_dict(cls, d):
+		s = cls()
+		s.values = [float(x) for x in d["values"]]
+		return s
+
+
+class TDigest(object):
+	"""Merging t-digest (Dunning & Ertl), memory bounded by the compression parameter."""
+
+	kind = "tdigest"
+
+	def __init__(self, compression=100.0):
+		self.compression = float(compression)
+		self.buffer_size = int(5 * compression)
+
+		self.means = []  # sorted centroid means
+		self.counts = [] # centroid weights
+		self.buffer = [] # (value, weight) not yet merged into centroids
+
+		self.n = 0.0
+		self.min = float('inf')
+		self.max = float('-inf')
+
+	def __len__(self):
+		return int(self.n)
+
+	def add(self, x, w=1.0):
+		x = float(x)
+		self.buffer.append( (x, w) )
+		self.n += w
+
+		if x < self.min:
+			self.min = x
+		if x > self.max:
+			self.max = x
+
+		if len(self.buffer) >= self.buffer_size:
+			self._compress()
+
+	def merge(self, other):
+		if isinstance(other, ExactQuantiles):
+			for x in other.values:
+				self.add(x)
+			return
+
+		other._compress()
+		for m,c in zip(other.means, other.counts):
+			self.buffer.append( (m, c) )
+		self.n += other.n
+		self.min = min(self.min, other.min)
+		self.max = max(self.max, other.max)
+
+		self._compress()
+
+	# scale function k1 and its inverse
+	def _k(self, q):
+		return self.compression / (2.0*math.pi) * math.asin(2.0*q - 1.0)
+
+	def _k_inv(self, k):
+		return (math.sin(k * 2.0*math.pi / self.compression) + 1.0) / 2.0
+
+	def _compress(self):
+		if not self.buffer:
+			return
+
+		points = sorted( list(zip(self.means, self.counts)) + self.buffer )
+		self.buffer = []
+
+		total = sum([c for m,c in points])
+
+		means = []
+		counts = []
+
+		cur_mean, cur_count = points[0]
+		q0 = 0.0
+		q_limit = self._k_inv( min(self._k(q0) + 1.0, self.compression/4.0) )
+
+		for m,c in points[1:]:
+			q = (q0 + cur_count + c) / total
+			if q <= q_limit:
+				cur_count += c
+				cur_mean += (m - cur_mean) * c / cur_count
+			else:
+				means.append(cur_mean)
+				counts.append(cur_count)
+				q0 += cur_count
+				q_limit = self._k_inv( min(self._k(q0/total) + 1.0, self.compression/4.0) )
+				cur_mean, cur_count = m, c
+
+		means.append(cur_mean)
+		counts.append(cur_count)
+
+		self.means = means
+		self.counts = counts
+
+	# q in percent, like numpy.percentile, uses the same linear interpolation
+	# between ranks, so a digest of only singleton centroids is exact.
+	def percentile(self, q):
+		self._compress()
+
+		if self.n == 0:
+			return np.array([float('nan')] * len(q))
+
+		counts = np.array(self.counts)
+		means = np.array(self.means)
+
+		# rank (0-based) of each centroid's center, bracketed by min and max
+		centers = np.cumsum(counts) - (counts + 1.0) / 2.0
+		ranks = np.concatenate( ([0.0], centers, [self.n - 1.0]) )
+		values = np.concatenate( ([self.min], means, [self.max]) )
+
+		pos = np.asarray(q, dtype=np.float64) / 100.0 * (self.n - 1.0)
+		return np.interp(pos, ranks, values)
+
+	def to_dict(self):
+		self._compress()
+		return {"kind": self.kind, "compression": self.compression, "means": self.means, "counts": self.counts, "n": self.n, "min": self.min, "max": self.max}
+
+	@classmethod
+	def from_dict(cls, d):
+		s = cls(d["compression"])
+		s.means = [float(x) for x in d["means"]]
+		s.counts = [float(x) for x in d["counts"]]
+		s.n = float(d["n"])
+		s.min = float(d["min"])
+		s.max = float(d["max"])
+		return s
+
+
+sketch_types = {
+	ExactQuantiles.kind: ExactQuantiles,
+	TDigest.kind: TDigest,
+}
+
+def make_sketch(kind, compression=100.0):
+	if kind == TDigest.kind:
+		return TDigest(compression)
+	if kind == ExactQuantiles.kind:
+		return ExactQuantiles()
+	raise ValueError("Unknown quantile sketch type '%s'" % kind)
+
+def sketch_from_dict(d):
+	if not d["kind"] in sketch_types:
+		raise ValueError("Unknown quantile sketch type '%s'" % d["kind"])
+	return sketch_types[ d["kind"] ].from_dict(d)
+
+
+# a set of named sketches, saved together as one JSON summary file
+def save_summary(f, sketches):
+	json.dump( dict([ (name, s.to_dict()) for name,s in sketches.items() ]), f )
+	f.write("\n")
+
+def load_summary(f):
+	return dict([ (name, sketch_from_dict(d)) for name,d in json.load(f).items() ])
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+
+# Stand-in for the g2o command line executable, to try run_g2o.py and the
+# scheduler without g2o: run_g2o.py --g2o stub_g2o.py ...
+#
+# Understands the options run_g2o.py passes (-solver, -i, -o, -saveTiming and
+# the input graph as last argument) and ignores all others. The input graph is
+# copied to the output unchanged, the timing file gets one line per iteration in
+# the format of g2o's iteration output. Environment variables change what it does:
+#   STUB_G2O_SLEEP   seconds to run (in a child process, like a solver would)
+#   STUB_G2O_EXIT    exit code
+#   STUB_G2O_MATCH   only sleep and exit with STUB_G2O_EXIT for inputs whose path contains this
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+
+	if len(args) == 0:
+		print("usage: stub_g2o.py [-solver S] [-i N] [-o OUTPUT] [-saveTiming FILE] [other g2o options] INPUT", file=sys.stderr)
+		exit(1)
+
+	options = dict()
+	for i in range(len(args)-1):
+		if args[i] in ["-solver", "-i", "-o", "-saveTiming"]:
+			options[args[i]] = args[i+1]
+
+	graphfile = args[-1]
+	iterations = int(options.get("-i", 10))
+
+	print("stub g2o: %s, solver %s, %d iterations" % (graphfile, options.get("-solver", "default"), iterations))
+
+	if not os.path.exists(graphfile):
+		print("ERROR: can't open %s" % graphfile, file=sys.stderr)
+		exit(1)
+
+	affected = os.environ.get("STUB_G2O_MATCH", "") in graphfile
+
+	start = time.time()
+
+	if affected and os.environ.get("STUB_G2O_SLEEP"):
+		subprocess.call(["sleep", os.environ["STUB_G2O_SLEEP"]])
+
+	if "-o" in options:
+		shutil.copyfile(graphfile, options["-o"])
+
+	if "-saveTiming" in options:
+		total = time.time() - start
+		with open(options["-saveTiming"], 'w') as f:
+			chi2 = 1000.0
+			for it in range(iterations):
+				chi2 *= 0.5
+				print("iteration= %d\t chi2= %f\t time= %f\t cumTime= %f\t edges= 0\t schur= 0" % (it, chi2, total/iterations, total*(it+1)/iterations), file=f)
+
+	if affected and os.environ.get("STUB_G2O_EXIT"):
+		exit(int(os.environ["STUB_G2O_EXIT"]))
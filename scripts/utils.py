@@ -1,9 +1,32 @@
 import argparse
 import sys
+import os
+import profiling
+import metrics
 
 class DefaultHelpParser(argparse.ArgumentParser):
+    def __init__(self, *args, **kwargs):
+        super(DefaultHelpParser, self).__init__(*args, **kwargs)
+
+        group = self.add_argument_group("profiling", "Profiling can also be switched on with the environment variable %s=cpu|memory|all, reports are then written to %s (default: current directory)." % (profiling.PROFILE_ENV, profiling.PROFILE_DIR_ENV))
+        group.add_argument("--profile", choices=profiling.MODES, help="Profile this run with cProfile (cpu), tracemalloc and peak RSS (memory) or both (all). Writes a .prof file and a short text report when the script exits.")
+        group.add_argument("--profile-output", help="Path prefix of the profile files. Default: <script name>.<pid>")
+        group.add_argument("--profile-top", type=int, default=20, help="Number of functions and allocation sites in the profile report. Default: 20")
+        group.add_argument("--metrics", help="Count and time the graph operations (lines parsed per tag, duplicates skipped, edges sorted, weights normalized, compound calls, time per phase) and write them as JSON to this file when the script exits, - for one line on stderr.")
+
     def error(self, message):
         sys.stderr.write('error: %s\n' % message)
         self.print_help()
         sys.exit(2)
 
+    def parse_known_args(self, args=None, namespace=None):
+        (namespace, extra) = super(DefaultHelpParser, self).parse_known_args(args, namespace)
+
+        mode = namespace.profile or os.environ.get(profiling.PROFILE_ENV)
+        if mode:
+            profiling.start(mode, namespace.profile_output, namespace.profile_top)
+
+        if namespace.metrics:
+            metrics.dump_at_exit(namespace.metrics)
+
+        return (namespace, extra)
@@ -1,4 +1,5 @@
 #include <map>
+#include <cmath>
 #include <string>
 #include <set>
 #include <fstream>
@@ -49,6 +50,10 @@ struct options {
 	bool group_loops; // "grouped" policy of Suenderhauf
 	int group_size;
 
+	bool spatial_loops; // second vertex is near the first one in the ground truth, see SpatialIndex
+	double spatial_radius;
+	double spatial_min_distance;
+
 	double min_weight;
 	double max_weight;
 
@@ -76,6 +81,10 @@ struct options {
 		group_loops = false;
 		group_size = 20;
 
+		spatial_loops = false;
+		spatial_radius = 10;
+		spatial_min_distance = 2;
+
 		min_weight = .5;
 		max_weight = 2.;
 
@@ -164,6 +173,76 @@ struct Graph {
 	Graph() : dim(-1) {}
 };
 
+// Uniform grid over the ground truth positions of the vertices, with cells as
+// large as the radius, so all vertices within the radius of a position are in
+// the 3^dim cells around it. Finding the candidates for a false loop target is
+// then a look at a few cells instead of drawing from all vertices until one is
+// near enough.
+struct SpatialIndex {
+	struct Cell {
+		long x, y, z;
+
+		bool operator<(const Cell& o) const {
+			if(x != o.x) return x < o.x;
+			if(y != o.y) return y < o.y;
+			return z < o.z;
+		}
+	};
+
+	int dim;
+	double cell_size;
+	vector< Vector3d > positions; // by index in Graph::vertex_ids
+	map< Cell, vector<size_t> > cells; // vertex indices, ascending
+
+	SpatialIndex() : dim(-1), cell_size(1) {}
+
+	Cell cell_of(const Vector3d& p) const {
+		Cell c;
+		c.x = (long)floor(p[0] / cell_size);
+		c.y = (long)floor(p[1] / cell_size);
+		c.z = (long)floor(p[2] / cell_size);
+		return c;
+	}
+
+	void build(const Graph& G, double radius) {
+		dim = G.dim;
+		cell_size = radius;
+		positions.resize(G.vertex_ids.size());
+		cells.clear();
+
+		for(size_t i=0; i<G.vertex_ids.size(); i++) {
+			const VectorXd& pose = G.vertices.find(G.vertex_ids[i])->second.ground_truth_pose;
+			positions[i] = Vector3d::Zero();
+			positions[i].head(dim) = pose.head(dim); // SE2: x y theta, SE3: x y z + quaternion
+			cells[cell_of(positions[i])].push_back(i);
+		}
+	}
+
+	// indices of all vertices with min_distance <= distance <= max_distance to vertex index, in ascending order per cell
+	void candidates(size_t index, double min_distance, double max_distance, vector<size_t>& out) const {
+		out.clear();
+		const Vector3d& p = positions[index];
+		Cell center = cell_of(p);
+
+		long reach_z = (dim == 3) ? 1 : 0;
+		for(long dx=-1; dx<=1; dx++)
+		for(long dy=-1; dy<=1; dy++)
+		for(long dz=-reach_z; dz<=reach_z; dz++) {
+			Cell c = center; c.x += dx; c.y += dy; c.z += dz;
+
+			map< Cell, vector<size_t> >::const_iterator it = cells.find(c);
+			if(it == cells.end()) continue;
+
+			for(size_t k=0; k<it->second.size(); k++) {
+				double d = (positions[it->second[k]] - p).norm();
+				if(d >= min_distance && d <= max_distance) {
+					out.push_back(it->second[k]);
+				}
+			}
+		}
+	}
+};
+
 
 bool parse_options(options& op, int argc, char** argv);
 bool load(Graph&, const std::string& file);
@@ -172,6 +251,15 @@ bool save_outliers(const Graph&, const std::string& file, const options&);
 
 bool generate_outliers(Graph&, const options&);
 
+// draws in a row without an open spatial target, out of n references, after
+// which most likely none of them has one left
+inline size_t max_failed_spatial_draws(size_t n) {
+	return 10*n + 100;
+}
+
+template <typename RNG>
+bool sample_spatial_target(const Graph& G, const SpatialIndex& index, const options& op, const set< pair<int,int> >& already_connected_vertices, size_t ref_index, bool allow_sequential, RNG& gen, size_t& tar_index);
+
 template <typename RNG>
 void sample_mean_and_store(int dim, double loop_variance_translation, double loop_variance_rotation, ConstraintData& c, double inside_confidence, double outside_confidence, RNG& gen);
 template <typename RNG>
@@ -248,6 +336,27 @@ bool generate_outliers(Graph& G, const options& op) {
 
 	boost::mt19937 gen(op.seed);
 
+	SpatialIndex spatial_index;
+	if(op.spatial_loops) {
+		spatial_index.build(G, op.spatial_radius);
+
+		size_t with_candidates = 0;
+		vector<size_t> candidates;
+		for(size_t i=0; i<G.vertex_ids.size(); i++) {
+			spatial_index.candidates(i, op.spatial_min_distance, op.spatial_radius, candidates);
+			if(candidates.size() > 1 || (candidates.size() == 1 && candidates.front() != i)) {
+				with_candidates++;
+			}
+		}
+
+		cout << "spatial policy: " << spatial_index.cells.size() << " grid cells of size " << op.spatial_radius << ", " << with_candidates << " of " << G.vertex_ids.size() << " vertices have others between " << op.spatial_min_distance << " and " << op.spatial_radius << " away" << endl << endl;
+
+		if(with_candidates == 0) {
+			cerr << "no vertex has another one within the spatial radius, increase --spatial-radius or decrease --spatial-min-distance" << endl;
+			return false;
+		}
+	}
+
 
 	// indices
 	vector<size_t> simple_loop_inliers, simple_seq_inliers;
@@ -353,6 +462,7 @@ bool generate_outliers(Graph& G, const options& op) {
 			cout << "generating " << i+2 << "-loops: " << accumulate(op.false_loops_on_inliers,i) - accumulate(loops_on_inliers,i) << " (have " << accumulate(loops_on_inliers,i) << ", need " << accumulate(op.false_loops_on_inliers,i) << ")" << endl;
 			cout << "have a set of " << (*extensible).size() << " to extend" << endl;
 
+			size_t failed_spatial_draws = 0; // in a row, see max_failed_spatial_draws()
 			while(accumulate(loops_on_inliers,i) < accumulate(op.false_loops_on_inliers,i)) {
 				// pick random inlier loop
 				boost::uniform_int<size_t> random_index(0,(*extensible).size()-1);
@@ -369,30 +479,42 @@ bool generate_outliers(Graph& G, const options& op) {
 					continue;
 				}
 
-				size_t lower_limit = 0;
-				if(op.local_loops) {
-					lower_limit = ref_index-op.local_neighborhood;
-					if(lower_limit > ref_index ) { // wrapped
-						lower_limit = 0;
+				size_t tar_index = 0;
+				if(op.spatial_loops) {
+					if(!sample_spatial_target(G, spatial_index, op, already_connected_vertices, ref_index, false, gen, tar_index)) {
+						if(++failed_spatial_draws > max_failed_spatial_draws((*extensible).size())) {
+							cerr << "none of the inlier loops to extend has an open target within the spatial radius any more" << endl;
+							return false;
+						}
+						continue; // nothing near enough, pick another one
 					}
-				}
-				size_t upper_limit = G.vertex_ids.size()-1;
-				if(op.local_loops) {
-					upper_limit = ref_index+op.local_neighborhood;
-					if(upper_limit >= G.vertex_ids.size() ) { // cap
-						upper_limit = G.vertex_ids.size()-1;
+					failed_spatial_draws = 0;
+				} else {
+					size_t lower_limit = 0;
+					if(op.local_loops) {
+						lower_limit = ref_index-op.local_neighborhood;
+						if(lower_limit > ref_index ) { // wrapped
+							lower_limit = 0;
+						}
+					}
+					size_t upper_limit = G.vertex_ids.size()-1;
+					if(op.local_loops) {
+						upper_limit = ref_index+op.local_neighborhood;
+						if(upper_limit >= G.vertex_ids.size() ) { // cap
+							upper_limit = G.vertex_ids.size()-1;
+						}
 					}
-				}
 
-				boost::uniform_int<size_t> random_target(lower_limit,upper_limit);
-				size_t tar_index = random_target(gen);
-				while(     already_connected_vertices.find(make_pair(G.vertex_ids[ref_index], G.vertex_ids[tar_index])) != already_connected_vertices.end()
-						|| already_connected_vertices.find(make_pair(G.vertex_ids[tar_index], G.vertex_ids[ref_index])) != already_connected_vertices.end()
-						|| tar_index == ref_index
-						|| tar_index+1 == ref_index
-						|| ref_index+1 == tar_index
-				 ) {
+					boost::uniform_int<size_t> random_target(lower_limit,upper_limit);
 					tar_index = random_target(gen);
+					while(     already_connected_vertices.find(make_pair(G.vertex_ids[ref_index], G.vertex_ids[tar_index])) != already_connected_vertices.end()
+							|| already_connected_vertices.find(make_pair(G.vertex_ids[tar_index], G.vertex_ids[ref_index])) != already_connected_vertices.end()
+							|| tar_index == ref_index
+							|| tar_index+1 == ref_index
+							|| ref_index+1 == tar_index
+					 ) {
+						tar_index = random_target(gen);
+					}
 				}
 
 				
@@ -449,6 +571,7 @@ bool generate_outliers(Graph& G, const options& op) {
 			cout << "generating 1-loops: " << accumulate(op.false_loops,i) - accumulate(loops_on_null,i) << " (have " << accumulate(loops_on_null,i) << ", need " << accumulate(op.false_loops,i) << ")" << endl;
 			cout << "don't need a set to extend, inventing new edges here" << endl;
 
+			size_t failed_spatial_draws = 0; // in a row, see max_failed_spatial_draws()
 			while(accumulate(loops_on_null,i) < accumulate(op.false_loops,i)) {
 				boost::uniform_int<size_t> random_reference(0,G.vertex_ids.size()-1);
 				size_t ref_index = random_reference(gen);
@@ -459,28 +582,40 @@ bool generate_outliers(Graph& G, const options& op) {
 					}
 				}
 
-				size_t lower_limit = 0;
-				if(op.local_loops) {
-					lower_limit = ref_index-op.local_neighborhood;
-					if(lower_limit > ref_index ) { // wrapped
-						lower_limit = 0;
+				size_t tar_index = 0;
+				if(op.spatial_loops) {
+					if(!sample_spatial_target(G, spatial_index, op, already_connected_vertices, ref_index, true, gen, tar_index)) {
+						if(++failed_spatial_draws > max_failed_spatial_draws(G.vertex_ids.size())) {
+							cerr << "none of the references has an open target within the spatial radius any more" << endl;
+							return false;
+						}
+						continue; // nothing near enough, pick another one
 					}
-				}
-				size_t upper_limit = G.vertex_ids.size()-1;
-				if(op.local_loops) {
-					upper_limit = ref_index+op.local_neighborhood;
-					if(upper_limit >= G.vertex_ids.size() ) { // cap
-						upper_limit = G.vertex_ids.size()-1;
+					failed_spatial_draws = 0;
+				} else {
+					size_t lower_limit = 0;
+					if(op.local_loops) {
+						lower_limit = ref_index-op.local_neighborhood;
+						if(lower_limit > ref_index ) { // wrapped
+							lower_limit = 0;
+						}
+					}
+					size_t upper_limit = G.vertex_ids.size()-1;
+					if(op.local_loops) {
+						upper_limit = ref_index+op.local_neighborhood;
+						if(upper_limit >= G.vertex_ids.size() ) { // cap
+							upper_limit = G.vertex_ids.size()-1;
+						}
 					}
-				}
 
-				boost::uniform_int<size_t> random_target(lower_limit,upper_limit);
-				size_t tar_index = random_target(gen);
-				if(     already_connected_vertices.find(make_pair(G.vertex_ids[ref_index], G.vertex_ids[tar_index])) != already_connected_vertices.end()
-						|| already_connected_vertices.find(make_pair(G.vertex_ids[tar_index], G.vertex_ids[ref_index])) != already_connected_vertices.end()
-						|| tar_index == ref_index
-				 ) {
-					continue;
+					boost::uniform_int<size_t> random_target(lower_limit,upper_limit);
+					tar_index = random_target(gen);
+					if(     already_connected_vertices.find(make_pair(G.vertex_ids[ref_index], G.vertex_ids[tar_index])) != already_connected_vertices.end()
+							|| already_connected_vertices.find(make_pair(G.vertex_ids[tar_index], G.vertex_ids[ref_index])) != already_connected_vertices.end()
+							|| tar_index == ref_index
+					 ) {
+						continue;
+					}
 				}
 
 				// make new edge
@@ -540,6 +675,7 @@ bool generate_outliers(Graph& G, const options& op) {
 			cout << "generating " << i+1 << "-loops: " << accumulate(op.false_loops,i) - accumulate(loops_on_null,i) << " (have " << accumulate(loops_on_null,i) << ", need " << accumulate(op.false_loops,i) << ")" << endl;
 			cout << "have a set of " << (*extensible).size() << " to extend" << endl;
 
+			size_t failed_spatial_draws = 0; // in a row, see max_failed_spatial_draws()
 			while(accumulate(loops_on_null,i) < accumulate(op.false_loops,i)) {
 				// pick random inlier loop
 				boost::uniform_int<size_t> random_index(0,(*extensible).size()-1);
@@ -551,28 +687,40 @@ bool generate_outliers(Graph& G, const options& op) {
 					continue;
 				}
 
-				size_t lower_limit = 0;
-				if(op.local_loops) {
-					lower_limit = ref_index-op.local_neighborhood;
-					if(lower_limit > ref_index ) { // wrapped
-						lower_limit = 0;
+				size_t tar_index = 0;
+				if(op.spatial_loops) {
+					if(!sample_spatial_target(G, spatial_index, op, already_connected_vertices, ref_index, true, gen, tar_index)) {
+						if(++failed_spatial_draws > max_failed_spatial_draws((*extensible).size())) {
+							cerr << "none of the null loops to extend has an open target within the spatial radius any more" << endl;
+							return false;
+						}
+						continue; // nothing near enough, pick another one
 					}
-				}
-				size_t upper_limit = G.vertex_ids.size()-1;
-				if(op.local_loops) {
-					upper_limit = ref_index+op.local_neighborhood;
-					if(upper_limit >= G.vertex_ids.size() ) { // cap
-						upper_limit = G.vertex_ids.size()-1;
+					failed_spatial_draws = 0;
+				} else {
+					size_t lower_limit = 0;
+					if(op.local_loops) {
+						lower_limit = ref_index-op.local_neighborhood;
+						if(lower_limit > ref_index ) { // wrapped
+							lower_limit = 0;
+						}
+					}
+					size_t upper_limit = G.vertex_ids.size()-1;
+					if(op.local_loops) {
+						upper_limit = ref_index+op.local_neighborhood;
+						if(upper_limit >= G.vertex_ids.size() ) { // cap
+							upper_limit = G.vertex_ids.size()-1;
+						}
 					}
-				}
 
-				boost::uniform_int<size_t> random_target(lower_limit,upper_limit);
-				size_t tar_index = random_target(gen);
-				while(     already_connected_vertices.find(make_pair(G.vertex_ids[ref_index], G.vertex_ids[tar_index])) != already_connected_vertices.end()
-						|| already_connected_vertices.find(make_pair(G.vertex_ids[tar_index], G.vertex_ids[ref_index])) != already_connected_vertices.end()
-						|| tar_index == ref_index
-				 ) {
+					boost::uniform_int<size_t> random_target(lower_limit,upper_limit);
 					tar_index = random_target(gen);
+					while(     already_connected_vertices.find(make_pair(G.vertex_ids[ref_index], G.vertex_ids[tar_index])) != already_connected_vertices.end()
+							|| already_connected_vertices.find(make_pair(G.vertex_ids[tar_index], G.vertex_ids[ref_index])) != already_connected_vertices.end()
+							|| tar_index == ref_index
+					 ) {
+						tar_index = random_target(gen);
+					}
 				}
 
 				
@@ -769,6 +917,37 @@ bool generate_outliers(Graph& G, const options& op) {
 	return true;
 }
 
+// picks a random target among the vertices between spatial_min_distance and
+// spatial_radius from the reference in the ground truth that are not connected to
+// it yet, false if there is none
+template <typename RNG>
+bool sample_spatial_target(const Graph& G, const SpatialIndex& index, const options& op, const set< pair<int,int> >& already_connected_vertices, size_t ref_index, bool allow_sequential, RNG& gen, size_t& tar_index) {
+	vector<size_t> candidates;
+	index.candidates(ref_index, op.spatial_min_distance, op.spatial_radius, candidates);
+
+	vector<size_t> open_targets;
+	open_targets.reserve(candidates.size());
+	for(size_t k=0; k<candidates.size(); k++) {
+		size_t t = candidates[k];
+		if(        t == ref_index
+				|| (!allow_sequential && (t+1 == ref_index || ref_index+1 == t))
+				|| already_connected_vertices.find(make_pair(G.vertex_ids[ref_index], G.vertex_ids[t])) != already_connected_vertices.end()
+				|| already_connected_vertices.find(make_pair(G.vertex_ids[t], G.vertex_ids[ref_index])) != already_connected_vertices.end()
+		 ) {
+			continue;
+		}
+		open_targets.push_back(t);
+	}
+
+	if(open_targets.empty()) {
+		return false;
+	}
+
+	boost::uniform_int<size_t> random_candidate(0,open_targets.size()-1);
+	tar_index = open_targets[random_candidate(gen)];
+	return true;
+}
+
 template< typename Group, typename RNG >
 Group sample_mean_with(const ConstraintData& c, double inside_confidence, double outside_confidence, RNG& gen) {
 	typename NormalDistributionOn<Group>::Covariance Sigma = c.cov;
@@ -1250,6 +1429,9 @@ bool parse_options(options& op, int argc, char** argv) {
 	    ("local-neighborhood", po::value<int>(&op.local_neighborhood)->default_value(op.local_neighborhood), "Size of local neighborhood for local policy.")
 	    ("group-loops", po::value< bool >(&op.group_loops)->default_value(op.group_loops)->zero_tokens(), "Use 'grouped' loop generation policy, where the a number of loops are added for consecutive vertices. Can be combined with --local-loops. (see Niko Suenderhauf's PhD thesis).")
 	    ("group-size", po::value<int>(&op.group_size)->default_value(op.group_size), "Size of group for grouped policy.")
+	    ("spatial-loops", po::value< bool >(&op.spatial_loops)->default_value(op.spatial_loops)->zero_tokens(), "Use 'spatial' loop generation policy, where the second vertex is randomly chosen among the vertices whose ground truth position (the poses in the input file) is at least --spatial-min-distance and at most --spatial-radius away from the first one, i.e. near enough to look like a plausible place recognition but outside the true overlap. Uses a grid over the positions, so it stays fast on large graphs. Can be combined with --group-loops, not with --local-loops.")
+	    ("spatial-radius", po::value<double>(&op.spatial_radius)->default_value(op.spatial_radius), "Maximum distance between the vertices of a loop for spatial policy.")
+	    ("spatial-min-distance", po::value<double>(&op.spatial_min_distance)->default_value(op.spatial_min_distance), "Minimum distance between the vertices of a loop for spatial policy, vertices nearer than this are considered to truly overlap.")
 	    ("loop-variance-translation", po::value<double>(&op.loop_tr_variance)->default_value(op.loop_tr_variance), "Translation variance for false loops.")
 	    ("loop-variance-rotation", po::value<double>(&op.loop_rot_variance)->default_value(op.loop_rot_variance), "Rotation variance for false loops.")
 	    ("motion-variance-translation", po::value<double>(&op.motion_tr_variance)->default_value(op.motion_tr_variance), "Translation variance for false motions.")
@@ -1285,6 +1467,16 @@ bool parse_options(options& op, int argc, char** argv) {
 
 	op.has_existing_outliers_file = vm.count("previous-outliers") != 0;
 
+	if( op.spatial_loops && op.local_loops ) {
+		cerr << "Can not use both the local and the spatial loop policy!" << endl;
+		return false;
+	}
+
+	if( op.spatial_loops && (op.spatial_radius <= 0 || op.spatial_min_distance < 0 || op.spatial_min_distance > op.spatial_radius) ) {
+		cerr << "Need 0 <= --spatial-min-distance <= --spatial-radius and --spatial-radius > 0!" << endl;
+		return false;
+	}
+
 	if( op.false_motions.empty() && op.false_loops.empty() && op.false_loops_on_inliers.empty() ) {
 		cerr << "You did not ask for any outliers to be generated!" << endl;
 		cerr << desc << endl;
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+# Checks that the faster conversion paths write exactly what the
+# convert_to_*.py scripts write, run with
+#   python -m unittest discover tests
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+here = os.path.dirname(os.path.realpath(__file__))
+scripts = os.path.join(here, "..", "scripts")
+datasets = os.path.join(here, "..", "datasets")
+sys.path.insert(0, scripts)
+
+import graph as G
+import converters
+import benchmark
+import incremental
+
+def read(path):
+	with open(path, 'rb') as f:
+		return f.read()
+
+class ConversionPaths(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp(prefix="conversion_paths_")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def dataset(self, name):
+		path = os.path.join(datasets, name, "data.g2o")
+		with open(path, 'r') as f:
+			return (path, G.readg2o(f))
+
+	def outliers(self, base, name, n, seed=0):
+		path = os.path.join(self.dir, name + ".outliers")
+		with open(path, 'w') as f:
+			benchmark.write_random_outliers(base, f, n, seed=seed)
+		return path
+
+	# output of the standalone script of format fmt
+	def script(self, fmt, input_path, outliers_path, name, args):
+		output = os.path.join(self.dir, name + ".script.g2o")
+		with open(os.devnull, 'w') as devnull:
+			subprocess.check_call([sys.executable, os.path.join(scripts, "convert_to_%s.py" % fmt), input_path, outliers_path, output] + args, stdout=devnull)
+		return read(output)
+
+	def in_process(self, fmt, base, outliers_path, name, **prepare_options):
+		output = os.path.join(self.dir, name + ".in_process.g2o")
+		converters.convert(base, outliers_path, output, fmt, {}, **prepare_options)
+		return read(output)
+
+	def test_bfs_init_same_as_script(self):
+		for (dataset, formats) in [("ring", sorted(converters.formats.keys())), ("sphere2500", ["switchable"])]:
+			(input_path, base) = self.dataset(dataset)
+			outliers_path = self.outliers(base, dataset, 100)
+			for fmt in formats:
+				name = "%s-%s" % (dataset, fmt)
+				self.assertEqual(self.script(fmt, input_path, outliers_path, name, ["--bfs-init"]), self.in_process(fmt, base, outliers_path, name, do_bfs=True), name)
+
+	# outlier files that extend each other, the first with the first 10 blocks
+	# of a file of n outliers, the next with 50 blocks and so on
+	def chain(self, base, name, n, sizes):
+		with open(self.outliers(base, name, n), 'r') as f:
+			blocks = incremental.split_blocks(base, f.read())
+		paths = []
+		for size in sizes:
+			path = os.path.join(self.dir, "%s-%04d.outliers" % (name, size))
+			with open(path, 'w') as f:
+				f.write("".join([ text for (key, text, has_inlier) in blocks[:size] ]))
+			paths.append(path)
+		return paths
+
+	def test_incremental_bfs_init_same_as_script(self):
+		(input_path, base) = self.dataset("sphere2500")
+		formats = ["switchable", "hypermog"]
+		converter = incremental.IncrementalConverter(base, [ (fmt, {}) for fmt in formats ], do_bfs=True)
+		for path in self.chain(base, "sphere2500", 300, [10, 50, 100, 200]):
+			name = os.path.splitext(os.path.basename(path))[0]
+			outputs = [ os.path.join(self.dir, "%s-%s.incremental.g2o" % (name, fmt)) for fmt in formats ]
+			converter.convert(path, outputs)
+			for (fmt, output) in zip(formats, outputs):
+				self.assertEqual(self.script(fmt, input_path, path, "%s-%s" % (name, fmt), ["--bfs-init"]), read(output), "%s-%s" % (name, fmt))
+		self.assertEqual(converter.extended, 3)
+
+	# worker for convert_many.py that runs the convert_to_*.py script with the
+	# python running the tests (the scripts start /usr/bin/python)
+	def worker(self, fmt):
+		script = "convert_to_%s.py" % fmt
+		path = os.path.join(self.dir, "workers", script)
+		if not os.path.exists(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		with open(path, 'w') as f:
+			f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, os.path.join(scripts, script)))
+		os.chmod(path, 0o755)
+		return path
+
+	# outputs of convert_many.py by file name
+	def convert_many(self, worker, input_path, outliers, name, args):
+		output_dir = os.path.join(self.dir, name)
+		with open(os.devnull, 'w') as devnull:
+			subprocess.check_call([sys.executable, os.path.join(scripts, "convert_many.py"), worker, input_path] + outliers + ["--output-dir", output_dir] + args, stdout=devnull)
+		return dict([ (f, read(os.path.join(output_dir, f))) for f in os.listdir(output_dir) ])
+
+	def test_convert_many_jobs_same_as_script(self):
+		(input_path, base) = self.dataset("sphere2500")
+		outliers = [ self.outliers(base, "sphere2500-%d" % seed, 100, seed=seed) for seed in range(4) ]
+		scripts_outputs = self.convert_many(self.worker("switchable"), input_path, outliers, "jobs1", ["--jobs", "1", "--bfs-init"])
+		self.assertEqual(len(scripts_outputs), len(outliers))
+		in_process = self.convert_many(os.path.join(scripts, "convert_to_switchable.py"), input_path, outliers, "jobs3", ["--jobs", "3", "--in-process", "--bfs-init"])
+		self.assertEqual(sorted(scripts_outputs.keys()), sorted(in_process.keys()))
+		for f in scripts_outputs:
+			self.assertEqual(scripts_outputs[f], in_process[f], f)
+
+	def test_copies_keep_order(self):
+		(input_path, base) = self.dataset("sphere2500")
+		g = G.Graph(base)
+		g.readExtraOutliers(open(self.outliers(base, "sphere2500", 100)))
+		copy = G.Graph(g)
+		self.assertEqual(copy.edge_keys, g.edge_keys)
+		self.assertEqual(list(copy.E.keys()), list(g.E.keys()))
+		self.assertEqual(list(copy.V.keys()), list(g.V.keys()))
+
+if __name__ == "__main__":
+	unittest.main()